@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+A pure Python reader for aprx files, for use without arcpy (e.g. on Linux build servers).
+
+An aprx is a zip of CIM JSON documents (ArcGIS Pro 3.0 and later). This module reads the maps and layers straight
+from the zip, and wraps them in small classes that mimic the parts of arcpy.mp used by summarise_aprx, i.e.
+ArcGISProject.listMaps(), Map.listLayers() and the Layer properties, so the same get_lyr_stats works on both.
+
+Only what's needed for the summary is supported, older XML based aprx files are not.
+"""
+import os
+import json
+import zipfile
+
+
+class CimObject(dict):
+    """A CIM JSON object, with attribute access to its keys like the arcpy.cim classes."""
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class ArcGISProject(object):
+    """Read-only stand-in for arcpy.mp.ArcGISProject."""
+    def __init__(self, aprx_path):
+        self.filePath = os.path.abspath(aprx_path)
+        self.homeFolder = os.path.dirname(self.filePath)
+        self._zip = zipfile.ZipFile(aprx_path)
+        self._members = dict((n.lower(), n) for n in self._zip.namelist())
+        self._docs = {}
+        if not any(n.endswith('.json') for n in self._members):
+            raise ValueError("{} has no CIM JSON documents, only aprx files from ArcGIS Pro 3.0 or later "
+                             "are supported".format(aprx_path))
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get_cim(self, uri):
+        """Get a CIM document by its CIMPATH uri (or zip member name), parsed only once."""
+        member = uri.split('=', 1)[1] if uri.upper().startswith('CIMPATH=') else uri
+        member = self._members.get(member.lower())
+        if member is None:
+            return None
+        if member not in self._docs:
+            self._docs[member] = json.loads(self._zip.read(member).decode('utf-8-sig'), object_hook=CimObject)
+        return self._docs[member]
+
+    def listMaps(self, wildcard=None):
+        # Use the project item order if possible, otherwise any CIMMap in the zip
+        uris = []
+        proj = self.get_cim('GISProject.json')
+        if proj:
+            uris = [item.get('catalogPath', '') for item in proj.get('projectItems', [])
+                    if item.get('itemType') == 'Map']
+        if not uris:
+            uris = sorted(n for n in self._members.values() if n.lower().endswith('.json'))
+        maps = []
+        for uri in uris:
+            cim = self.get_cim(uri)
+            if cim and cim.get('type') == 'CIMMap':
+                maps.append(Map(self, cim))
+        return maps
+
+
+class Map(object):
+    def __init__(self, project, cim):
+        self._project = project
+        self._cim = cim
+        self.name = cim.get('name', '')
+
+    def getDefinition(self, cim_version):
+        return self._cim
+
+    def listLayers(self, wildcard=None):
+        """All layers, depth first (group layers before their sub layers), like arcpy."""
+        layers = []
+        self._add_layers(self._cim.get('layers', []), '', layers)
+        return layers
+
+    def _add_layers(self, uris, prefix, layers):
+        for uri in uris:
+            cim = self._project.get_cim(uri)
+            if cim is None:
+                continue
+            lyr = Layer(self._project, cim, prefix)
+            layers.append(lyr)
+            if lyr.isGroupLayer:
+                self._add_layers(cim.get('layers', []), lyr.longName + '\\', layers)
+
+
+class Layer(object):
+    """Read-only stand-in for arcpy.mp.Layer. Properties that don't apply to the layer raise AttributeError."""
+    def __init__(self, project, cim, prefix=''):
+        self._project = project
+        self._cim = cim
+        self.name = cim.get('name', '')
+        self.longName = prefix + self.name
+
+    @property
+    def isGroupLayer(self):
+        return self._cim.get('type') == 'CIMGroupLayer'
+
+    @property
+    def isFeatureLayer(self):
+        return self._cim.get('type') == 'CIMFeatureLayer'
+
+    @property
+    def visible(self):
+        return bool(self._cim.get('visibility', False))
+
+    @property
+    def transparency(self):
+        return self._cim.get('transparency', 0)
+
+    @property
+    def minThreshold(self):
+        return self._cim.get('minScale', 0)
+
+    @property
+    def maxThreshold(self):
+        return self._cim.get('maxScale', 0)
+
+    @property
+    def definitionQuery(self):
+        table = self._cim.get('featureTable') or {}
+        return table.get('definitionExpression') or ''
+
+    @property
+    def dataSource(self):
+        table = self._cim.get('featureTable') or {}
+        conn = table.get('dataConnection') or self._cim.get('dataConnection')
+        if not conn:
+            raise AttributeError('dataSource')
+        return data_source(conn, self._project.homeFolder)
+
+    def getDefinition(self, cim_version):
+        return self._cim
+
+
+def data_source(conn, home_folder=''):
+    """Make a data source path like arcpy's Layer.dataSource from a CIM data connection."""
+    # Joins and relates: the source is the table being joined to
+    while conn.get('type') == 'CIMRelQueryTableDataConnection' and conn.get('sourceTable'):
+        conn = conn['sourceTable']
+    props = dict(p.split('=', 1) for p in conn.get('workspaceConnectionString', '').split(';') if '=' in p)
+    parts = [conn.get('featureDataset'), conn.get('dataset')]
+    if 'DATABASE' in props and conn.get('workspaceFactory') != 'SDE':  # file based
+        db = props['DATABASE']
+        if not os.path.isabs(db) and not db.startswith('\\\\'):  # relative to the aprx
+            db = os.path.normpath(os.path.join(home_folder, db.replace('\\', os.sep)))
+        return os.sep.join([db] + [p for p in parts if p])
+    # Enterprise geodatabases etc.: the connection properties, without passwords
+    conn_str = ';'.join('{}={}'.format(k, v) for (k, v) in props.items() if 'PASSWORD' not in k.upper())
+    return os.sep.join([p for p in [conn_str] + parts if p])
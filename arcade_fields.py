@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+The fields and classes used by the symbology of aprx layers, for the "Visualisation attributes" column.
+
+Arcade expressions are tokenized (strings, template literals, comments and all), and the fields are taken from every
+way of getting at them: $feature.name, $feature["name"], $feature['name'], and the field name arguments of Expects,
+DomainName and DomainCode. Many layers share the same expression, so the fields are memoised by expression text.
+
+The class values come from the renderer: the values of unique value renderers and the upper bounds of class breaks
+renderers. Renderers are CIM objects as given by arcpy's getDefinition or aprx_cim.
+"""
+import re
+import functools
+
+_TOKEN_RE = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<template>`(?:[^`\\]|\\.)*`)
+  | (?P<name>\$?[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+)
+  | (?P<punct>.)
+''', re.VERBOSE | re.DOTALL)
+
+# Functions taking $feature and then field names: name -> the argument positions of the field names (None: all)
+FIELD_FUNCTIONS = {'expects': None, 'domainname': (1,), 'domaincode': (1,)}
+
+
+def tokenize(expr):
+    """Yield the (kind, text) tokens of an Arcade expression. Template literals are given as the tokens of their
+    ${...} parts, and comments and white space are left out."""
+    for m in _TOKEN_RE.finditer(expr):
+        kind = m.lastgroup
+        if kind in ('space', 'comment'):
+            continue
+        if kind == 'template':
+            for part in _template_parts(m.group()[1:-1]):
+                for tok in tokenize(part):
+                    yield tok
+            continue
+        yield (kind, m.group())
+
+
+def _template_parts(text):
+    """The expressions in the ${...} parts of a template literal."""
+    parts = []
+    pos = text.find('${')
+    while pos >= 0:
+        (depth, end) = (1, pos + 2)
+        while end < len(text) and depth:
+            depth += {'{': 1, '}': -1}.get(text[end], 0)
+            end += 1
+        parts.append(text[pos + 2:end - 1])
+        pos = text.find('${', end)
+    return parts
+
+
+def _unquote(text):
+    return re.sub(r'\\(.)', r'\1', text[1:-1])
+
+
+@functools.lru_cache(maxsize=4096)
+def expression_fields(expr):
+    """The names of the fields an Arcade expression reads, in order of first use."""
+    toks = list(tokenize(expr or ''))
+    fields = []
+    for (n, (kind, text)) in enumerate(toks):
+        found = []
+        if kind == 'name' and text.lower() == '$feature':
+            nxt = toks[n + 1:n + 4]
+            if len(nxt) >= 2 and nxt[0][1] == '.' and nxt[1][0] == 'name':
+                found.append(nxt[1][1])
+            elif len(nxt) == 3 and nxt[0][1] == '[' and nxt[1][0] == 'string' and nxt[2][1] == ']':
+                found.append(_unquote(nxt[1][1]))
+        elif kind == 'name' and text.lower() in FIELD_FUNCTIONS and n + 1 < len(toks) and toks[n + 1][1] == '(':
+            found = _function_fields(toks, n + 2, FIELD_FUNCTIONS[text.lower()])
+        for name in found:
+            if name not in fields:
+                fields.append(name)
+    return tuple(fields)
+
+
+def _function_fields(toks, start, positions):
+    """The string arguments at the given positions (all but the first, for None) of a call starting at start."""
+    (args, depth, arg) = ([], 0, [])
+    for (kind, text) in toks[start:]:
+        if text in '([{':
+            depth += 1
+        elif text in ')]}':
+            if not depth:
+                break
+            depth -= 1
+        if text == ',' and not depth:
+            args.append(arg)
+            arg = []
+        else:
+            arg.append((kind, text))
+    args.append(arg)
+    wanted = range(1, len(args)) if positions is None else positions
+    return [_unquote(args[i][0][1]) for i in wanted
+            if i < len(args) and len(args[i]) == 1 and args[i][0][0] == 'string']
+
+
+def renderer_fields(renderer):
+    """("Standard", fields) for renderers on fields, ("Custom", fields) for Arcade expressions, or None."""
+    fields = _get(renderer, 'fields') or ([_get(renderer, 'field')] if _get(renderer, 'field') else [])
+    if fields:
+        return ('Standard', list(fields))
+    expr_info = _get(renderer, 'valueExpressionInfo')
+    expr = _get(expr_info, 'expression') if expr_info else None
+    if expr:
+        return ('Custom', list(expression_fields(expr)))
+    return None
+
+
+def renderer_classes(renderer):
+    """The class values of a unique value renderer (multi-field values joined with commas), or the upper bounds of a
+    class breaks renderer."""
+    values = []
+    for group in _get(renderer, 'groups') or []:
+        for cls in _get(group, 'classes') or []:
+            for value in _get(cls, 'values') or []:
+                values.append(','.join('{}'.format(v) for v in (_get(value, 'fieldValues') or [])))
+    for brk in _get(renderer, 'breaks') or []:
+        if _get(brk, 'upperBound') is not None:
+            values.append('{:g}'.format(_get(brk, 'upperBound')))
+    return values
+
+
+def _get(obj, name):
+    """An attribute of a CIM object (arcpy.cim object or aprx_cim.CimObject), or None."""
+    if isinstance(obj, dict):  # CimObject, whose "values" would be dict.values as an attribute
+        return obj.get(name)
+    return getattr(obj, name, None)
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Generators for synthetic map files and aprx files, for the benchmarks.
+
+The map files have a given number of layers spread over groups, with PostGIS and shape file data, METADATA blocks of
+a given size, SCALETOKENs on some of the layers, CLASS/STYLE blocks for the readers to skip, and optionally INCLUDEs
+and a BOM. The aprx files are zips of CIM JSON, as read by aprx_cim.
+
+Usage: python benchmarks/generate.py OUTPUT_FOLDER [--layers N] ..., see --help.
+"""
+import io
+import os
+import json
+import codecs
+import random
+import zipfile
+import argparse
+
+
+def make_mapfile(path, layers=1000, groups=20, token_sets=3, token_every=4, metadata_size=5, includes=0, bom=False,
+                 seed=1):
+    """Write a synthetic map file with the given number of layers to path, and return path.
+
+    token_sets is the number of distinct SCALETOKEN sets (0 for none), used by every token_every'th layer.
+    With includes > 0, that many layers go in a fragment file next to the map file, included from it.
+    """
+    rnd = random.Random(seed)
+    tokens = [_scaletoken(n, rnd) for n in range(token_sets)]
+    main_lyrs = []
+    inc_lyrs = []
+    for n in range(layers):
+        lyr = _layer(n, groups, tokens if token_sets and not n % token_every else None, metadata_size, rnd)
+        (inc_lyrs if n < includes else main_lyrs).append(lyr)
+
+    lines = ['MAP', '  NAME "synthetic"', '  EXTENT 440000 6040000 900000 6410000',
+             '  WEB', '    METADATA', '      "wms_title" "Synthetic"', '    END', '  END']
+    if inc_lyrs:
+        inc_name = os.path.splitext(os.path.basename(path))[0] + '_layers.inc'
+        with io.open(os.path.join(os.path.dirname(path) or '.', inc_name), 'w', encoding='utf-8') as f:
+            f.write('\n'.join(inc_lyrs) + '\n')
+        lines.append('  INCLUDE "{}"'.format(inc_name))
+    lines.extend(main_lyrs)
+    lines.append('END')
+
+    with open(path, 'wb') as f:
+        if bom:
+            f.write(codecs.BOM_UTF8)
+        f.write(('\n'.join(lines) + '\n').encode('utf-8'))
+    return path
+
+
+def _scaletoken(n, rnd):
+    scales = [0] + sorted(rnd.sample(range(1000, 200000, 1000), 3))
+    values = '\n'.join('        "{}" "t{}_{}"'.format(s, n, i) for (i, s) in enumerate(scales))
+    return ('%lvl{}%'.format(n),
+            '    SCALETOKEN\n      NAME "%lvl{}%"\n      VALUES\n{}\n      END\n    END'.format(n, values))
+
+
+def _layer(n, groups, tokens, metadata_size, rnd):
+    lines = ['  LAYER', '    NAME "layer_{}"'.format(n), '    GROUP "group_{}"'.format(n % groups),
+             '    STATUS {}'.format(rnd.choice(['ON', 'OFF', 'DEFAULT'])), '    TYPE POLYGON']
+    if rnd.random() < 0.7:
+        lines.extend(['    MINSCALEDENOM {}'.format(rnd.choice([0, 1000, 5000])),
+                      '    MAXSCALEDENOM {}'.format(rnd.choice([25000, 100000, 500000]))])
+    if tokens:
+        (name, block) = tokens[n % len(tokens)]
+        table = 'schema_{}.table_{}'.format(n % 7, name)
+    else:
+        (name, block) = (None, None)
+        table = 'schema_{}.table_{}'.format(n % 7, n)
+    if n % 5:
+        lines.extend(['    CONNECTIONTYPE POSTGIS',
+                      '    CONNECTION "host=db{} dbname=geo user=reader password=secret"'.format(n % 3),
+                      '    DATA "geometri from (select * from {}) as foo using unique gid using srid=25832"'.format(table)])
+    else:
+        lines.append('    DATA "/data/shapes/layer_{}.shp"'.format(n))
+    lines.extend(['    METADATA', '      "wms_title" "Layer {} æøå"'.format(n),
+                  '      "wms_abstract" "{}"'.format(' '.join(['Abstract text'] * 10)),
+                  '      "wms_group_title" "Group {}"'.format(n % groups)])
+    lines.extend('      "extra_{}" "value {}"'.format(i, i) for i in range(metadata_size))
+    lines.append('    END')
+    if block:
+        lines.append(block)
+    lines.extend(['    CLASS', '      NAME "class"', '      EXPRESSION ([type] = {})'.format(n % 10),
+                  '      STYLE', '        COLOR 255 0 0', '        OUTLINECOLOR 0 0 0', '      END',
+                  '      LABEL', '        TEXT "[name]"', '        SIZE 8', '      END', '    END', '  END'])
+    return '\n'.join(lines)
+
+
+def make_aprx(path, maps=2, layers=1000, groups=20, seed=1):
+    """Write a synthetic aprx (a zip of CIM JSON, ArcGIS Pro 3.0+ style) with layers spread over maps, return path."""
+    rnd = random.Random(seed)
+    docs = {}
+    items = []
+    for m in range(maps):
+        map_dir = 'map{}'.format(m)
+        grp_uris = []
+        for g in range(groups):
+            uri = '{}/group_{}.json'.format(map_dir, g)
+            docs[uri] = {'type': 'CIMGroupLayer', 'name': 'Group {}'.format(g), 'visibility': True, 'layers': []}
+            grp_uris.append(uri)
+        for n in range(layers // maps):
+            uri = '{}/layer_{}.json'.format(map_dir, n)
+            docs[uri] = _cim_layer(n, rnd)
+            docs[grp_uris[n % groups]]['layers'].append('CIMPATH=' + uri)
+        docs['{}/{}.json'.format(map_dir, map_dir)] = {'type': 'CIMMap', 'name': 'Map {}'.format(m),
+                                                       'layers': ['CIMPATH=' + u for u in grp_uris]}
+        items.append({'type': 'CIMProjectItem', 'name': 'Map {}'.format(m), 'itemType': 'Map',
+                      'catalogPath': 'CIMPATH={}/{}.json'.format(map_dir, map_dir)})
+    docs['GISProject.json'] = {'type': 'CIMGISProject', 'projectItems': items}
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        for (uri, doc) in docs.items():
+            z.writestr(uri, json.dumps(doc))
+    return path
+
+
+def _cim_layer(n, rnd):
+    if n % 3:
+        conn = {'type': 'CIMStandardDataConnection', 'workspaceFactory': 'SDE', 'dataset': 'geo.s{}.t{}'.format(n % 7, n),
+                'workspaceConnectionString': 'ENCRYPTED_PASSWORD=xx;SERVER=db;DATABASE=geo;USER=reader'}
+    else:
+        conn = {'type': 'CIMStandardDataConnection', 'workspaceFactory': 'FileGDB', 'dataset': 'fc_{}'.format(n),
+                'workspaceConnectionString': 'DATABASE=..\\data\\data_{}.gdb'.format(n % 4)}
+    if n % 2:
+        renderer = {'type': 'CIMUniqueValueRenderer', 'fields': ['TYPE', 'KLASSE']}
+    else:
+        renderer = {'type': 'CIMUniqueValueRenderer', 'fields': [],
+                    'valueExpressionInfo': {'expression': 'return $feature.vejtype + " " + $feature.Kl;'}}
+    return {'type': 'CIMFeatureLayer', 'name': 'Layer {}'.format(n), 'visibility': rnd.random() < 0.5,
+            'transparency': rnd.choice([0, 20, 50]), 'minScale': rnd.choice([0, 50000, 250000]),
+            'maxScale': rnd.choice([0, 500, 1000]), 'renderer': renderer,
+            'featureTable': {'type': 'CIMFeatureTable', 'definitionExpression': 'gid > {}'.format(n),
+                             'dataConnection': conn}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic map file and aprx for benchmarking.")
+    parser.add_argument('folder')
+    parser.add_argument('--layers', type=int, default=10000)
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--token-sets', type=int, default=3, help="distinct SCALETOKEN sets, 0 for none")
+    parser.add_argument('--metadata-size', type=int, default=5, help="extra METADATA entries per layer")
+    parser.add_argument('--includes', type=int, default=0, help="number of layers to put in an INCLUDEd file")
+    parser.add_argument('--bom', action='store_true', help="start the map file with a UTF-8 BOM")
+    parser.add_argument('--maps', type=int, default=2, help="number of maps in the aprx")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.folder):
+        os.makedirs(args.folder)
+    print(make_mapfile(os.path.join(args.folder, 'synthetic.map'), args.layers, args.groups, args.token_sets,
+                       metadata_size=args.metadata_size, includes=args.includes, bom=args.bom))
+    print(make_aprx(os.path.join(args.folder, 'synthetic.aprx'), args.maps, args.layers, args.groups))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks for the summarisers: wall time and peak memory per stage, on synthetic inputs from generate.py.
+
+Each stage is timed repeat times (the best time is reported), and run once more under tracemalloc for the peak
+memory it allocates. The results can be saved as JSON, and compared with a saved baseline to catch regressions:
+
+    python benchmarks/run_benchmarks.py --layers 10000 --json baseline.json
+    python benchmarks/run_benchmarks.py --layers 10000 --compare baseline.json
+
+With --compare, the exit code is 1 if any stage got slower or bigger than the tolerance allows. A baseline made
+from other inputs (--layers, --groups and so on) isn't compared with. The map file stages are run with both
+readers, fast and mappyfile.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import tracemalloc
+import collections
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # the summarisers aren't a package
+
+import generate
+import mapfile_preprocess
+import scale_tokens
+import output_writers
+import summarise_mapfile
+import summarise_aprx
+from office_utils import OfficeUtils
+
+STAGES = collections.OrderedDict()  # name -> function(ctx)
+MAPFILE_ENGINES = ('fast', 'mappyfile')
+INPUT_ARGS = ('layers', 'groups', 'token_sets', 'metadata_size', 'includes', 'bom', 'maps')  # what the inputs are
+
+
+def stage(name):
+    def register(func):
+        STAGES[name] = func
+        return func
+    return register
+
+
+@stage('preprocess')
+def _preprocess(ctx):
+    mapfile_preprocess.clear_fragment_cache()
+    mapfile_preprocess.preprocess(ctx['mapfile'], drop_includes=not ctx['includes'])
+
+
+@stage('parse (mappyfile)')
+def _parse_mappyfile(ctx):
+    summarise_mapfile.read_layers(ctx['text'], 'mappyfile')
+
+
+@stage('parse (fast)')
+def _parse_fast(ctx):
+    summarise_mapfile.read_layers(ctx['text'], 'fast')
+
+
+def _lyr_stats_stage(engine, split_scale_lyrs):
+    def run(ctx):
+        summarise_mapfile.get_lyr_stats(ctx['mapfile'], split_scale_lyrs, engine, ctx['text'])
+    return run
+
+
+for _engine in MAPFILE_ENGINES:
+    stage('get_lyr_stats ({})'.format(_engine))(_lyr_stats_stage(_engine, False))
+    stage('get_lyr_stats ({}, split scale)'.format(_engine))(_lyr_stats_stage(_engine, True))
+
+
+@stage('token expansion')
+def _token_expansion(ctx):
+    scale_tokens._compile.cache_clear()
+    for (tokens, data) in ctx['tokenised']:
+        compiled = scale_tokens.compile_tokens(tokens)
+        for row in compiled.expand(data):
+            pass
+
+
+@stage('write xlsx (OfficeUtils)')
+def _write_xlsx(ctx):
+    keys = [k for (k, heading) in summarise_mapfile.COLUMNS]
+    OfficeUtils.iters2xlsx([(None, (rec.row(keys) for rec in ctx['records']))], ctx['out'] + '.xlsx',
+                           [heading for (k, heading) in summarise_mapfile.COLUMNS])
+
+
+@stage('write csv')
+def _write_csv(ctx):
+    output_writers.write_tables(ctx['out'] + '.csv', summarise_mapfile.COLUMNS, [(None, ctx['records'])])
+
+
+@stage('write parquet')
+def _write_parquet(ctx):
+    output_writers.write_tables(ctx['out'] + '.parquet', summarise_mapfile.COLUMNS, [(None, ctx['records'])])
+
+
+def _end_to_end_mapfile_stage(engine):
+    def run(ctx):
+        mapfile_preprocess.clear_fragment_cache()
+        summarise_mapfile.main(ctx['mapfile'], ctx['out'] + '_map.xlsx', drop_includes=not ctx['includes'],
+                               engine=engine, cache=False)
+    return run
+
+
+for _engine in MAPFILE_ENGINES:
+    stage('end-to-end map file ({})'.format(_engine))(_end_to_end_mapfile_stage(_engine))
+
+
+@stage('end-to-end aprx (cim)')
+def _end_to_end_aprx(ctx):
+    summarise_aprx.summarise_aprx(ctx['aprx'], ctx['out'] + '_aprx.xlsx', cache=False, engine='cim')
+
+
+def measure(func, ctx, repeat=3):
+    """Best wall time in seconds over repeat runs, and the peak traced memory in bytes of one more run."""
+    times = []
+    for n in range(repeat):
+        t0 = time.perf_counter()
+        func(ctx)
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        func(ctx)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def prepare(folder, args):
+    """Generate the inputs, and read what the stages that don't start from the file need."""
+    ctx = {'includes': args.includes, 'out': os.path.join(folder, 'out')}
+    ctx['mapfile'] = generate.make_mapfile(os.path.join(folder, 'synthetic.map'), args.layers, args.groups,
+                                           args.token_sets, metadata_size=args.metadata_size,
+                                           includes=args.includes, bom=args.bom)
+    ctx['aprx'] = generate.make_aprx(os.path.join(folder, 'synthetic.aprx'), args.maps, args.layers, args.groups)
+    ctx['text'] = mapfile_preprocess.preprocess(ctx['mapfile'], drop_includes=not args.includes)
+    layers = summarise_mapfile.read_layers(ctx['text'], 'fast')
+    ctx['tokenised'] = [(lyr['scaletokens'], lyr.get('data', '')) for lyr in layers if lyr['scaletokens']]
+    ctx['records'] = summarise_mapfile.get_lyr_stats(ctx['mapfile'], False, 'fast', ctx['text'])
+    return ctx
+
+
+def compare(results, baseline, tolerance):
+    """List the stages that are more than tolerance (a fraction) slower or bigger than in baseline."""
+    regressions = []
+    for (name, res) in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for key in ('seconds', 'peak_bytes'):
+            if base[key] and res[key] > base[key] * (1 + tolerance):
+                regressions.append((name, key, base[key], res[key]))
+    return regressions
+
+
+def _quiet(msg, severity=0):
+    pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--layers', type=int, default=10000)
+    parser.add_argument('--groups', type=int, default=20)
+    parser.add_argument('--token-sets', type=int, default=3)
+    parser.add_argument('--metadata-size', type=int, default=5)
+    parser.add_argument('--includes', type=int, default=0)
+    parser.add_argument('--bom', action='store_true')
+    parser.add_argument('--maps', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stages', nargs='+', metavar='STAGE',
+                        help="only run the stages whose names contain one of these, e.g. parse write")
+    parser.add_argument('--json', help="save the results to this file")
+    parser.add_argument('--compare', help="compare with results saved with --json")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown for --compare (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        changed = ['--{} {} (not {})'.format(k.replace('_', '-'), baseline['args'].get(k), getattr(args, k))
+                   for k in INPUT_ARGS if baseline['args'].get(k) != getattr(args, k)]
+        if changed:
+            parser.error("{} was recorded with other inputs: {}".format(args.compare, ', '.join(changed)))
+
+    summarise_mapfile.set_msg = _quiet
+    summarise_aprx.set_msg = _quiet
+
+    folder = tempfile.mkdtemp(prefix='summarise_bench_')
+    try:
+        ctx = prepare(folder, args)
+        print("{} layers, {} map file bytes, python {}".format(args.layers, os.path.getsize(ctx['mapfile']),
+                                                              sys.version.split()[0]))
+        print("{:<40} {:>10} {:>12}".format('stage', 'seconds', 'peak MB'))
+        results = collections.OrderedDict()
+        for (name, func) in STAGES.items():
+            if args.stages and not any(s in name for s in args.stages):
+                continue
+            try:
+                (seconds, peak) = measure(func, ctx, args.repeat)
+            except ImportError as e:  # e.g. no pyarrow or mappyfile
+                print("{:<40} skipped: {}".format(name, e))
+                continue
+            results[name] = {'seconds': seconds, 'peak_bytes': peak}
+            print("{:<40} {:>10.3f} {:>12.1f}".format(name, seconds, peak / 1e6))
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+    if args.compare:
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for (name, key, before, after) in regressions:
+            print("REGRESSION {}: {} {:.4g} -> {:.4g}".format(name, key, before, after))
+        if regressions:
+            sys.exit(1)
+        print("No regressions against {}.".format(args.compare))
+
+
+if __name__ == "__main__":
+    main()
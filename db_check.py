@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+Checking that the tables the PostGIS layers of a map file read from exist, for the check_tables option of
+summarise_mapfile.
+
+The layers are grouped by connection string (normalised, so the same database written two ways is one), one pooled
+connection is opened per distinct database, and all the schema.table names referenced by its layers are looked up
+in one catalogue query. The connections are kept for the rest of the process, so a batch worker reuses them from
+map file to map file. The result goes in the records' data_ok column, as for check_paths in the other summarisers.
+
+The database access is behind the Backend interface: PostgresBackend (psycopg2, or psycopg 3) for real use, and
+SQLiteBackend as a local stand-in, with a SQLite file per database name.
+"""
+import os
+import re
+import atexit
+import itertools
+import collections
+
+import instrument
+from path_check import OK, MISSING, ERROR
+
+_TABLE_RE = re.compile(r'\b(?:from|join)\s+((?:"[^"]+"|[\w\[\];]+)(?:\.(?:"[^"]+"|[\w\[\];]+))?)', re.IGNORECASE)
+_ALTERNATIVES_RE = re.compile(r'\[([^\]]*)\]')
+_BARE_TABLE_RE = re.compile(r'^\s*((?:"[^"]+"|[\w\[\];]+)(?:\.(?:"[^"]+"|[\w\[\];]+))?)\s*$')
+_SCALE_TOKEN_RE = re.compile(r'%\w+%')
+_SUBQUERY_RE = re.compile(r'\s*(?:select|with)\b', re.IGNORECASE)
+_CALL_RE = re.compile(r'\s*\(')
+
+
+class Backend(object):
+    """How to connect to a database and look up tables in it."""
+    Error = Exception  # what connect and existing raise when the database can't be used
+
+    def connect(self, conninfo):
+        raise NotImplementedError
+
+    def existing(self, con, names):
+        """The subset of the (schema.)table names that exist in the database."""
+        raise NotImplementedError
+
+    def close(self, con):
+        con.close()
+
+
+class PostgresBackend(Backend):
+    def __init__(self, connect_timeout=10):
+        try:
+            import psycopg2 as driver
+        except ImportError:
+            import psycopg as driver  # psycopg 3
+        self.driver = driver
+        self.Error = driver.Error
+        self.connect_timeout = connect_timeout
+
+    def connect(self, conninfo):
+        con = self.driver.connect(conninfo, connect_timeout=self.connect_timeout)
+        con.autocommit = True
+        return con
+
+    def existing(self, con, names):
+        # to_regclass follows the search_path for unqualified names, and gives NULL for missing ones
+        cur = con.cursor()
+        try:
+            cur.execute('SELECT n FROM unnest(%s::text[]) AS n WHERE to_regclass(n) IS NOT NULL', (list(names),))
+            return set(row[0] for row in cur.fetchall())
+        finally:
+            cur.close()
+
+
+class SQLiteBackend(Backend):
+    """A stand-in for trying the checks without a Postgres: the dbname of a connection string is the SQLite file
+    folder/dbname.sqlite, and schema.table is a table named "schema.table" (or just table)."""
+
+    def __init__(self, folder='.'):
+        import sqlite3
+        self.sqlite3 = sqlite3
+        self.Error = sqlite3.Error
+        self.folder = folder
+
+    def connect(self, conninfo):
+        dbname = parse_conninfo(conninfo).get('dbname', 'postgres')
+        path = os.path.join(self.folder, dbname + '.sqlite')
+        if not os.path.isfile(path):
+            raise self.sqlite3.OperationalError("No database {}".format(path))
+        return self.sqlite3.connect(path)
+
+    def existing(self, con, names):
+        tables = set(row[0].lower() for row in
+                     con.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')"))
+        found = set()
+        for n in names:
+            bare = n.replace('"', '').lower()
+            if bare in tables or bare.split('.')[-1] in tables:
+                found.add(n)
+        return found
+
+
+def get_backend(spec=True):
+    """A Backend from a check_tables argument: True or 'postgres' for Postgres, 'sqlite:FOLDER' for the stand-in,
+    or a Backend."""
+    if isinstance(spec, Backend):
+        return spec
+    if spec is True or spec == 'postgres':
+        return PostgresBackend()
+    if spec.startswith('sqlite:'):
+        return SQLiteBackend(spec[len('sqlite:'):] or '.')
+    raise ValueError("Unknown database backend {!r}, use postgres or sqlite:FOLDER".format(spec))
+
+
+def parse_conninfo(conninfo):
+    """The key=value pairs of a libpq connection string (values may be quoted with '')."""
+    pairs = {}
+    for m in re.finditer(r"(\w+)\s*=\s*(?:'((?:[^'\\]|\\.)*)'|(\S*))", conninfo):
+        value = m.group(2).replace("\\'", "'") if m.group(2) is not None else m.group(3)
+        pairs[m.group(1).lower()] = value
+    return pairs
+
+
+def normalise_conninfo(conninfo):
+    """The key used to share a connection: the connection parameters in a fixed order."""
+    return ' '.join('{}={}'.format(k, v) for (k, v) in sorted(parse_conninfo(conninfo).items()))
+
+
+def referenced_tables(data):
+    """The (schema.)table names a layer's DATA reads from, e.g. "geom from (select * from a.b join c on ...) as foo"
+    gives a.b and c, and "geometri from vej.veje using unique gid" gives vej.veje. A bare name (as in a data path
+    with the "geom from" and "using" parts taken off) is the table itself. Summarised scale token alternatives
+    ("a.b_[fine;coarse]") give a name each. The from of a function call (extract(year from dato)) and functions
+    read from (from generate_series(1, 10)) aren't tables. Quoted identifiers are kept quoted, as their case
+    matters to the database."""
+    data = data or ''
+    found = [m.group(1) for m in _TABLE_RE.finditer(data)
+             if not _CALL_RE.match(data, m.end()) and not _in_function_call(data, m.start())]
+    if not found:
+        found = [m.group(1) for m in [_BARE_TABLE_RE.match(data)] if m]
+    names = []
+    for name in found:
+        parts = _ALTERNATIVES_RE.split(name)  # text, alternatives, text, ...
+        choices = [parts[i].split(';') if i % 2 else [parts[i]] for i in range(len(parts))]
+        for combo in itertools.product(*choices):
+            full = ''.join(combo)
+            if full not in names:
+                names.append(full)
+    return names
+
+
+def _in_function_call(data, pos):
+    """Whether pos is inside the parentheses of a function call, as the "from" of extract(year from dato) is,
+    rather than at the top level or in a subquery."""
+    opened = []  # where the text in each open parenthesis starts
+    for m in re.finditer(r'[()]', data[:pos]):
+        if m.group() == '(':
+            opened.append(m.end())
+        elif opened:
+            opened.pop()
+    return bool(opened) and not _SUBQUERY_RE.match(data, opened[-1])
+
+
+class ConnectionPool(object):
+    """One connection per distinct database, opened on first use."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._cons = {}  # normalised conninfo -> connection, or the error connecting
+
+    def existing(self, conninfo, names):
+        """The existing names in a database, trying once more with a fresh connection if a pooled one went stale."""
+        key = normalise_conninfo(conninfo)
+        for attempt in (0, 1):
+            con = self._cons.get(key)
+            if con is None:
+                try:
+                    con = self._cons[key] = self.backend.connect(conninfo)
+                    instrument.count('db_connections')
+                except self.backend.Error as e:
+                    self._cons[key] = e
+                    raise
+            elif isinstance(con, Exception):  # don't keep trying a database that's down
+                raise con
+            try:
+                return self.backend.existing(con, names)
+            except self.backend.Error:
+                del self._cons[key]
+                try:
+                    self.backend.close(con)
+                except self.backend.Error:
+                    pass
+                if attempt:
+                    raise
+
+    def close(self):
+        for con in self._cons.values():
+            if not isinstance(con, Exception):
+                try:
+                    self.backend.close(con)
+                except self.backend.Error:
+                    pass
+        self._cons = {}
+
+
+_pools = {}  # backend spec -> ConnectionPool, kept for the life of the process
+
+
+def get_pool(spec=True):
+    if isinstance(spec, Backend):
+        return ConnectionPool(spec)
+    if spec not in _pools:
+        _pools[spec] = ConnectionPool(get_backend(spec))
+    return _pools[spec]
+
+
+@atexit.register
+def close_pools():
+    for pool in _pools.values():
+        pool.close()
+    _pools.clear()
+
+
+def record_tables(rec):
+    """The tables a layer record reads: from its DATA as written (data_sql), or from its data path if the DATA has
+    scale tokens, as they're filled in (or summarised as alternatives) there."""
+    data = rec.data_sql
+    if not data or data in ('N/A', '-') or _SCALE_TOKEN_RE.search(data):
+        data = rec.data_path
+    return referenced_tables(data)
+
+
+def check_records(lyr_stats, check_tables=True, pool=None):
+    """Set data_ok of the records: OK if all the tables they read exist, "missing: a.b, c" if not, ERROR if the
+    database can't be reached, and '-' for layers that aren't in a database."""
+    pool = pool or get_pool(check_tables)
+    by_db = collections.OrderedDict()  # normalised conninfo -> (conninfo, [(record, table names)])
+    for rec in lyr_stats:
+        names = record_tables(rec) if rec.connection_type == 'POSTGIS' and rec.connection else []
+        if names:
+            by_db.setdefault(normalise_conninfo(rec.connection), (rec.connection, []))[1].append((rec, names))
+        else:
+            rec.data_ok = '-'
+
+    for (conninfo, recs) in by_db.values():
+        wanted = sorted(set(n for (rec, names) in recs for n in names))
+        instrument.count('tables_checked', len(wanted))
+        try:
+            with instrument.span('check tables'):
+                found = pool.existing(conninfo, wanted)
+        except pool.backend.Error:
+            for (rec, names) in recs:
+                rec.data_ok = ERROR
+            continue
+        for (rec, names) in recs:
+            missing = [n for n in names if n not in found]
+            rec.data_ok = '{}: {}'.format(MISSING, ', '.join(missing)) if missing else OK
+    return lyr_stats
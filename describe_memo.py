@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Memoised Describe field lookups for the join detection in summarise_mxd.
+
+arcpy.Describe is slow, and the field names of the layers don't change unless the mxd or the data behind it does, so
+with a path the field names are kept in SQLite between runs, for ttl seconds (a day by default, as changes to a view
+don't change the mxd). The field names are kept per layer, keyed by the content hash of the mxd and the layer's
+position and long name: a join is a property of the layer, not of its data source (lyr.dataSource stays the base
+table when a join is added), so layers on the same source can't share a lookup. Works in both py2 (ArcMap) and py3.
+"""
+import os
+import json
+import time
+import sqlite3
+
+import instrument
+
+DEFAULT_TTL = 24 * 60 * 60
+
+
+def default_memo_path():
+    """The memo file, from $SUMMARISE_DESCRIBE_CACHE or in the user's local app data/cache folder."""
+    if os.environ.get('SUMMARISE_DESCRIBE_CACHE'):
+        return os.environ['SUMMARISE_DESCRIBE_CACHE']
+    base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'summarise_geoproject', 'describe.sqlite')
+
+
+def field_names(describe_func, obj):
+    """The field names of obj (a layer or a data source) from describe_func (e.g. arcpy.Describe)."""
+    return [fld.name for fld in describe_func(obj).fields]
+
+
+def join_tables(names, dataset_name):
+    """The tables other than dataset_name that the qualified ("table.field") field names come from."""
+    tables = set()
+    for name in names:
+        (table, dot, _) = name.partition('.')
+        if dot and table != dataset_name:
+            tables.add(table)
+    return tables
+
+
+class DescribeMemo(object):
+    """Field names per layer, and with persist (True or a path) and scope (the content hash of the mxd) also in SQLite
+    for ttl seconds. Without a scope (e.g. for CURRENT) nothing is kept between runs."""
+
+    def __init__(self, describe_func, persist=None, ttl=DEFAULT_TTL, scope=None):
+        self.describe_func = describe_func
+        self.ttl = ttl
+        self.scope = scope
+        self._fields = {}  # layer key -> field names
+        self._con = None
+        if persist and scope:
+            self._open(default_memo_path() if persist is True else persist)
+
+    def _open(self, path):
+        folder = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:  # a parallel worker got there first
+                pass
+        self._con = sqlite3.connect(path, timeout=30)
+        with self._con:
+            self._con.execute('CREATE TABLE IF NOT EXISTS layer_fields (scope TEXT NOT NULL, key TEXT NOT NULL, '
+                              'names TEXT NOT NULL, stored REAL NOT NULL, PRIMARY KEY (scope, key))')
+            self._con.execute('DELETE FROM layer_fields WHERE stored < ?', (time.time() - self.ttl,))
+        for (key, names) in self._con.execute('SELECT key, names FROM layer_fields WHERE scope = ?', (self.scope,)):
+            self._fields[key] = json.loads(names)
+
+    def fields(self, lyr, key):
+        """The field names of a layer, where key (e.g. "3 Roads\\Main roads") tells the layer apart from the other
+        layers of the mxd. Raises what describe_func raises (for e.g. anno layers)."""
+        names = self._fields.get(key)
+        if names is not None:
+            instrument.count('describe_memo_hits')
+            return names
+        names = field_names(self.describe_func, lyr)
+        self._fields[key] = names
+        if self._con:
+            with self._con:
+                self._con.execute('INSERT OR REPLACE INTO layer_fields (scope, key, names, stored) '
+                                  'VALUES (?, ?, ?, ?)', (self.scope, key, json.dumps(names), time.time()))
+        return names
+
+    def join_tables(self, lyr, key, dataset_name):
+        """The set of joined tables of a layer, see fields for key."""
+        return join_tables(self.fields(lyr, key), dataset_name)
+
+    def close(self):
+        if self._con:
+            self._con.close()
+            self._con = None
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Timings and counters for the summarisers, to see which phase a slow run spends its time in.
+
+The phases are wrapped in named spans, which nest: span('parse') inside span('map file') is recorded as
+"map file/parse". Spans with the same path are aggregated (count, total, max), so a span per layer is cheap, and
+counters (layers, paths checked, rows written...) are added up with count(). Everything goes in one module level
+recorder, which can be exported as JSON with export_json, or reported through a set_msg function. Spans nest per
+thread, so worker threads (e.g. the stages of pipeline) can record spans of their own.
+
+profile() is an opt-in hook that runs cProfile and/or tracemalloc around a block of code.
+
+Progress messages still go through the modules' set_msg, so the messages in the ArcGIS toolbox work as before.
+Works in both py2 (ArcMap) and py3.
+"""
+from __future__ import print_function
+import io
+import json
+import time
+import threading
+import contextlib
+import collections
+
+try:
+    clock = time.perf_counter
+except AttributeError:  # py2
+    clock = time.time
+
+
+class Recorder(object):
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.spans = collections.OrderedDict()  # path -> [count, total seconds, max seconds]
+        self.counters = collections.OrderedDict()
+        self.started = time.time()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def _stack(self):
+        """The names of the open spans of the current thread."""
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    @contextlib.contextmanager
+    def span(self, name):
+        self._stack.append(name)
+        path = '/'.join(self._stack)
+        t0 = clock()
+        try:
+            yield
+        finally:
+            secs = clock() - t0
+            self._stack.pop()
+            with self._lock:
+                stats = self.spans.get(path)
+                if stats is None:
+                    self.spans[path] = [1, secs, secs]
+                else:
+                    stats[0] += 1
+                    stats[1] += secs
+                    stats[2] = max(stats[2], secs)
+
+    def spans_of(self, iterable, name):
+        """Yield the items of iterable, each in a span of its own, i.e. timing the loop body per item."""
+        for item in iterable:
+            with self.span(name):
+                yield item
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self):
+        return {
+            'started': self.started,
+            'spans': collections.OrderedDict((path, {'count': c, 'seconds': total, 'max_seconds': mx})
+                                             for (path, (c, total, mx)) in self.spans.items()),
+            'counters': dict(self.counters),
+        }
+
+    def merge(self, data):
+        """Add the spans and counters from another recorder's to_dict(), e.g. from a worker process,
+        under the current span."""
+        prefix = ''.join(name + '/' for name in self._stack)
+        with self._lock:
+            for (path, stats) in data['spans'].items():
+                path = prefix + path
+                mine = self.spans.setdefault(path, [0, 0.0, 0.0])
+                mine[0] += stats['count']
+                mine[1] += stats['seconds']
+                mine[2] = max(mine[2], stats['max_seconds'])
+        for (name, n) in data['counters'].items():
+            self.count(name, n)
+
+
+recorder = Recorder()
+span = recorder.span
+spans_of = recorder.spans_of
+count = recorder.count
+
+
+def reset():
+    recorder.reset()
+
+
+def snapshot():
+    return recorder.to_dict()
+
+
+def merge(data):
+    recorder.merge(data)
+
+
+def counted(iterable, name):
+    """Pass the items of iterable on, counting them."""
+    n = 0
+    try:
+        for item in iterable:
+            n += 1
+            yield item
+    finally:
+        count(name, n)
+
+
+def export_json(path):
+    with io.open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(snapshot(), indent=2, ensure_ascii=False))
+
+
+def report(set_msg=print):
+    """Report the spans (slowest first) and counters through set_msg."""
+    if recorder.spans:
+        set_msg("Timings (s):")
+        for (path, (c, total, mx)) in sorted(recorder.spans.items(), key=lambda i: -i[1][1]):
+            if c > 1:
+                set_msg("  {:<50} {:>9.3f}  ({} x, max {:.3f})".format(path, total, c, mx))
+            else:
+                set_msg("  {:<50} {:>9.3f}".format(path, total))
+    for (name, n) in recorder.counters.items():
+        set_msg("  {}: {}".format(name, n))
+
+
+@contextlib.contextmanager
+def profile(path=None, memory=False, set_msg=print):
+    """Run cProfile (if path is given, the stats are dumped there for e.g. snakeviz) and/or tracemalloc (memory=True,
+    py3 only) around the block. The memory peak goes in the counters, and the top allocations are reported."""
+    prof = None
+    if path:
+        import cProfile
+        prof = cProfile.Profile()
+    if memory:
+        import tracemalloc
+        tracemalloc.start()
+    if prof:
+        prof.enable()
+    try:
+        yield
+    finally:
+        if prof:
+            prof.disable()
+            prof.dump_stats(path)
+            set_msg("Profile written to {}.".format(path))
+        if memory:
+            count('peak_memory_bytes', tracemalloc.get_traced_memory()[1])
+            top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+            tracemalloc.stop()
+            set_msg("Top memory allocations:")
+            for stat in top:
+                set_msg("  {}".format(stat))
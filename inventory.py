@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+An inventory of the layers of all summarised map files, aprx and mxd files, for questions like "which projects use
+this table" across projects, without opening the output workbooks.
+
+The layers are stored in SQLite with indexes on the normalised data source, the layer name, the group and the scale
+range, and each project's layers are replaced whenever it's summarised (with the inventory option). The data sources
+are normalised (lower case, forward slashes, no passwords, the SQL of map file DATA reduced to what's queried), so a
+table or feature class can be found whichever way it's referred to.
+
+Usage: python inventory.py source vej.veje | layer Veje | group Transport | query "gid >" | scale 25000 | projects,
+see --help.
+"""
+import os
+import re
+import sys
+import time
+import sqlite3
+import argparse
+
+import output_writers
+
+try:
+    text_type = unicode  # py2 (ArcMap)
+except NameError:
+    text_type = str
+
+SCHEMA_VERSION = 1
+OPEN_FROM, OPEN_TO = 0.0, float('inf')  # the scale bounds stored for no limit, so the scale index can be used
+
+LAYER_COLUMNS = ['map', 'layer', 'group_name', 'data_path', 'source', 'data_sql', 'definition_query', 'visible',
+                 'scale_from', 'scale_to']
+
+_PASSWORD_RE = re.compile(r'(password|encrypted_password)\s*=\s*[^\s;]*', re.IGNORECASE)
+_GEOM_FROM_RE = re.compile(r'^\s*\w+\s+from\s+', re.IGNORECASE)
+_USING_RE = re.compile(r'\s+using\s+.*$', re.IGNORECASE | re.DOTALL)
+
+
+def default_inventory_path():
+    """The inventory file, from $SUMMARISE_INVENTORY or in the user's local app data/cache folder."""
+    if os.environ.get('SUMMARISE_INVENTORY'):
+        return os.environ['SUMMARISE_INVENTORY']
+    base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'summarise_geoproject', 'inventory.sqlite')
+
+
+def open_inventory(inventory=True):
+    """Open an Inventory from an inventory argument: True for the default location, a path, or False/None for none."""
+    if not inventory:
+        return None
+    if inventory is True:
+        return Inventory()
+    if isinstance(inventory, Inventory):
+        return inventory
+    return Inventory(inventory)
+
+
+def normalise_source(src):
+    """Normalise a data source for searching: lower case, forward slashes, no passwords, and for map file DATA only
+    the part after "geom from" and before "using"."""
+    if not src:
+        return ''
+    src = _PASSWORD_RE.sub('', src)
+    src = _USING_RE.sub('', _GEOM_FROM_RE.sub('', src))
+    src = src.replace('\\', '/').replace('"', '')
+    return ' '.join(src.lower().split())
+
+
+def record(inventory, project_path, tool, tables):
+    """Replace the layers of a project in the inventory (given as for open_inventory), if any.
+    tables are (map name, layer records) pairs."""
+    inv = open_inventory(inventory)
+    if not inv:
+        return
+    try:
+        inv.record(project_path, tool, tables)
+    finally:
+        if inv is not inventory:
+            inv.close()
+
+
+class Inventory(object):
+    def __init__(self, path=None):
+        self.path = path or default_inventory_path()
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:  # a parallel worker got there first
+                pass
+        self._con = sqlite3.connect(self.path, timeout=30)
+        try:
+            self._con.execute('PRAGMA journal_mode=WAL')
+        except sqlite3.DatabaseError:  # e.g. not supported on network drives
+            pass
+        with self._con:
+            self._con.execute('CREATE TABLE IF NOT EXISTS projects (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, '
+                              'tool TEXT NOT NULL, layers INTEGER NOT NULL, updated REAL NOT NULL)')
+            self._con.execute('CREATE TABLE IF NOT EXISTS layers (project_id INTEGER NOT NULL REFERENCES projects(id), '
+                              'map TEXT, layer TEXT, group_name TEXT, data_path TEXT, source TEXT, data_sql TEXT, '
+                              'definition_query TEXT, visible INTEGER, scale_from REAL, scale_to REAL)')
+            for (name, cols) in [('project', 'project_id'), ('source', 'source'), ('layer', 'layer COLLATE NOCASE'),
+                                 ('group', 'group_name COLLATE NOCASE'), ('scale', 'scale_from, scale_to')]:
+                self._con.execute('CREATE INDEX IF NOT EXISTS layers_{} ON layers ({})'.format(name, cols))
+            if self._con.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+                # inventories from before the open scale bounds were stored as OPEN_FROM and OPEN_TO
+                self._con.execute('UPDATE layers SET scale_from = ? WHERE scale_from IS NULL', (OPEN_FROM,))
+                self._con.execute('UPDATE layers SET scale_to = ? WHERE scale_to IS NULL OR scale_to = 0', (OPEN_TO,))
+                self._con.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+
+    def record(self, project_path, tool, tables):
+        """Replace the layers of a project with the (map name, layer records) tables."""
+        project_path = os.path.abspath(project_path)
+        rows = []
+        for (map_name, records) in tables:
+            for rec in records:
+                visible = output_writers.to_type(rec.visible, 'bool')
+                rows.append((map_name, rec.layer, _text(rec.group), _text(rec.data_path),
+                             normalise_source(_text(rec.data_path) or _text(rec.data_sql)), _text(rec.data_sql),
+                             _text(rec.definition_query), None if visible is None else int(visible),
+                             # max_scale is the zoomed in end of the range (MINSCALEDENOM) in all the summarisers,
+                             # and 0 means no limit as in ArcGIS
+                             output_writers.to_type(rec.max_scale, 'float') or OPEN_FROM,
+                             output_writers.to_type(rec.min_scale, 'float') or OPEN_TO))
+        with self._con:
+            cur = self._con.execute('SELECT id FROM projects WHERE path = ?', (project_path,)).fetchone()
+            if cur:
+                project_id = cur[0]
+                self._con.execute('DELETE FROM layers WHERE project_id = ?', (project_id,))
+                self._con.execute('UPDATE projects SET tool = ?, layers = ?, updated = ? WHERE id = ?',
+                                  (tool, len(rows), time.time(), project_id))
+            else:
+                project_id = self._con.execute('INSERT INTO projects (path, tool, layers, updated) VALUES (?, ?, ?, ?)',
+                                               (project_path, tool, len(rows), time.time())).lastrowid
+            self._con.executemany('INSERT INTO layers (project_id, {}) VALUES (?, {})'.format(
+                ', '.join(LAYER_COLUMNS), ', '.join('?' * len(LAYER_COLUMNS))), [(project_id,) + r for r in rows])
+
+    def remove(self, project_path):
+        project_path = os.path.abspath(project_path)
+        with self._con:
+            self._con.execute('DELETE FROM layers WHERE project_id IN (SELECT id FROM projects WHERE path = ?)',
+                              (project_path,))
+            self._con.execute('DELETE FROM projects WHERE path = ?', (project_path,))
+
+    def _layers(self, where, params):
+        sql = ('SELECT p.path, l.{} FROM layers l JOIN projects p ON p.id = l.project_id WHERE {} '
+               'ORDER BY p.path, l.rowid').format(', l.'.join(LAYER_COLUMNS), where)
+        return self._con.execute(sql, params).fetchall()
+
+    def find_source(self, text, exact=False):
+        """Layers whose (normalised) data source contains text, e.g. a table or feature class name.
+        With exact, the data source has to be text (normalised), which is a lot quicker on big inventories."""
+        if exact:
+            return self._layers('l.source = ?', (normalise_source(text),))
+        return self._layers("l.source LIKE ? ESCAPE '\\'", ('%{}%'.format(_like_escape(normalise_source(text))),))
+
+    def find_layer(self, name):
+        """Layers with this name (case insensitive, % and _ are wildcards)."""
+        return self._layers('l.layer LIKE ?', (name,))
+
+    def find_group(self, name):
+        return self._layers('l.group_name LIKE ?', (name,))
+
+    def find_query(self, text):
+        """Layers with text in their definition query or data SQL."""
+        pattern = '%{}%'.format(_like_escape(text))
+        return self._layers("l.definition_query LIKE ? ESCAPE '\\' OR l.data_sql LIKE ? ESCAPE '\\'",
+                            (pattern, pattern))
+
+    def at_scale(self, scale):
+        """Layers that are shown at the scale (denominator), from scale_from up to but not including scale_to as in
+        ScaleIndex."""
+        return self._layers('l.scale_from <= ? AND l.scale_to > ?', (scale, scale))
+
+    def projects(self):
+        return self._con.execute('SELECT path, tool, layers, updated FROM projects ORDER BY path').fetchall()
+
+    def close(self):
+        self._con.close()
+
+
+def _like_escape(text):
+    """text for a LIKE ... ESCAPE '\\' pattern, with its % and _ taken literally."""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _text(value):
+    if value is None or (isinstance(value, (str, text_type)) and value.strip() in output_writers.NULLS):
+        return None
+    return value if isinstance(value, (str, text_type)) else text_type(value)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='inventory', description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--db', help="inventory file (default: $SUMMARISE_INVENTORY or the user's cache folder)")
+    sub = parser.add_subparsers(dest='what')
+    sub.required = True
+    for (what, arg, hlp) in [('source', 'text', "layers using a data source containing text"),
+                             ('layer', 'name', "layers by name, with % as wildcard"),
+                             ('group', 'name', "layers by group, with % as wildcard"),
+                             ('query', 'text', "layers with text in the definition query or data SQL"),
+                             ('scale', 'scale', "layers shown at a scale")]:
+        sub.add_parser(what, help=hlp).add_argument(arg, type=float if what == 'scale' else str)
+    sub.choices['source'].add_argument('--exact', action='store_true', help="the whole data source, not a part")
+    sub.add_parser('projects', help="the summarised projects")
+    args = parser.parse_args(argv)
+
+    inv = Inventory(args.db)
+    try:
+        if args.what == 'projects':
+            rows = [(path, tool, n, time.strftime('%Y-%m-%d %H:%M', time.localtime(t)))
+                    for (path, tool, n, t) in inv.projects()]
+            headings = ['project', 'tool', 'layers', 'updated']
+        else:
+            if args.what == 'source':
+                rows = inv.find_source(args.text, args.exact)
+            elif args.what == 'query':
+                rows = inv.find_query(args.text)
+            elif args.what == 'scale':
+                rows = inv.at_scale(args.scale)
+            else:
+                rows = (inv.find_layer if args.what == 'layer' else inv.find_group)(args.name)
+            headings = ['project'] + LAYER_COLUMNS
+    finally:
+        inv.close()
+    print('\t'.join(headings))
+    for row in rows:
+        print('\t'.join('' if v is None else str(v) for v in row))
+    sys.stderr.write("{} rows\n".format(len(rows)))
+
+
+if __name__ == "__main__":
+    main()
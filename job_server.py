@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""
+A local job server: a pool of long-lived worker processes that import the summariser engine (and through it arcpy,
+with its licence checkout) once, and then summarise project after project.
+
+Each run of summarise.py pays for starting Python and importing arcpy before reading a single layer, which dominates
+when summarising a whole share of projects. The server keeps that cost to once per worker. Clients connect over a
+local socket (multiprocessing.connection, with an auth key), send a list of jobs (input path, output path, options),
+and get the progress messages and results streamed back as the jobs finish. One client is served at a time, others
+wait their turn.
+
+The requests are pickled, so whoever has the auth key can run code in the workers. The key is taken from
+SUMMARISE_SERVER_KEY, or else from a key file (SUMMARISE_SERVER_KEY_FILE, default ~/.summarise_server_key), which
+the server creates with a random key, readable by the user only. There is no built-in default key.
+
+A worker is replaced by a fresh one after max_jobs jobs (to keep leaks in arcpy from piling up) or when it crashes,
+in which case its job is reported as failed. A worker found dead when it's given a job is replaced, and the job is
+given to another worker, once. If a worker can't load the engine, its job is reported as failed, and the server
+carries on. The engine is pluggable, given as "module:function" or one of ENGINES, so the server can be tried
+without arcpy with the stub engine.
+
+Usage: python job_server.py serve [--workers N] [--engine stub], then python job_server.py submit INPUT... and
+python job_server.py stop, see --help. Needs py3, so mxd files (which need ArcMap's py2) can't be summarised on
+the server.
+"""
+import os
+import sys
+import glob
+import time
+import stat
+import argparse
+import binascii
+import importlib
+import traceback
+import collections
+import multiprocessing
+from multiprocessing.connection import Listener, Client, wait
+
+DEFAULT_ADDRESS = ('localhost', 6010)
+DEFAULT_KEY_FILE = os.path.join(os.path.expanduser('~'), '.summarise_server_key')
+ENGINES = {'summarise': 'summarise:run', 'stub': 'job_server:stub_run'}
+PY2_ONLY = ('.mxd',)  # arcpy.mapping is only in ArcMap's py2
+
+
+def set_msg(msg, severity=0):  # placeholder
+    print(msg)
+
+
+def default_authkey(create=False):
+    """The auth key from SUMMARISE_SERVER_KEY, or from the key file. With create (for the server), a missing key
+    file is made with a random key and 0600 permissions. Raises RuntimeError if there's no key, or the key file can
+    be read by others."""
+    if os.environ.get('SUMMARISE_SERVER_KEY'):
+        return os.environ['SUMMARISE_SERVER_KEY'].encode('utf-8')
+    path = os.environ.get('SUMMARISE_SERVER_KEY_FILE') or DEFAULT_KEY_FILE
+    if create and not os.path.exists(path):
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:  # made by another server starting at the same time
+            pass
+        else:
+            with os.fdopen(fd, 'w') as f:
+                f.write(binascii.hexlify(os.urandom(32)).decode('ascii'))
+            set_msg("Wrote a new server key to {}".format(path))
+    if not os.path.isfile(path):
+        raise RuntimeError("No server key: set SUMMARISE_SERVER_KEY, or start the server to create {}".format(path))
+    if os.name == 'posix' and os.stat(path).st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise RuntimeError("The server key file {} can be read by other users, chmod 600 it".format(path))
+    with open(path) as f:
+        key = f.read().strip()
+    if not key:
+        raise RuntimeError("The server key file {} is empty".format(path))
+    return key.encode('utf-8')
+
+
+def load_engine(engine):
+    """Import an engine, given as "module:function" or a name in ENGINES. If the module has a warm_up function, it's
+    called, e.g. to import arcpy up front."""
+    (module_name, func_name) = ENGINES.get(engine, engine).split(':')
+    module = importlib.import_module(module_name)
+    if hasattr(module, 'warm_up'):
+        module.warm_up()
+    return getattr(module, func_name)
+
+
+def stub_run(src, out=None, set_msg=None, **opts):
+    """A stand-in engine for trying the server without arcpy: "summarises" src by writing its size to out.
+    The sleep (seconds) and crash options simulate slow and crashing jobs."""
+    (set_msg or print)("Stub summarising {} in process {}".format(src, os.getpid()))
+    time.sleep(opts.get('sleep', 0))
+    if opts.get('crash'):
+        os._exit(3)
+    out = out or os.path.splitext(src)[0] + '.txt'
+    with open(out, 'w') as f:
+        f.write('{}\t{}\n'.format(src, os.path.getsize(src)))
+    return out
+
+
+def _worker(conn, engine, max_jobs):
+    """Worker process: load the engine once, then run jobs from conn until max_jobs are done or the pool hangs up."""
+    try:
+        run = load_engine(engine)
+    except Exception:
+        conn.send({'event': 'failed', 'error': traceback.format_exc()})
+        return
+    conn.send({'event': 'ready', 'pid': os.getpid()})
+    for _ in range(max_jobs):
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+        (job_id, src, out, opts) = job
+
+        def job_msg(msg, severity=0):
+            conn.send({'event': 'msg', 'job': job_id, 'src': src, 'msg': msg, 'severity': severity})
+
+        t0 = time.time()
+        try:
+            out = run(src, out, job_msg, **opts)
+            error = None
+        except Exception as e:
+            error = '{}: {}'.format(type(e).__name__, e)
+        conn.send({'event': 'done', 'job': job_id, 'src': src, 'output': out, 'error': error,
+                   'seconds': time.time() - t0, 'pid': os.getpid()})
+
+
+class _Worker(object):
+    __slots__ = ('proc', 'conn', 'jobs', 'current')
+
+    def __init__(self, proc, conn):
+        self.proc = proc
+        self.conn = conn
+        self.jobs = 0  # jobs finished
+        self.current = None  # (job id, src) being run
+
+
+class WorkerPool(object):
+    """A pool of warm worker processes. Use as a context manager, and run jobs with run()."""
+
+    def __init__(self, workers=None, engine='summarise', max_jobs=50):
+        self.size = workers or min(4, multiprocessing.cpu_count())
+        self.engine = engine
+        self.max_jobs = max_jobs
+        self.workers = []
+        self.started = 0  # worker processes started, including replacements
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        while len(self.workers) < self.size:
+            self.workers.append(self._spawn())
+
+    def _spawn(self):
+        (conn, child_conn) = multiprocessing.Pipe()
+        proc = multiprocessing.Process(target=_worker, args=(child_conn, self.engine, self.max_jobs))
+        proc.daemon = True
+        proc.start()
+        child_conn.close()
+        self.started += 1
+        return _Worker(proc, conn)
+
+    def _replace(self, worker, kill=False):
+        if kill and worker.proc.is_alive():
+            worker.proc.terminate()
+        worker.proc.join(5)
+        worker.conn.close()
+        self.workers[self.workers.index(worker)] = self._spawn()
+
+    def run(self, jobs):
+        """Run the (src, out, opts) jobs, and yield events as they come: {'event': 'msg', ...} for progress
+        messages, and {'event': 'done', 'job': index, 'src', 'output', 'error', 'seconds', 'pid'} per job."""
+        queue = collections.deque((n, src, out, opts) for (n, (src, out, opts)) in enumerate(jobs))
+        retried = set()  # ids of the jobs given to another worker after a dead one
+        try:
+            while queue or any(w.current for w in self.workers):
+                for w in self.workers:
+                    if queue and w.current is None:
+                        job = queue.popleft()
+                        try:
+                            w.conn.send(job)
+                        except OSError as e:  # it died while idle, e.g. killed
+                            self._replace(w, kill=True)
+                            if job[0] in retried:
+                                yield {'event': 'done', 'job': job[0], 'src': job[1], 'output': None,
+                                       'seconds': None, 'pid': w.proc.pid,
+                                       'error': "Couldn't hand the job to a worker: {}".format(e)}
+                            else:
+                                retried.add(job[0])
+                                queue.appendleft(job)
+                            continue
+                        w.current = job[:2]
+                busy = [w for w in self.workers if w.current]
+                if not busy:
+                    continue
+                ready = wait([w.conn for w in busy] + [w.proc.sentinel for w in busy])
+                for w in busy:
+                    if w.conn not in ready and w.proc.sentinel not in ready:
+                        continue
+                    for event in self._events(w):
+                        yield event
+        finally:
+            for w in list(self.workers):
+                if w.current:  # abandoned, e.g. the client hung up: a job can't be stopped half way
+                    w.current = None
+                    self._replace(w, kill=True)
+
+    def _events(self, w):
+        """The events from a worker that's ready, replacing it when it's done max_jobs jobs or has crashed."""
+        try:
+            while w.current and w.conn.poll():
+                event = w.conn.recv()
+                if event['event'] == 'failed':  # the job never ran, the worker has exited
+                    set_msg("A worker couldn't load the {} engine:\n{}".format(self.engine, event['error']), 40)
+                    (job_id, src) = w.current
+                    w.current = None
+                    self._replace(w)
+                    yield {'event': 'done', 'job': job_id, 'src': src, 'output': None, 'seconds': None,
+                           'pid': w.proc.pid, 'error': "Couldn't load the {} engine: {}".format(
+                               self.engine, event['error'].strip().splitlines()[-1])}
+                    return
+                if event['event'] == 'done':
+                    w.current = None
+                    w.jobs += 1
+                    if w.jobs >= self.max_jobs:  # it exits by itself
+                        self._replace(w)
+                if event['event'] != 'ready':
+                    yield event
+        except (EOFError, OSError):
+            pass
+        if w.current and not w.proc.is_alive():
+            (job_id, src) = w.current
+            w.current = None
+            w.proc.join()
+            self._replace(w)
+            yield {'event': 'done', 'job': job_id, 'src': src, 'output': None, 'seconds': None, 'pid': w.proc.pid,
+                   'error': "Worker crashed (exit code {})".format(w.proc.exitcode)}
+
+    def close(self):
+        for w in self.workers:
+            try:
+                w.conn.send(None)
+            except (EOFError, OSError):
+                pass
+        for w in self.workers:
+            w.proc.join(5)
+            if w.proc.is_alive():
+                w.proc.terminate()
+            w.conn.close()
+        self.workers = []
+
+
+def serve(address=DEFAULT_ADDRESS, workers=None, engine='summarise', max_jobs=50, authkey=None):
+    """Run the job server until a client sends stop. Without authkey, the key is read (or the key file created)
+    by default_authkey."""
+    with WorkerPool(workers, engine, max_jobs) as pool:
+        with Listener(address, authkey=authkey or default_authkey(create=True)) as listener:
+            set_msg("Serving {} workers ({} engine) on {}:{}".format(pool.size, engine, *listener.address))
+            while True:
+                try:
+                    conn = listener.accept()
+                except multiprocessing.AuthenticationError as e:
+                    set_msg("Refused a client: {}".format(e), 30)
+                    continue
+                try:
+                    request = conn.recv()
+                    if request.get('stop'):
+                        conn.send({'event': 'end'})
+                        set_msg("Stopped.")
+                        return
+                    jobs = request['jobs']
+                    set_msg("{} jobs".format(len(jobs)))
+                    t0 = time.time()
+                    for event in pool.run(jobs):
+                        conn.send(event)
+                    conn.send({'event': 'end', 'workers_started': pool.started})
+                    set_msg("  done in {:.1f}s".format(time.time() - t0))
+                except (EOFError, OSError) as e:
+                    set_msg("Lost the client: {}".format(e), 30)
+                finally:
+                    conn.close()
+
+
+def submit(jobs, address=DEFAULT_ADDRESS, authkey=None):
+    """Send (src, out, opts) jobs to a running server, and yield the events (see WorkerPool.run) as they come."""
+    conn = Client(address, authkey=authkey or default_authkey())
+    try:
+        conn.send({'jobs': list(jobs)})
+        while True:
+            event = conn.recv()
+            if event['event'] == 'end':
+                return
+            yield event
+    finally:
+        conn.close()
+
+
+def stop(address=DEFAULT_ADDRESS, authkey=None):
+    conn = Client(address, authkey=authkey or default_authkey())
+    try:
+        conn.send({'stop': True})
+        conn.recv()
+    finally:
+        conn.close()
+
+
+def expand_inputs(inputs):
+    """Files, globs and directories (of aprx and map files) to summarise. mxd files are left out of globs and
+    directories, and raise ValueError if given by name, as the server can't read them."""
+    import summarise
+    paths = []
+    for src in inputs:
+        if os.path.splitext(src)[1].lower() in PY2_ONLY:
+            raise ValueError("Can't summarise {} on the job server, mxd files need ArcMap's Python 2: run "
+                             "summarise_mxd.py in ArcMap".format(src))
+        if os.path.isdir(src):
+            src = os.path.join(src, '*')
+        for path in sorted(glob.glob(src)) if any(c in src for c in '*?[') else [src]:
+            ext = os.path.splitext(path)[1].lower()
+            if ext in summarise.ENGINES and ext not in PY2_ONLY:
+                paths.append(path)
+    return paths
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='job_server', description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--port', type=int, default=DEFAULT_ADDRESS[1])
+    sub = parser.add_subparsers(dest='command')
+    sub.required = True
+
+    srv = sub.add_parser('serve', help="start the server (the auth key is SUMMARISE_SERVER_KEY, or a random key in "
+                                       "~/.summarise_server_key or SUMMARISE_SERVER_KEY_FILE, made on first start "
+                                       "and readable by you only)")
+    srv.add_argument('--workers', type=int, help="number of worker processes (default: up to 4)")
+    srv.add_argument('--max-jobs', type=int, default=50, help="jobs per worker before it's replaced (default: 50)")
+    srv.add_argument('--engine', default='summarise',
+                     help="summarise, stub, or module:function taking (src, out, set_msg, **opts)")
+
+    sbm = sub.add_parser('submit', help="summarise files on the server")
+    sbm.add_argument('inputs', nargs='+', help="aprx and map files, globs or directories")
+    sbm.add_argument('--out-dir', help="folder for the outputs (default: next to the inputs)")
+    sbm.add_argument('--no-cache', dest='cache', action='store_false', help="don't use the result cache")
+    sbm.add_argument('--inventory', nargs='?', const=True, metavar='DB', help="also store the layers in the inventory")
+    sbm.add_argument('--check-paths', action='store_true', help="check that the data sources exist")
+    sbm.add_argument('--cim', action='store_true', help="read aprx files without arcpy")
+    sbm.add_argument('--fast', action='store_true', help="use the streaming LAYER reader for map files")
+    sbm.add_argument('--split-scale', action='store_true', help="one row per scale for layers with SCALETOKENs")
+    sbm.add_argument('--quiet', action='store_true', help="only report the finished jobs")
+
+    sub.add_parser('stop', help="stop the server")
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    address = (DEFAULT_ADDRESS[0], args.port)
+    try:
+        default_authkey(create=args.command == 'serve')
+    except RuntimeError as e:
+        sys.exit(str(e))
+    if args.command == 'serve':
+        serve(address, args.workers, args.engine, args.max_jobs)
+    elif args.command == 'stop':
+        stop(address)
+    else:
+        import summarise
+        opts = dict(cache=args.cache, inventory=args.inventory, check_paths=args.check_paths, cim=args.cim,
+                    fast=args.fast, split_scale=args.split_scale)
+        try:
+            inputs = expand_inputs(args.inputs)
+        except ValueError as e:
+            sys.exit(str(e))
+        jobs = []
+        for src in inputs:
+            out = summarise.default_output(src)
+            if args.out_dir:
+                out = os.path.join(args.out_dir, os.path.basename(out))
+            jobs.append((os.path.abspath(src), os.path.abspath(out), opts))
+        failed = 0
+        for event in submit(jobs, address):
+            if event['event'] == 'msg' and not args.quiet:
+                set_msg("  [{}] {}".format(os.path.basename(event['src']), event['msg']))
+            elif event['event'] == 'done':
+                if event['error']:
+                    failed += 1
+                    set_msg("{} failed: {}".format(event['src'], event['error']), 40)
+                else:
+                    set_msg("{} -> {} ({:.1f}s)".format(event['src'], event['output'], event['seconds']))
+        set_msg("{} of {} jobs done.".format(len(jobs) - failed, len(jobs)))
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Filters for summarising only some of the layers of a big map file or project: a group, layer names matching a glob,
+data sources containing a text, layers active somewhere in a scale range, or visible/hidden layers.
+
+The summarisers check the filter as early as they can, with the few layer properties that are cheap to get, so the
+layers that are left out never have their metadata decoded, scale tokens expanded, CIM definitions fetched or data
+sources checked. match() checks the values it's given and skips the rest, so it can be called with whatever is at
+hand; match_record() checks a finished LayerRecord, e.g. one from the result cache.
+
+A filter is written as conditions separated by semicolons, e.g. "group=Roads; name=vej*; scale=1000-25000", see
+parse. Works in both py2 (ArcMap) and py3.
+"""
+import fnmatch
+
+import output_writers
+import scale_index
+
+KEYS = ('group', 'name', 'source', 'scale', 'visible')
+
+
+class LayerFilter(object):
+    """Which layers to summarise: the layers that meet all the given conditions.
+
+    group and name are case insensitive globs (for aprx and mxd, the group is the group layer's path, and the name
+    can be the layer's name or its long name), source is a case insensitive substring of the data source, scales is
+    a (from, to) range that the layer must be active somewhere in, and visible is True or False.
+    """
+
+    def __init__(self, group=None, name=None, source=None, scales=None, visible=None):
+        self.group = group
+        self.name = name
+        self.source = source.lower() if source else None
+        self.scales = scales
+        self.visible = visible
+
+    def __repr__(self):
+        return 'LayerFilter({})'.format(self.text)
+
+    @property
+    def text(self):
+        conds = []
+        for (key, value) in [('group', self.group), ('name', self.name), ('source', self.source)]:
+            if value is not None:
+                conds.append('{}={}'.format(key, value))
+        if self.scales is not None:
+            conds.append('scale={:g}-{:g}'.format(*self.scales))
+        if self.visible is not None:
+            conds.append('visible={}'.format('yes' if self.visible else 'no'))
+        return '; '.join(conds)
+
+    @classmethod
+    def parse(cls, conditions):
+        """A filter from conditions like "group=Roads; name=vej*; source=postgis; scale=1000-25000; visible=yes",
+        given as one string or a list of them (e.g. from a repeated command line option). A single scale is taken
+        as the range of just that scale, and "1:" prefixes are allowed. Returns None for no conditions."""
+        if not isinstance(conditions, (list, tuple)):
+            conditions = [conditions]
+        kwargs = {}
+        for cond in (c.strip() for text in conditions if text for c in text.split(';')):
+            if not cond:
+                continue
+            (key, sep, value) = cond.partition('=')
+            (key, value) = (key.strip().lower(), value.strip())
+            if not sep or key not in KEYS:
+                raise ValueError("Can't read the layer filter condition {!r}, expected one of {} followed by = "
+                                 "and a value".format(cond, ', '.join(KEYS)))
+            if key == 'scale':
+                kwargs['scales'] = _parse_range(value)
+            elif key == 'visible':
+                kwargs['visible'] = output_writers.to_type(value.upper().replace('YES', 'TRUE'), 'bool')
+            else:
+                kwargs[key] = value
+        return cls(**kwargs) if kwargs else None
+
+    def match(self, name=None, group=None, source=None, max_scale=None, min_scale=None, visible=None):
+        """Whether a layer can meet the filter, from the values given. Values that are left out (None) aren't checked,
+        and the scale range is only checked when at least one end is given."""
+        if self.name is not None and name is not None and not (_glob(name, self.name) or
+                                                               _glob(name.rpartition('\\')[2], self.name)):
+            return False
+        if self.group is not None and group is not None and not _glob(group, self.group):
+            return False
+        if self.source is not None and source is not None and self.source not in source.lower():
+            return False
+        if self.visible is not None and visible is not None and \
+                bool(output_writers.to_type(visible, 'bool')) != self.visible:
+            return False
+        if self.scales is not None and (max_scale is not None or min_scale is not None):
+            (lo, hi) = scale_index.scale_bounds(max_scale, min_scale)
+            if lo > self.scales[1] or hi <= self.scales[0]:
+                return False
+        return True
+
+    def match_record(self, rec):
+        """Whether a LayerRecord meets the filter. Without a group, the group is the path of the group layer."""
+        group = rec.group
+        if not group or group == '-':
+            group = parent_path(rec.layer)
+        return self.match(rec.layer or '', group, rec.data_path or '', rec.max_scale, rec.min_scale, rec.visible)
+
+    def filter(self, records):
+        """The records that meet the filter."""
+        return [rec for rec in records if self.match_record(rec)]
+
+
+def parent_path(long_name):
+    """The group layer path of an aprx/mxd layer's long name ("Group\\Sub\\Layer" -> "Group\\Sub"), or ''."""
+    return (long_name or '').rpartition('\\')[0]
+
+
+def _glob(value, pattern):
+    return fnmatch.fnmatchcase(value.lower(), pattern.lower())
+
+
+def _parse_range(text):
+    """(from, to) from "1000-25000", "1:1000-1:25000" or a single scale."""
+    ends = [float(s.strip().split(':')[-1]) for s in text.split('-')]
+    if len(ends) == 1:
+        ends = ends * 2
+    if len(ends) != 2 or ends[0] > ends[1]:
+        raise ValueError("Can't read the scale range {!r}, expected e.g. 1000-25000".format(text))
+    return tuple(ends)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+The layer record shared by all the summarisers, and the registry of the columns it can hold.
+
+A LayerRecord has a slot per column and no instance dict, and the values that repeat a lot across layers
+(data paths, connection strings, groups, metadata...) are interned, so big maps with tens of thousands of
+(scale split) layers stay small in memory. The summarisers each pick the columns they output, in their own order,
+with a list of keys, and rows are only made from the records as they're written.
+
+The records hold the values as shown in the summaries (e.g. 'N/A' and '-'), the types in COLUMNS are used by the
+typed output formats, see output_writers.
+"""
+import sys
+
+# Column key -> type, in output order for the typed formats
+COLUMNS = [
+    ('source_file', 'str'),
+    ('map', 'str'),
+    ('layer', 'str'),
+    ('group', 'str'),
+    ('data_path', 'str'),
+    ('data_ok', 'str'),
+    ('features', 'int'),
+    ('extent', 'str'),
+    ('data_size', 'int'),
+    ('visible', 'bool'),
+    ('transparency', 'float'),
+    ('max_scale', 'float'),
+    ('min_scale', 'float'),
+    ('data_sql', 'str'),
+    ('connection', 'str'),
+    ('connection_type', 'str'),
+    ('vis_attributes', 'str'),
+    ('vis_classes', 'str'),
+    ('definition_query', 'str'),
+    ('joins', 'str'),
+    ('wms_title', 'str'),
+    ('wms_layer_group', 'str'),
+    ('wms_abstract', 'str'),
+    ('wms_group_title', 'str'),
+    ('wms_group_abstract', 'str'),
+]
+COLUMN_TYPES = dict(COLUMNS)
+KEYS = tuple(k for (k, typ) in COLUMNS)
+
+# Columns whose values are typically shared by many layers
+INTERNED = frozenset(['source_file', 'map', 'group', 'data_path', 'data_ok', 'visible', 'data_sql', 'connection',
+                      'connection_type', 'wms_title', 'wms_layer_group', 'wms_abstract', 'wms_group_title', 'wms_group_abstract'])
+
+try:
+    _intern = sys.intern
+except AttributeError:  # py2
+    _intern = intern
+
+
+def intern_str(value):
+    """Intern strings, leave anything else (numbers, None, py2 unicode) as it is."""
+    return _intern(value) if type(value) is str else value
+
+
+class LayerRecord(object):
+    __slots__ = KEYS
+
+    def __init__(self, **values):
+        for k in KEYS:
+            v = values.pop(k, None)
+            setattr(self, k, intern_str(v) if k in INTERNED else v)
+        if values:
+            raise TypeError("Unknown layer record column(s): {}".format(', '.join(values)))
+
+    def __setattr__(self, key, value):
+        object.__setattr__(self, key, intern_str(value) if key in INTERNED else value)
+
+    def __repr__(self):
+        return 'LayerRecord({})'.format(', '.join('{}={!r}'.format(k, getattr(self, k))
+                                                  for k in KEYS if getattr(self, k) is not None))
+
+    def __eq__(self, other):
+        return isinstance(other, LayerRecord) and self.to_list() == other.to_list()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def row(self, keys):
+        """The values of the given columns, as a row for writing."""
+        return [getattr(self, k) for k in keys]
+
+    def to_list(self):
+        """All values, in KEYS order, e.g. for caching as JSON."""
+        return [getattr(self, k) for k in KEYS]
+
+    @classmethod
+    def from_list(cls, values):
+        return cls(**dict(zip(KEYS, values)))
+
+    def __getstate__(self):
+        return self.to_list()
+
+    def __setstate__(self, state):
+        for (k, v) in zip(KEYS, state):
+            setattr(self, k, v)
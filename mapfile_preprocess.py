@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Preprocessing of map file text before it's parsed: decoding, BOM removal and INCLUDE handling.
+
+Everything happens in memory. The map file is read once, and nothing is written next to it, so read-only folders
+and concurrent runs on the same map file are fine. Very large files are memory-mapped rather than read into a buffer.
+
+Included fragments are read (decoded and split on their own INCLUDE lines) once per process, and their text is
+kept in a cache keyed by path and modification time, so fragments shared by many map files (common layer sets,
+symbols, fonts...) aren't read again for every map file that includes them. This is a text cache: the expanded map
+file is still parsed as a whole, shared fragments included, as a fragment on its own isn't valid map file syntax.
+In a batch run each worker process has its own cache, except in pipelined runs, where the map files are read (and
+the includes expanded) in the main process, so each fragment is read once per batch.
+
+As in MapServer and mappyfile, relative INCLUDE paths are relative to the main map file, also in nested includes.
+"""
+import os
+import re
+import mmap
+import codecs
+
+MAX_INCLUDE_DEPTH = 5  # same as MapServer and mappyfile
+MMAP_THRESHOLD = 64 * 1024 * 1024  # files larger than this are memory-mapped
+
+_INCLUDE_RE = re.compile(r'''^[ \t]*INCLUDE[ \t]+(["'])(.*?)\1[^\n]*$''', re.IGNORECASE | re.MULTILINE)
+_DROP_INCLUDE_RE = re.compile(r'^([ \t]*)(INCLUDE\b)', re.IGNORECASE | re.MULTILINE)
+
+# Longest first, the UTF-32 LE BOM starts with the UTF-16 LE BOM
+_BOMS = [(codecs.BOM_UTF32_LE, 'utf-32-le'), (codecs.BOM_UTF32_BE, 'utf-32-be'), (codecs.BOM_UTF8, 'utf-8'),
+         (codecs.BOM_UTF16_LE, 'utf-16-le'), (codecs.BOM_UTF16_BE, 'utf-16-be')]
+
+_fragments = {}  # path -> Fragment, replaced when the mtime changes
+_stats = {'read': 0, 'reused': 0}
+
+
+class IncludeError(ValueError):
+    """Raised for missing include files, include cycles and too deeply nested includes."""
+    pass
+
+
+class Fragment(object):
+    """A map file (fragment) split on its INCLUDE lines.
+
+    parts is a list of text strings and (include path, line number) tuples, in file order.
+    """
+    __slots__ = ('path', 'mtime', 'parts')
+
+    def __init__(self, path, mtime, parts):
+        self.path = path
+        self.mtime = mtime
+        self.parts = parts
+
+
+def preprocess(mapfile_src, drop_includes=True):
+    """Read a map file into text that's ready for parsing, with INCLUDEs either commented out or resolved."""
+    text = read_text(mapfile_src)
+    if drop_includes:
+        return _DROP_INCLUDE_RE.sub('\\1# \\2', text)
+    return expand_includes(text, mapfile_src)
+
+
+def read_text(path):
+    """Read a map file as text, removing any BOM. Without a BOM UTF-8 is assumed, with Latin-1 as fallback."""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size > MMAP_THRESHOLD:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            buf = f.read()
+    try:
+        return decode(buf)
+    finally:
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+
+
+def decode(buf):
+    """Decode the bytes (or mmap) of a map file, removing any BOM."""
+    start = 0
+    encoding = None
+    for (bom, enc) in _BOMS:
+        if buf[:len(bom)] == bom:
+            (start, encoding) = (len(bom), enc)
+            break
+    view = memoryview(buf)[start:]
+    try:
+        if encoding:
+            return str(view, encoding)
+        try:
+            return str(view, 'utf-8')
+        except UnicodeDecodeError:  # e.g. old cp1252 map files
+            return str(view, 'latin-1')
+    finally:
+        view.release()
+
+
+def split_includes(text):
+    """Split map file text into text parts and (include path, line number) parts."""
+    parts = []
+    pos = 0
+    for m in _INCLUDE_RE.finditer(text):
+        parts.append(text[pos:m.start()])
+        parts.append((m.group(2), text.count('\n', 0, m.start()) + 1))
+        pos = m.end()
+    parts.append(text[pos:])
+    return parts
+
+
+def get_fragment(path):
+    """Get an included file from the cache, reading it if it's new or has changed since it was cached."""
+    path = os.path.normcase(os.path.abspath(path))
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        raise IncludeError("Include file not found: {}".format(path))
+    frag = _fragments.get(path)
+    if frag is None or frag.mtime != mtime:
+        frag = Fragment(path, mtime, split_includes(read_text(path)))
+        _fragments[path] = frag
+        _stats['read'] += 1
+    else:
+        _stats['reused'] += 1
+    return frag
+
+
+def expand_includes(text, mapfile_src, max_depth=MAX_INCLUDE_DEPTH):
+    """Replace the INCLUDE lines in the text of mapfile_src by the contents of the included files."""
+    src = os.path.normcase(os.path.abspath(mapfile_src))
+    return ''.join(_expand_parts(split_includes(text), os.path.dirname(src), (src,), max_depth))
+
+
+def _expand_parts(parts, base_dir, stack, max_depth):
+    for part in parts:
+        if not isinstance(part, tuple):
+            yield part
+            continue
+        (inc, line) = part
+        path = os.path.normcase(os.path.abspath(os.path.join(base_dir, inc)))
+        if path in stack:
+            raise IncludeError("Include cycle: {}".format(' -> '.join(stack[stack.index(path):] + (path,))))
+        if len(stack) > max_depth:
+            raise IncludeError("Includes nested more than {} levels deep: {}".format(
+                max_depth, ' -> '.join(stack + (path,))))
+        try:
+            frag = get_fragment(path)
+        except IncludeError as e:
+            raise IncludeError("{} (included from {}, line {})".format(e, stack[-1], line))
+        for s in _expand_parts(frag.parts, base_dir, stack + (path,), max_depth):
+            yield s
+
+
+def fragment_cache_info():
+    """Number of fragments read and reused from the cache in this process."""
+    return dict(_stats)
+
+
+def clear_fragment_cache():
+    _fragments.clear()
+    _stats['read'] = 0
+    _stats['reused'] = 0
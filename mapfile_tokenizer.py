@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+"""
+A streaming reader for the LAYER blocks of a map file, as a fast alternative to a full mappyfile parse.
+
+Only the LAYER level keywords that summarise_mapfile uses are read (NAME, GROUP, DATA, CONNECTION, CONNECTIONTYPE,
+STATUS, MINSCALEDENOM, MAXSCALEDENOM, METADATA and SCALETOKEN). Everything else, including CLASS, STYLE and LABEL
+blocks, is skipped token by token without being built. The layers come out as dicts shaped like the ones mappyfile
+gives, so the same code can make rows from either.
+
+Anything the reader doesn't handle (INCLUDEs, strings spanning lines, unbalanced blocks) raises UnsupportedSyntax,
+and the caller is expected to fall back to mappyfile.
+"""
+import io
+import re
+import collections
+
+import mapfile_preprocess
+
+# Keywords that always start a block ending with END
+BLOCK_KEYWORDS = {'MAP', 'LAYER', 'CLASS', 'LABEL', 'METADATA', 'VALIDATION', 'PROJECTION', 'SCALETOKEN', 'VALUES',
+                  'WEB', 'OUTPUTFORMAT', 'LEGEND', 'SCALEBAR', 'QUERYMAP', 'REFERENCE', 'FEATURE', 'POINTS', 'GRID',
+                  'JOIN', 'CLUSTER', 'COMPOSITE', 'LEADER', 'PATTERN', 'CONNECTIONOPTIONS'}
+# Keywords that start a block in some blocks and are attributes in others, -> whether they start one in a parent
+# block (None at the top level), e.g. STYLE is an attribute in SCALEBAR, SYMBOL in STYLE and SYMBOLSET in MAP
+AMBIGUOUS_KEYWORDS = {'STYLE': lambda parent: parent != 'SCALEBAR',
+                      'SYMBOL': lambda parent: parent in (None, 'MAP', 'SYMBOLSET'),
+                      'SYMBOLSET': lambda parent: parent is None}
+# Keywords whose value can be a /regex/, besides the values in a VALIDATION block
+REGEX_KEYWORDS = {'EXPRESSION', 'FILTER', 'REGEX'}
+# Operators followed by a /regex/ in a parenthesised expression
+REGEX_OPERATORS = {'~', '~*', '=~'}
+
+LAYER_KEYWORDS = {'NAME', 'GROUP', 'DATA', 'CONNECTION', 'CONNECTIONTYPE', 'STATUS', 'MINSCALEDENOM',
+                  'MAXSCALEDENOM'}
+SCALE_KEYWORDS = {'MINSCALEDENOM', 'MAXSCALEDENOM'}
+
+_TOKEN_RE = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<comment>\#.*)
+  | (?P<string>"(?:[^"\\]|\\.)*"i?|'(?:[^'\\]|\\.)*'i?)
+  | (?P<attr>\[[^\]]*\])
+  | (?P<paren>[()])
+  | (?P<word>[^\s"'()\[\]\#]+)
+  | (?P<other>.)
+''', re.VERBOSE)
+_REGEX_RE = re.compile(r'/(?:[^/\\]|\\.)*/i?')
+
+
+class UnsupportedSyntax(ValueError):
+    """Raised for map file syntax the streaming reader doesn't handle."""
+    pass
+
+
+class Token(object):
+    __slots__ = ('kind', 'text', 'line')
+
+    def __init__(self, kind, text, line):
+        self.kind = kind
+        self.text = text
+        self.line = line
+
+    @property
+    def keyword(self):
+        """The upper-cased text for bare words, None for anything else."""
+        return self.text.upper() if self.kind == 'word' else None
+
+    @property
+    def string(self):
+        """The token text, unquoted if it's a string. Escapes are kept as they are, like mappyfile does."""
+        if self.kind == 'string':
+            s = self.text[:-1] if self.text.endswith('i') else self.text
+            return s[1:-1]
+        return self.text
+
+    @property
+    def value(self):
+        """The token as a value: strings unquoted, numbers as int/float, everything else as is."""
+        if self.kind == 'string':
+            return self.string
+        if self.kind == 'word':
+            try:
+                return int(self.text)
+            except ValueError:
+                pass
+            try:
+                return float(self.text)
+            except ValueError:
+                pass
+        return self.text
+
+
+def tokenize(lines):
+    """Yield the tokens of a map file, given as an iterable of lines. Parenthesised expressions are skipped.
+
+    A /regex/ is only read as one where a regex can be, as the value of EXPRESSION and the like, in a VALIDATION
+    block or after a ~ operator, so that e.g. an unquoted DATA /data/veje.shp is a word."""
+    paren_depth = 0
+    prev = None  # the text of the previous token, upper-cased
+    in_validation = False
+    for (n, line) in enumerate(lines, 1):
+        pos = 0
+        while pos < len(line):
+            m = None
+            if line[pos] == '/' and (in_validation or prev in REGEX_KEYWORDS or prev in REGEX_OPERATORS):
+                m = _REGEX_RE.match(line, pos)
+            m = m or _TOKEN_RE.match(line, pos)
+            pos = m.end()
+            kind = 'regex' if m.re is _REGEX_RE else m.lastgroup
+            if kind in ('space', 'comment'):
+                continue
+            prev = m.group().upper()
+            if not paren_depth and kind == 'word':
+                if prev == 'VALIDATION':
+                    in_validation = True
+                elif prev == 'END':
+                    in_validation = False
+            if kind == 'other':
+                raise UnsupportedSyntax("Unexpected {!r} at line {}".format(m.group(), n))
+            if kind == 'paren':
+                paren_depth += 1 if m.group() == '(' else -1
+                if paren_depth < 0:
+                    raise UnsupportedSyntax("Unbalanced parenthesis at line {}".format(n))
+                continue
+            if paren_depth:
+                continue
+            yield Token(kind, m.group(), n)
+    if paren_depth:
+        raise UnsupportedSyntax("Unbalanced parenthesis at end of file")
+
+
+class _Peekable(object):
+    def __init__(self, tokens):
+        self._it = iter(tokens)
+        self._next = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._next is not None:
+            tok, self._next = self._next, None
+            return tok
+        return next(self._it)
+    next = __next__  # py2
+
+    def peek(self):
+        if self._next is None:
+            self._next = next(self._it, None)
+        return self._next
+
+    def take(self, what):
+        tok = next(self, None)
+        if tok is None:
+            raise UnsupportedSyntax("Unexpected end of file, expected {}".format(what))
+        return tok
+
+
+def _opens_block(tok, parent):
+    """Whether a token starts a block ending with END, inside the parent block (None at the top level)."""
+    kw = tok.keyword
+    if kw in BLOCK_KEYWORDS:
+        return True
+    if kw in AMBIGUOUS_KEYWORDS:
+        return AMBIGUOUS_KEYWORDS[kw](parent)
+    return False
+
+
+def iter_layers(lines):
+    """Yield a dict per LAYER block in a map file (or map file fragment), given as an iterable of lines."""
+    tokens = _Peekable(tokenize(lines))
+    blocks = []  # the keywords of the open blocks
+    for tok in tokens:
+        kw = tok.keyword
+        if kw == 'INCLUDE':
+            raise UnsupportedSyntax("INCLUDE at line {}".format(tok.line))
+        if kw == 'END':
+            if not blocks:
+                raise UnsupportedSyntax("Unexpected END at line {}".format(tok.line))
+            blocks.pop()
+        elif kw == 'LAYER':
+            yield _read_layer(tokens)
+        elif _opens_block(tok, blocks[-1] if blocks else None):
+            blocks.append(kw)
+    if blocks:
+        raise UnsupportedSyntax("{} block(s) not closed at end of file".format(len(blocks)))
+
+
+def layer_blocks(text):
+    """Split map file text into the text of its LAYER blocks, e.g. for fingerprinting them one by one.
+
+    Each block has to start and end on lines of its own (comments aside), otherwise UnsupportedSyntax is raised.
+    """
+    lines = text.splitlines(True)
+    tokens = _Peekable(tokenize(lines))
+    blocks = []
+    open_blocks = []  # the keywords of the open blocks
+    layer_depth = None  # the depth of the LAYER being read, if any
+    prev_line = 0  # line of the previous token
+    for tok in tokens:
+        kw = tok.keyword
+        if kw == 'INCLUDE':
+            raise UnsupportedSyntax("INCLUDE at line {}".format(tok.line))
+        if kw == 'END':
+            if not open_blocks:
+                raise UnsupportedSyntax("Unexpected END at line {}".format(tok.line))
+            open_blocks.pop()
+            if len(open_blocks) == layer_depth:
+                nxt = tokens.peek()
+                if nxt is not None and nxt.line == tok.line:
+                    raise UnsupportedSyntax("LAYER block ending mid-line at line {}".format(tok.line))
+                blocks.append(''.join(lines[start - 1:tok.line]))
+                layer_depth = None
+        elif kw == 'LAYER' and layer_depth is None:
+            if prev_line == tok.line:
+                raise UnsupportedSyntax("LAYER block starting mid-line at line {}".format(tok.line))
+            (start, layer_depth) = (tok.line, len(open_blocks))
+            open_blocks.append(kw)
+        elif _opens_block(tok, open_blocks[-1] if open_blocks else None):
+            open_blocks.append(kw)
+        prev_line = tok.line
+    if open_blocks:
+        raise UnsupportedSyntax("{} block(s) not closed at end of file".format(len(open_blocks)))
+    return blocks
+
+
+def read_layers(mapfile_src):
+    """Read the layers of a map file."""
+    return loads_layers(mapfile_preprocess.read_text(mapfile_src))
+
+
+def loads_layers(text):
+    """Read the layers of map file text."""
+    return list(iter_layers(io.StringIO(text)))
+
+
+def _read_layer(tokens):
+    lyr = collections.OrderedDict([('__type__', 'layer'), ('group', None), ('metadata', {}), ('scaletokens', [])])
+    for tok in tokens:
+        kw = tok.keyword
+        if kw == 'END':
+            return lyr
+        if kw == 'INCLUDE':
+            raise UnsupportedSyntax("INCLUDE at line {}".format(tok.line))
+        if kw in LAYER_KEYWORDS:
+            val = tokens.take(kw).value
+            if kw in SCALE_KEYWORDS and not isinstance(val, (int, float)):
+                raise UnsupportedSyntax("Non-numeric {} at line {}".format(kw, tok.line))
+            lyr[kw.lower()] = val
+        elif kw == 'METADATA':
+            lyr['metadata'] = dict((k.lower(), v) for (k, v) in _read_pairs(tokens))
+        elif kw == 'SCALETOKEN':
+            lyr['scaletokens'].append(_read_scaletoken(tokens))
+        elif _opens_block(tok, 'LAYER'):
+            _skip_block(tokens, kw)
+    raise UnsupportedSyntax("LAYER not closed at end of file")
+
+
+def _read_pairs(tokens):
+    """Read "key" "value" pairs up to the END of a METADATA or VALUES block."""
+    pairs = []
+    while True:
+        tok = tokens.take('END')
+        if tok.keyword == 'END':
+            return pairs
+        val = tokens.take('value')
+        if val.keyword == 'END':
+            raise UnsupportedSyntax("Key without value at line {}".format(val.line))
+        pairs.append((tok.string, val.string))
+
+
+def _read_scaletoken(tokens):
+    token = {'__type__': 'scaletoken', 'name': None, 'values': collections.OrderedDict()}
+    for tok in tokens:
+        kw = tok.keyword
+        if kw == 'END':
+            return token
+        if kw == 'NAME':
+            token['name'] = tokens.take('NAME').value
+        elif kw == 'VALUES':
+            token['values'] = collections.OrderedDict(_read_pairs(tokens))
+        else:
+            raise UnsupportedSyntax("Unexpected {} in SCALETOKEN at line {}".format(tok.text, tok.line))
+    raise UnsupportedSyntax("SCALETOKEN not closed at end of file")
+
+
+def _skip_block(tokens, keyword):
+    """Skip the rest of a block opened by keyword, nested blocks and all."""
+    open_blocks = [keyword]
+    for tok in tokens:
+        kw = tok.keyword
+        if kw == 'END':
+            open_blocks.pop()
+            if not open_blocks:
+                return
+        elif kw == 'INCLUDE':
+            raise UnsupportedSyntax("INCLUDE at line {}".format(tok.line))
+        elif _opens_block(tok, open_blocks[-1]):
+            open_blocks.append(kw)
+    raise UnsupportedSyntax("Block not closed at end of file")
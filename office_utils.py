@@ -6,27 +6,20 @@ No, it isn't pretty, but its just for import here...
 Created by: Hanne L. Petersen <halpe@sdfe.dk>
 Created on: 5 Feb 2018
 """
+import itertools
 
 
 class OfficeUtils(object):
 
     @staticmethod
     def multi_lists2xlsx(lstlst, xlsx_path, headings=None, config=[]):
-        """Write a list of lists to xlsx file."""
-        if len(lstlst) < 1:
-            # TODO: print/set_msg
-            print("No data, no file written")
-            return
+        """Write a list of lists to xlsx file. Returns False if there's no data, and no file is written."""
+        if len(lstlst) < 1:  # no data, no file
+            return False
 
         import xlsxwriter
         workbook = xlsxwriter.Workbook(xlsx_path)
-
-        # Add a bold format to use to highlight cells
-        bold_fmt = workbook.add_format({'bold': True})
-        # Add locked formats for protecting cells
-        unlocked_fmt = workbook.add_format({'locked': False})
-        locked_fmt = workbook.add_format({'locked': True})
-        formats = {'bold': bold_fmt, 'unlocked': unlocked_fmt, 'locked': locked_fmt}
+        formats = OfficeUtils.add_formats(workbook)
 
         for n, l in enumerate(lstlst):  # yes, enumerate() is py2 and py3
             if 'sheetname' in config:
@@ -38,14 +31,13 @@ class OfficeUtils(object):
             OfficeUtils.write_sheet(worksheet, l, headings, config, formats)
 
         workbook.close()
+        return True
 
     @staticmethod
     def lists2xlsx(lstlst, xlsx_path, headings=None, config=[]):
-        """Write a list of lists to xlsx file."""
-        if len(lstlst) < 1:
-            # TODO: print/set_msg
-            print("No data, no file written")
-            return
+        """Write a list of lists to xlsx file. Returns False if there's no data, and no file is written."""
+        if len(lstlst) < 1:  # no data, no file
+            return False
 
         import xlsxwriter
         if 'sheetname' in config:
@@ -53,33 +45,76 @@ class OfficeUtils(object):
         else:
             sheetname = 'Sheet1'
         workbook = xlsxwriter.Workbook(xlsx_path)
+        formats = OfficeUtils.add_formats(workbook)
+
+        worksheet = workbook.add_worksheet(sheetname)
+        OfficeUtils.write_sheet(worksheet, lstlst, headings, config, formats)
+
+        workbook.close()
+        return True
+
+    @staticmethod
+    def iters2xlsx(sheets, xlsx_path, headings=None, config={}):
+        """Write rows to xlsx as they come, one sheet per (sheetname, rows) pair, where rows can be any iterable.
 
+        The workbook is written in xlsxwriter's constant_memory mode, so only the current row is kept in memory.
+        Column widths ('widths') and formats ('col_formats') go in config, as the rows aren't known up front.
+        Returns False if there are no sheets, and no file is written.
+        """
+        import xlsxwriter
+        workbook = None
+        for n, (sheetname, rows) in enumerate(sheets):
+            if workbook is None:
+                workbook = xlsxwriter.Workbook(xlsx_path, {'constant_memory': True})
+                formats = OfficeUtils.add_formats(workbook)
+            worksheet = workbook.add_worksheet(sheetname or 'Sheet{}'.format(n))
+            OfficeUtils.write_sheet(worksheet, rows, headings, config, formats)
+
+        if workbook is None:
+            return False
+        workbook.close()
+        return True
+
+    @staticmethod
+    def add_formats(workbook):
         # Add a bold format to use to highlight cells
         bold_fmt = workbook.add_format({'bold': True})
         # Add locked formats for protecting cells
         unlocked_fmt = workbook.add_format({'locked': False})
         locked_fmt = workbook.add_format({'locked': True})
-
-        worksheet = workbook.add_worksheet(sheetname)
-
-        formats = {'bold': bold_fmt, 'unlocked': unlocked_fmt, 'locked': locked_fmt}
-        OfficeUtils.write_sheet(worksheet, lstlst, headings, config, formats)
-
-        workbook.close()
+        return {'bold': bold_fmt, 'unlocked': unlocked_fmt, 'locked': locked_fmt, 'workbook': workbook}
 
     @staticmethod
     def write_sheet(worksheet, lstlst, headings, config, formats):
         row_counter = 0
 
+        # Number of columns, from the headings if possible, as lstlst may be an iterator
+        col_headings = headings or (config.get('headings') if isinstance(config, dict) else None)
+        if col_headings:
+            n_cols = len(col_headings)
+        else:
+            lstlst = iter(lstlst)
+            first = next(lstlst, None)
+            n_cols = len(first) if first else 1
+            lstlst = itertools.chain([first], lstlst) if first is not None else lstlst
+
         # Default column widths
         worksheet.set_column(0, 0, 50)  # first column wider
-        worksheet.set_column(1, len(lstlst[0])-1, 30)
+        worksheet.set_column(1, max(n_cols-1, 1), 30)
 
         # Custom column widths
         if 'widths' in config:
             for (c, w) in enumerate(config['widths']):
                 worksheet.set_column(c, c, w)  # first_col, last_col, width
 
+        # Column formats, e.g. {'num_format': '#,##0'}, or None for the default
+        if 'col_formats' in config and 'workbook' in formats:
+            widths = config.get('widths', [])
+            for (c, fmt) in enumerate(config['col_formats']):
+                if fmt:
+                    w = widths[c] if c < len(widths) else (50 if c == 0 else 30)
+                    worksheet.set_column(c, c, w, formats['workbook'].add_format(fmt))
+
         # Freeze panes
         if 'freeze' in config and config['freeze']:
             worksheet.freeze_panes(1, 0)  # Freeze top row
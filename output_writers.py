@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Output writers for the layer stats: xlsx (through OfficeUtils), CSV, JSON Lines and Parquet, picked by extension.
+
+The summarisers all have their own headings, but the non-xlsx formats share one typed column schema
+(layer_record.COLUMNS), so the map file, aprx and mxd outputs can be read and combined the same way downstream:
+scales, transparency and feature counts are numbers, visibility is a boolean, and "N/A"/"-" are nulls.
+Tables that would be separate sheets in xlsx (the maps in an aprx) get a "map" column instead.
+
+Parquet needs pyarrow, which is only imported when writing Parquet. The CSV and JSON Lines writers also work in
+py2 (ArcMap), where the text values are written as UTF-8 whether they come as str or unicode.
+"""
+import io
+import os
+import csv
+import json
+import itertools
+import collections
+
+from office_utils import OfficeUtils
+from layer_record import COLUMNS, COLUMN_TYPES
+import instrument
+
+try:
+    text_type = unicode  # py2 (ArcMap)
+    string_types = (str, unicode)
+except NameError:
+    text_type = str
+    string_types = (str,)
+PY2 = bytes is str
+
+NULLS = ('N/A', '-', '')
+TRUE_VALUES = ('TRUE', 'ON', 'DEFAULT')  # DEFAULT layers in map files are always on
+
+
+def to_type(value, typ):
+    """Convert a layer stats value to the column type, with N/A and - as None."""
+    if value is None or (isinstance(value, string_types) and value.strip() in NULLS):
+        return None
+    if typ == 'bool':
+        if isinstance(value, bool):
+            return value
+        return to_text(value).strip().upper() in TRUE_VALUES
+    if typ == 'float':
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    if typ == 'int':
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+    return to_text(value)
+
+
+def to_text(value):
+    """A value as text (unicode in py2, where str values are taken to be UTF-8)."""
+    if isinstance(value, bytes) and PY2:
+        return value.decode('utf-8', 'replace')
+    return value if isinstance(value, text_type) else text_type(value)
+
+
+def columns_for(keys, with_map=False):
+    """The summariser's column keys in schema order, plus "map" if with_map."""
+    keys = set(keys)
+    if with_map:
+        keys.add('map')
+    return [k for (k, typ) in COLUMNS if k in keys]
+
+
+def iter_records(tables):
+    """Yield the layer records of (map name, records) tables as typed dicts."""
+    for (map_name, records) in tables:
+        for rec in records:
+            typed = dict((k, to_type(getattr(rec, k), typ)) for (k, typ) in COLUMNS)
+            if map_name is not None:
+                typed['map'] = map_name
+            yield typed
+
+
+class CsvWriter(object):
+    def __init__(self, path, columns):
+        self.columns = columns
+        if PY2:  # the py2 csv module only writes bytes
+            self._f = open(path, 'wb')
+        else:
+            self._f = io.open(path, 'w', encoding='utf-8', newline='')
+        self._csv = csv.writer(self._f)
+        self._csv.writerow(columns)
+
+    def write(self, records):
+        for rec in records:
+            row = ['' if rec.get(k) is None else rec.get(k) for k in self.columns]
+            if PY2:
+                row = [v.encode('utf-8') if isinstance(v, text_type) else v for v in row]
+            self._csv.writerow(row)
+
+    def close(self):
+        self._f.close()
+
+
+class JsonLinesWriter(object):
+    def __init__(self, path, columns):
+        self.columns = columns
+        self._f = io.open(path, 'w', encoding='utf-8')
+
+    def write(self, records):
+        for rec in records:
+            line = json.dumps(collections.OrderedDict((k, rec.get(k)) for k in self.columns), ensure_ascii=False)
+            if isinstance(line, bytes):  # py2 gives str if all the values are ascii
+                line = line.decode('utf-8')
+            self._f.write(line + u'\n')
+
+    def close(self):
+        self._f.close()
+
+
+class ParquetWriter(object):
+    """Writes row groups of batch_size rows as the records come in, so many inputs can go in one file."""
+    batch_size = 10000
+
+    def __init__(self, path, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("Writing Parquet needs pyarrow, see https://pypi.org/project/pyarrow/")
+        self._pa = pyarrow
+        types = {'str': pyarrow.string(), 'bool': pyarrow.bool_(), 'float': pyarrow.float64(), 'int': pyarrow.int64()}
+        self.columns = columns
+        self.schema = pyarrow.schema([(k, types[COLUMN_TYPES[k]]) for k in columns])
+        self._writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, records):
+        records = iter(records)
+        while True:
+            batch = list(itertools.islice(records, self.batch_size))
+            if not batch:
+                return
+            arrays = [self._pa.array([rec.get(k) for rec in batch], type=self.schema.field(k).type)
+                      for k in self.columns]
+            self._writer.write_table(self._pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self._writer.close()
+
+
+WRITERS = {
+    '.csv': CsvWriter,
+    '.jsonl': JsonLinesWriter,
+    '.parquet': ParquetWriter,
+}
+XLSX_EXTENSIONS = ('.xlsx', '.xls')
+
+
+def output_path(outfile_path):
+    """The path to write to: as given for the supported formats, otherwise as xlsx."""
+    (base, ext) = os.path.splitext(outfile_path)
+    if ext.lower() in WRITERS:
+        return outfile_path
+    return base + '.xlsx'  # ensure it's xlsx and not xls
+
+
+def write_tables(outfile_path, columns, tables, config={}):
+    """Write (map name, layer records) tables to outfile_path, in the format given by its extension.
+
+    columns is the summariser's list of (column key, heading), see layer_record.
+    For xlsx each table is a sheet (named by the map name, if any), and config is passed on to OfficeUtils.
+    For the other formats all tables go in one file, with the map name in the "map" column.
+    Returns False if there are no tables, and no file is written.
+    """
+    keys = [k for (k, heading) in columns]
+    ext = os.path.splitext(outfile_path)[1].lower()
+    if ext not in WRITERS:
+        sheets = ((map_name, instrument.counted((rec.row(keys) for rec in records), 'rows_written'))
+                  for (map_name, records) in tables)
+        return OfficeUtils.iters2xlsx(sheets, outfile_path, [heading for (k, heading) in columns], config)
+    tables = iter(tables)
+    first = next(tables, None)
+    if first is None:
+        return False
+    tables = itertools.chain([first], tables)
+    writer = WRITERS[ext](outfile_path, columns_for(keys, with_map=first[0] is not None))
+    try:
+        writer.write(instrument.counted(iter_records(tables), 'rows_written'))
+    finally:
+        writer.close()
+    return True
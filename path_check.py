@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent checking of layer data sources, for the check_paths option of summarise_aprx and summarise_mxd.
+
+The sources are deduplicated first, as many layers tend to point at the same feature classes and shares,
+and the unique ones are checked on a bounded number of threads. A check that takes longer than the timeout is
+reported as "timeout" and its thread is left behind, so a stalled network share can't hold up the rest.
+
+The check function is pluggable (arcpy.Exists in the summarisers), so this also works with a local stand-in.
+Works in both py2 (ArcMap) and py3.
+"""
+import os
+import time
+import threading
+import collections
+try:
+    import queue
+except ImportError:  # py2
+    import Queue as queue
+
+import instrument
+
+OK = 'OK'
+MISSING = 'missing'
+TIMEOUT = 'timeout'
+ERROR = 'error'
+
+DEFAULT_WORKERS = 8
+DEFAULT_TIMEOUT = 30.0  # seconds per check
+
+
+def normalise_source(src):
+    """The key used to deduplicate sources."""
+    return os.path.normcase(src.strip())
+
+
+def check_sources(sources, check_func, max_workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT, progress=None):
+    """Check data sources with check_func (returning True if the source exists), each distinct source only once.
+
+    Returns a dict of source -> OK, MISSING, TIMEOUT or ERROR. Empty sources are left out.
+    progress, if given, is called with (checked, total) as the checks complete.
+    """
+    unique = collections.OrderedDict()
+    for src in sources:
+        if src:
+            unique.setdefault(normalise_source(src), src)
+
+    instrument.count('paths_checked', len(unique))
+    results = {}
+    pending = collections.deque(unique.items())
+    running = {}  # key -> start time
+    done_q = queue.Queue()
+    reported = 0
+    while pending or running:
+        while pending and len(running) < max_workers:
+            (key, src) = pending.popleft()
+            t = threading.Thread(target=_run_check, args=(check_func, key, src, done_q))
+            t.daemon = True  # don't keep the process alive for a hanging check
+            running[key] = time.time()
+            t.start()
+
+        wait = min(running.values()) + timeout - time.time()
+        try:
+            (key, status) = done_q.get(timeout=max(wait, 0.001))
+            if key in running:  # otherwise it already timed out
+                del running[key]
+                results[key] = status
+        except queue.Empty:
+            now = time.time()
+            for (key, start) in list(running.items()):
+                if now - start >= timeout:
+                    del running[key]
+                    results[key] = TIMEOUT
+        if progress and len(results) != reported:
+            reported = len(results)
+            progress(reported, len(unique))
+
+    return dict((src, results[normalise_source(src)]) for src in sources if src)
+
+
+def _run_check(check_func, key, src, done_q):
+    try:
+        status = OK if check_func(src) else MISSING
+    except Exception:
+        status = ERROR
+    done_q.put((key, status))
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Pipelined runs: the items (e.g. map files) go through a chain of stages (e.g. read, parse, write) connected by
+bounded queues, each stage with its own number of workers, so reading the inputs, parsing them and writing the
+outputs overlap instead of taking turns.
+
+A full queue holds up the stage before it (backpressure), and at most max_in_flight items are between being fed in
+and being handed back, so the memory use is bounded by the queue depths, not by the number or size of the inputs.
+The workers are threads, which suits the I/O bound stages (network shares, writing files). A CPU bound stage can be
+run in a pool of processes with processes=True; its function and values must then be picklable.
+
+The results are handed back in input order. An item that fails in a stage skips the rest of the stages and is
+handed back with its error, so one bad input doesn't stop the rest.
+"""
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import instrument
+
+DEFAULT_DEPTH = 4
+_DONE = object()  # end of the items, passed down the queues
+
+
+class Stage(object):
+    """A step of a pipeline: func(value) -> value for the next stage, run on a number of workers."""
+
+    def __init__(self, name, func, workers=1, processes=False):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers or 1)
+        self.processes = processes
+
+    def __repr__(self):
+        return 'Stage({!r}, workers={})'.format(self.name, self.workers)
+
+
+def parse_workers(text, count):
+    """A comma separated list of worker counts (e.g. "4,2,2"), one per stage, for count stages. Missing or empty
+    counts are None, i.e. the default of the stage."""
+    if text is True or not text:
+        return [None] * count
+    counts = [int(s) if s.strip() else None for s in text.split(',')]
+    if len(counts) > count:
+        raise ValueError("Expected at most {} worker counts, got {}".format(count, text))
+    return counts + [None] * (count - len(counts))
+
+
+def run(items, stages, depth=DEFAULT_DEPTH, max_in_flight=None):
+    """Run items through stages, yielding (item, value, error) in the order of items, where value is the result of
+    the last stage (the item itself is the value for the first stage), and error is None or the exception that
+    stopped the item. Each queue holds at most depth items."""
+    stages = list(stages)
+    if max_in_flight is None:
+        max_in_flight = sum(stage.workers for stage in stages) + depth * (len(stages) + 1)
+    slots = threading.Semaphore(max_in_flight)
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=depth) for _ in range(len(stages) + 1)]
+    pools = [ProcessPoolExecutor(max_workers=stage.workers) if stage.processes else None for stage in stages]
+    threads = [threading.Thread(target=_feed, args=(items, queues[0], slots, stop), name='pipeline feed')]
+    for (n, stage) in enumerate(stages):
+        running = [stage.workers, threading.Lock()]  # the last worker to finish passes the end on
+        for i in range(stage.workers):
+            threads.append(threading.Thread(target=_work, args=(stage, pools[n], queues[n], queues[n + 1], running,
+                                                                stop), name='pipeline {} {}'.format(stage.name, i)))
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    done = False
+    try:
+        pending = {}  # results that came out ahead of an earlier item
+        next_n = 0
+        while True:
+            job = queues[-1].get()
+            if job is _DONE:
+                done = True
+                break
+            pending[job[0]] = job
+            while next_n in pending:
+                (n, item, value, error) = pending.pop(next_n)
+                next_n += 1
+                slots.release()
+                yield (item, value, error)
+    finally:
+        stop.set()  # if the consumer stopped early: skip the rest, and let the workers run out
+        if not done:
+            while queues[-1].get() is not _DONE:
+                slots.release()
+        for t in threads:
+            t.join()
+        for pool in pools:
+            if pool:
+                pool.shutdown()
+
+
+def _feed(items, out_q, slots, stop):
+    try:
+        for (n, item) in enumerate(items):
+            slots.acquire()
+            if stop.is_set():
+                break
+            out_q.put((n, item, item, None))
+    finally:
+        out_q.put(_DONE)
+
+
+def _work(stage, pool, in_q, out_q, running, stop):
+    while True:
+        job = in_q.get()
+        if job is _DONE:
+            in_q.put(_DONE)  # for the other workers of the stage
+            with running[1]:
+                running[0] -= 1
+                last = not running[0]
+            if last:
+                out_q.put(_DONE)
+            return
+        (n, item, value, error) = job
+        if error is None and not stop.is_set():
+            try:
+                with instrument.span('stage ' + stage.name):
+                    if pool:
+                        value = pool.submit(stage.func, value).result()
+                    else:
+                        value = stage.func(value)
+            except Exception as e:
+                (value, error) = (None, e)
+        out_q.put((n, item, value, error))
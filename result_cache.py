@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+An on-disk cache of extracted layer stats, shared by the map file, aprx and mxd summarisers.
+
+Results are stored in SQLite, keyed by a hash of the input contents plus the options that change the output
+(e.g. split_scale_lyrs, drop_includes, the aprx engine). The cache is size-bounded, and the least recently used
+results are evicted first. Re-running over unchanged inputs then skips the parsing and only rewrites the output.
+
+The "Data OK?" values aren't cached: the data sources can come and go without the input changing, so with
+check_paths (or check_tables) the summarisers check them anew after the lookup.
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+CACHE_VERSION = 5  # bump when the layer stats change shape, to ignore older results
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def default_cache_path():
+    """The cache file, from $SUMMARISE_CACHE or in the user's local app data/cache folder."""
+    if os.environ.get('SUMMARISE_CACHE'):
+        return os.environ['SUMMARISE_CACHE']
+    base = os.environ.get('LOCALAPPDATA') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'summarise_geoproject', 'results.sqlite')
+
+
+def open_cache(cache=True):
+    """Open a ResultCache from a cache argument: True for the default location, a path, or False/None for none."""
+    if not cache:
+        return None
+    if cache is True:
+        return ResultCache()
+    if isinstance(cache, ResultCache):
+        return cache
+    return ResultCache(cache)
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            h.update(chunk)
+            chunk = f.read(chunk_size)
+    return h.hexdigest()
+
+
+class ResultCache(object):
+    def __init__(self, path=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path or default_cache_path()
+        self.max_bytes = max_bytes
+        folder = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:  # a parallel worker got there first
+                pass
+        self._con = sqlite3.connect(self.path, timeout=30)
+        try:
+            self._con.execute('PRAGMA journal_mode=WAL')  # lets batch workers read while one writes
+        except sqlite3.DatabaseError:  # e.g. not supported on network drives
+            pass
+        with self._con:
+            self._con.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, payload TEXT NOT NULL, '
+                              'size INTEGER NOT NULL, last_used REAL NOT NULL)')
+            self._con.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+
+    @staticmethod
+    def key(content_hash, **options):
+        """Make a cache key from the input content hash and the options that affect the output."""
+        opts = json.dumps(options, sort_keys=True)
+        return hash_bytes('{}|{}|{}'.format(CACHE_VERSION, content_hash, opts).encode('utf-8'))
+
+    def get(self, key):
+        """Get a cached result, or None."""
+        row = self._con.execute('SELECT payload FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        with self._con:
+            self._con.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key, result):
+        """Store a (JSON serialisable) result, evicting the least recently used results if the cache gets too big."""
+        payload = json.dumps(result)
+        with self._con:
+            self._con.execute('INSERT OR REPLACE INTO results (key, payload, size, last_used) VALUES (?, ?, ?, ?)',
+                              (key, payload, len(payload), time.time()))
+        self.evict()
+
+    def get_many(self, keys):
+        """Get the cached results of many keys at once, as a dict of key -> result for the ones found."""
+        found = {}
+        keys = list(keys)
+        for n in range(0, len(keys), 500):  # keep under SQLite's limit on query parameters
+            chunk = keys[n:n + 500]
+            sql = 'SELECT key, payload FROM results WHERE key IN ({})'.format(','.join('?' * len(chunk)))
+            found.update((key, json.loads(payload)) for (key, payload) in self._con.execute(sql, chunk))
+        if found:
+            now = time.time()
+            with self._con:
+                self._con.executemany('UPDATE results SET last_used = ? WHERE key = ?', [(now, k) for k in found])
+        return found
+
+    def put_many(self, results):
+        """Store a dict of key -> result in one transaction."""
+        now = time.time()
+        rows = []
+        for (key, result) in results.items():
+            payload = json.dumps(result)
+            rows.append((key, payload, len(payload), now))
+        with self._con:
+            self._con.executemany('INSERT OR REPLACE INTO results (key, payload, size, last_used) VALUES (?, ?, ?, ?)',
+                                  rows)
+        self.evict()
+
+    def evict(self):
+        total = self._con.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        drop = []
+        for (key, size) in self._con.execute('SELECT key, size FROM results ORDER BY last_used').fetchall():
+            if total <= self.max_bytes:
+                break
+            drop.append((key,))
+            total -= size
+        with self._con:
+            self._con.executemany('DELETE FROM results WHERE key = ?', drop)
+
+    def clear(self):
+        with self._con:
+            self._con.execute('DELETE FROM results')
+
+    def close(self):
+        self._con.close()
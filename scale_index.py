@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+An interval index over the scale ranges of the summarised layers, and a report of the layers and data sources that
+are active at each of a list of scales (zoom levels), to spot the scales where a map draws a lot.
+
+A layer is active at scale S if max_scale <= S < min_scale (max_scale is the zoomed in end, MINSCALEDENOM in map
+files), with a missing end taken as open. ScaleIndex is a centred interval tree, so the layers active at a scale are
+found in O(log n + k), and counted in O(log n). With split scale layers, each interval of a layer is its own record.
+
+The report goes in a file of its own next to the output, like the map file diff. Works in both py2 (ArcMap) and py3.
+"""
+import os
+import csv
+import bisect
+
+import output_writers
+from office_utils import OfficeUtils
+
+# Common map scales, from the zoomed in end
+DEFAULT_SCALES = [500, 1000, 2000, 5000, 10000, 25000, 50000, 100000, 250000, 500000, 1000000, 2000000, 5000000]
+REPORT_HEADINGS = ['Map', 'Scale', 'Layers', 'Visible layers', 'Data sources']
+REPORT_WIDTHS = [20, 12, 10, 10, 12]
+INF = float('inf')
+
+
+def parse_scales(text):
+    """A comma separated list of scales (e.g. "1000,5000,1:25000"), or the default scales for True/empty."""
+    if text is True or not text:
+        return list(DEFAULT_SCALES)
+    return sorted(float(s.strip().split(':')[-1]) for s in text.split(',') if s.strip())
+
+
+def scale_range(rec):
+    """The (from, to) scales a layer record is active in, with 0 and infinity for open ends."""
+    return scale_bounds(rec.max_scale, rec.min_scale)
+
+
+def scale_bounds(max_scale, min_scale):
+    """The (from, to) scales of a layer's max. and min. scale (as in the layer records), with open ends as 0 and
+    infinity."""
+    lo = output_writers.to_type(max_scale, 'float')
+    hi = output_writers.to_type(min_scale, 'float')
+    return (lo or 0.0, hi or INF)  # 0 means no limit for the scale thresholds in ArcGIS
+
+
+class _Node(object):
+    __slots__ = ('center', 'by_lo', 'by_hi', 'left', 'right')
+
+
+class ScaleIndex(object):
+    """A static interval tree over (from, to, value) items, where from <= scale < to."""
+
+    def __init__(self, items):
+        items = [(lo, hi, value) for (lo, hi, value) in items if lo < hi]
+        self._los = sorted(lo for (lo, hi, value) in items)
+        self._his = sorted(hi for (lo, hi, value) in items)
+        self._root = self._build(items)
+
+    def __len__(self):
+        return len(self._los)
+
+    @classmethod
+    def from_records(cls, records):
+        return cls((lo, hi, rec) for rec in records for (lo, hi) in [scale_range(rec)])
+
+    def _build(self, items):
+        if not items:
+            return None
+        ends = sorted(e for (lo, hi, value) in items for e in (lo, hi))
+        node = _Node()
+        node.center = ends[(len(ends) - 1) // 2]  # the lower median, so the node always gets at least one item
+        here = [it for it in items if it[0] <= node.center < it[1]]
+        node.by_lo = sorted(here, key=lambda it: it[0])
+        node.by_hi = sorted(here, key=lambda it: -it[1])
+        node.left = self._build([it for it in items if it[1] <= node.center])
+        node.right = self._build([it for it in items if it[0] > node.center])
+        return node
+
+    def at(self, scale):
+        """The values of the items active at scale."""
+        found = []
+        node = self._root
+        while node is not None:
+            if scale < node.center:  # all the node's items end after scale
+                for (lo, hi, value) in node.by_lo:
+                    if lo > scale:
+                        break
+                    found.append(value)
+                node = node.left
+            else:  # all the node's items start at or before scale
+                for (lo, hi, value) in node.by_hi:
+                    if hi <= scale:
+                        break
+                    found.append(value)
+                node = node.right
+        return found
+
+    def count_at(self, scale):
+        """The number of items active at scale: started at or before it, minus those ended by then."""
+        return bisect.bisect_right(self._los, scale) - bisect.bisect_right(self._his, scale)
+
+
+def _source(rec):
+    src = rec.data_path
+    if src is None or src.strip() in output_writers.NULLS or src == '[group layer]':
+        return None
+    return os.path.normcase(src.strip())
+
+
+def zoom_report(tables, scales=None):
+    """Rows of [map, scale, active layers, of those visible, distinct data sources] for (map name, records) tables.
+    Group layers aren't counted."""
+    rows = []
+    for (map_name, records) in tables:
+        index = ScaleIndex.from_records(rec for rec in records if rec.data_path != '[group layer]')
+        for scale in scales or DEFAULT_SCALES:
+            active = index.at(scale)
+            visible = sum(1 for rec in active if output_writers.to_type(rec.visible, 'bool'))
+            sources = set(_source(rec) for rec in active)
+            sources.discard(None)
+            rows.append([map_name or '-', scale, len(active), visible, len(sources)])
+    return rows
+
+
+def report_path(outfile_path):
+    """The report file next to the output: csv for csv outputs, xlsx otherwise."""
+    (base, ext) = os.path.splitext(outfile_path)
+    return base + '_zoom' + ('.csv' if ext.lower() == '.csv' else '.xlsx')
+
+
+def write_report(tables, outfile_path, scales=None):
+    """Write the zoom report of (map name, records) tables next to outfile_path. Returns the report path."""
+    return write_rows(zoom_report(tables, scales), outfile_path)
+
+
+def write_rows(rows, outfile_path):
+    """Write zoom_report rows (e.g. gathered map file by map file in a batch) next to outfile_path. Returns the
+    report path."""
+    path = report_path(outfile_path)
+    if path.endswith('.csv'):
+        with open(path, 'w') as f:
+            writer = csv.writer(f, lineterminator='\n')
+            writer.writerow(REPORT_HEADINGS)
+            writer.writerows(rows)
+    else:
+        OfficeUtils.iters2xlsx([('Zoom levels', rows)], path, REPORT_HEADINGS, {'widths': REPORT_WIDTHS})
+    return path
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+SCALETOKEN handling for the map file summary.
+
+A SCALETOKEN block gives a token (e.g. %lvl%) a value per scale: each value applies from its scale up to the next
+one. compile_tokens turns the tokens of a layer into a ScaleTokens, which replaces all of them in one regex pass, and
+for the split_scale_lyrs rows builds the table of scale intervals once per set of tokens used. With several tokens the
+intervals are split at all their scales, so each row has the values that apply together at that scale.
+
+Layers tend to share their tokens (often through an INCLUDE), so the compiled tokens are memoised.
+"""
+import re
+import functools
+
+NO_SCALE = '-'
+
+
+def compile_tokens(scaletokens):
+    """Compile a layer's scaletokens (dicts with name and values, as read by mappyfile or mapfile_tokenizer)."""
+    key = tuple((t['name'], tuple((scl, _strip_using(v)) for (scl, v) in t['values'].items() if scl != '__type__'))
+                for t in scaletokens if t.get('name'))
+    return _compile(key)
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile(key):
+    return ScaleTokens(key)
+
+
+class ScaleTokens(object):
+    """The scale tokens of a layer, from a tuple of (name, ((scale, value), ...))."""
+    def __init__(self, tokens):
+        self.values = dict((name, vals) for (name, vals) in tokens)
+        if self.values:
+            names = sorted(self.values, key=len, reverse=True)  # longest first, in case one name contains another
+            self._re = re.compile('|'.join(re.escape(n) for n in names))
+        else:
+            self._re = None
+        self._summaries = dict((name, '[{}]'.format(';'.join(v for (scl, v) in vals))) for (name, vals) in tokens)
+        self._tables = {}  # frozenset of token names -> interval table
+
+    def __bool__(self):
+        return bool(self.values)
+
+    __nonzero__ = __bool__
+
+    def used_in(self, text):
+        """The names of the tokens in text."""
+        if self._re is None:
+            return frozenset()
+        return frozenset(self._re.findall(text))
+
+    def summarise(self, text):
+        """Replace each token in text by all its values, as [value1;value2;...]."""
+        if self._re is None:
+            return text
+        return self._re.sub(lambda m: self._summaries[m.group(0)], text)
+
+    def expand(self, text):
+        """Yield (max_scale, min_scale, text) per scale interval of the tokens in text, with the tokens replaced.
+
+        max_scale is the scale the interval starts at, min_scale the scale before the next interval, or '-' for the
+        last one. Scales where a token has no value yet leave it as it is.
+        """
+        used = self.used_in(text)
+        if not used:
+            return
+        for (lo, hi, values) in self.table(used):
+            yield (lo, hi, self._re.sub(lambda m: values.get(m.group(0), m.group(0)), text))
+
+    def table(self, names):
+        """The list of (max_scale, min_scale, {name: value}) intervals for the given token names."""
+        names = frozenset(names)
+        if names not in self._tables:
+            self._tables[names] = self._build_table(names)
+        return self._tables[names]
+
+    def _build_table(self, names):
+        scales = [dict((_scale(scl), v) for (scl, v) in self.values[n]) for n in names]
+        breaks = sorted(set(s for by_scale in scales for s in by_scale))
+        table = []
+        current = {}
+        for (i, lo) in enumerate(breaks):
+            for (n, by_scale) in zip(names, scales):
+                if lo in by_scale:
+                    current[n] = by_scale[lo]
+            hi = breaks[i + 1] - 1 if i + 1 < len(breaks) else NO_SCALE
+            table.append((lo, hi, dict(current)))
+        return table
+
+
+def _scale(scl):
+    try:
+        return int(scl)
+    except ValueError:
+        return float(scl)
+
+
+def _strip_using(s):
+    try:
+        return s[:s.lower().index(' using')]
+    except ValueError:
+        return s
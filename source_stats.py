@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+Statistics of the file based data behind map file layers, read from the file headers only: the feature count,
+extent and size on disk, for the data_stats option of summarise_mapfile.
+
+- Shape files: the extent from the .shp header and the record count from the .shx header (or the .dbf header),
+  and the size of the .shp with all its sidecar files.
+- GeoPackages (OGR layers): the feature count from gpkg_ogr_contents and the extent from gpkg_contents, as written
+  by GDAL, without counting any rows.
+- GeoTIFFs: the extent from the size, pixel scale and tie point tags of the first image.
+- Anything else: just the size.
+
+The headers are read through mmap, so only the pages needed are read, also on network shares. The stats are cached
+per file in the result cache, keyed by path, mtime and size (with those of a shape file's sidecar files), and the
+distinct files are read on a pool of threads.
+"""
+import os
+import mmap
+import struct
+import sqlite3
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import result_cache
+import instrument
+
+DEFAULT_WORKERS = 8
+SHAPE_SIDECARS = ('.shp', '.shx', '.dbf', '.prj', '.cpg', '.qix', '.sbn', '.sbx')
+RASTER_EXTENSIONS = ('.tif', '.tiff')
+
+# TIFF field type -> struct format
+_TIFF_TYPES = {1: 'B', 3: 'H', 4: 'I', 11: 'f', 12: 'd', 16: 'Q'}
+_TIFF_WIDTH, _TIFF_HEIGHT, _TIFF_PIXEL_SCALE, _TIFF_TIEPOINT = 256, 257, 33550, 33922
+
+
+@contextlib.contextmanager
+def mapped(path):
+    """The contents of a file, memory-mapped read-only (an empty bytes for an empty file)."""
+    with open(path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # empty files can't be mapped
+            yield b''
+            return
+        try:
+            yield mm
+        finally:
+            mm.close()
+
+
+def format_extent(xmin, ymin, xmax, ymax):
+    return ', '.join('{}'.format(round(v, 3)) for v in (xmin, ymin, xmax, ymax))
+
+
+def shapefile_stats(path):
+    """(features, extent, size) of a shape file."""
+    base = os.path.splitext(path)[0]
+    with mapped(path) as shp:
+        if len(shp) < 100 or struct.unpack('>i', shp[:4])[0] != 9994:
+            raise ValueError("Not a shape file: {}".format(path))
+        bbox = struct.unpack('<4d', shp[36:68])
+    features = None
+    if os.path.isfile(base + '.shx'):
+        with mapped(base + '.shx') as shx:
+            features = (struct.unpack('>i', shx[24:28])[0] * 2 - 100) // 8  # the length is in 16 bit words
+    elif os.path.isfile(base + '.dbf'):
+        with mapped(base + '.dbf') as dbf:
+            features = struct.unpack('<I', dbf[4:8])[0]
+    size = sum(os.path.getsize(base + ext) for ext in SHAPE_SIDECARS if os.path.isfile(base + ext))
+    return (features, format_extent(*bbox) if features else None, size)
+
+
+def geopackage_stats(path, table=None):
+    """(features, extent, size) of a table in a GeoPackage, or the feature count of all its tables."""
+    con = sqlite3.connect('file:{}?mode=ro'.format(path.replace('?', '%3f').replace('#', '%23')), uri=True)
+    try:
+        features = extent = None
+        try:
+            if table:
+                row = con.execute('SELECT feature_count FROM gpkg_ogr_contents WHERE lower(table_name) = lower(?)',
+                                  (table,)).fetchone()
+                features = row[0] if row else None
+            else:
+                features = con.execute('SELECT SUM(feature_count) FROM gpkg_ogr_contents').fetchone()[0]
+        except sqlite3.OperationalError:  # not written by GDAL
+            pass
+        if table:
+            row = con.execute('SELECT min_x, min_y, max_x, max_y FROM gpkg_contents WHERE lower(table_name) = lower(?)',
+                              (table,)).fetchone()
+            if row and None not in row:
+                extent = format_extent(*row)
+    finally:
+        con.close()
+    return (features, extent, os.path.getsize(path))
+
+
+def geotiff_stats(path):
+    """(None, extent, size) of a GeoTIFF, the extent is None if it isn't georeferenced by tags."""
+    with mapped(path) as buf:
+        tags = _tiff_tags(buf, (_TIFF_WIDTH, _TIFF_HEIGHT, _TIFF_PIXEL_SCALE, _TIFF_TIEPOINT))
+    extent = None
+    if len(tags) == 4:
+        (width, height) = (tags[_TIFF_WIDTH][0], tags[_TIFF_HEIGHT][0])
+        (sx, sy) = tags[_TIFF_PIXEL_SCALE][:2]
+        (i, j, _, x, y, _) = tags[_TIFF_TIEPOINT][:6]
+        xmin = x - i * sx
+        ymax = y + j * sy
+        extent = format_extent(xmin, ymax - height * sy, xmin + width * sx, ymax)
+    return (None, extent, os.path.getsize(path))
+
+
+def _tiff_tags(buf, wanted):
+    """The values (tuples) of the wanted tags of the first image in a (classic or Big) TIFF."""
+    order = {b'II': '<', b'MM': '>'}.get(bytes(buf[:2]))
+    if order is None:
+        raise ValueError("Not a TIFF")
+    version = struct.unpack(order + 'H', buf[2:4])[0]
+    if version == 42:
+        (ifd, count_fmt, entry_fmt, inline) = (struct.unpack(order + 'I', buf[4:8])[0], 'H', 'HHI', 4)
+    elif version == 43:  # BigTIFF
+        (ifd, count_fmt, entry_fmt, inline) = (struct.unpack(order + 'Q', buf[8:16])[0], 'Q', 'HHQ', 8)
+    else:
+        raise ValueError("Not a TIFF")
+    count_size = struct.calcsize(count_fmt)
+    n = struct.unpack(order + count_fmt, buf[ifd:ifd + count_size])[0]
+    entry_size = struct.calcsize(order + entry_fmt) + inline
+    tags = {}
+    for pos in range(ifd + count_size, ifd + count_size + n * entry_size, entry_size):
+        (tag, typ, count) = struct.unpack(order + entry_fmt, buf[pos:pos + entry_size - inline])
+        if tag not in wanted or typ not in _TIFF_TYPES:
+            continue
+        fmt = order + _TIFF_TYPES[typ] * count
+        size = struct.calcsize(fmt)
+        offset = pos + entry_size - inline
+        if size > inline:
+            offset = struct.unpack(order + ('I' if inline == 4 else 'Q'), buf[offset:offset + inline])[0]
+        tags[tag] = struct.unpack(fmt, buf[offset:offset + size])
+    return tags
+
+
+def file_stats(path, table=None):
+    """(features, extent, size) of a data file, from its extension. Raises OSError if it can't be read."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.shp':
+        return shapefile_stats(path)
+    if ext == '.gpkg':
+        return geopackage_stats(path, table)
+    if ext in RASTER_EXTENSIONS:
+        return geotiff_stats(path)
+    return (None, None, os.path.getsize(path))
+
+
+def _safe_stats(path, table):
+    try:
+        return list(file_stats(path, table))
+    except (OSError, ValueError, struct.error, sqlite3.Error):
+        return None
+
+
+def signature(path):
+    """What the stats of a file depend on: its mtime and size, and for a shape file those of its sidecar files,
+    as the record count is read from the .shx (or .dbf) and the size includes them all. Raises OSError if the file
+    is missing."""
+    st = os.stat(path)
+    sig = [st.st_mtime, st.st_size]
+    (base, ext) = os.path.splitext(path)
+    if ext.lower() == '.shp':
+        for sidecar in SHAPE_SIDECARS[1:]:
+            try:
+                st = os.stat(base + sidecar)
+            except OSError:
+                continue
+            sig += [sidecar, st.st_mtime, st.st_size]
+    return sig
+
+
+def get_stats(sources, cache=True, max_workers=DEFAULT_WORKERS):
+    """The (features, extent, size) of (path, table) sources as a dict, each distinct file read once, concurrently.
+    Missing and unreadable files are left out."""
+    sources = set(sources)
+    sigs = {}
+    for (path, table) in sources:
+        try:
+            sigs[(path, table)] = signature(path)
+        except OSError:
+            continue
+
+    cache = result_cache.open_cache(cache)
+    try:
+        keys = {}
+        found = {}
+        if cache:
+            keys = dict((src, cache.key(result_cache.hash_bytes(os.path.abspath(src[0]).encode('utf-8')),
+                                        tool='source stats', table=src[1], signature=sig))
+                        for (src, sig) in sigs.items())
+            cached = cache.get_many(keys.values())
+            found = dict((src, cached[key]) for (src, key) in keys.items() if key in cached)
+            instrument.count('source_stats_cache_hits', len(found))
+        todo = [src for src in sigs if src not in found]
+        instrument.count('source_files_read', len(todo))
+        if todo:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                for (src, stats) in zip(todo, pool.map(lambda s: _safe_stats(*s), todo)):
+                    if stats is not None:
+                        found[src] = stats
+            if cache:
+                cache.put_many(dict((keys[src], found[src]) for src in todo if src in found))
+    finally:
+        if cache:
+            cache.close()
+    return dict((src, tuple(stats)) for (src, stats) in found.items())
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+One command for summarising map files, aprx and mxd files: picks the summariser from the file extension.
+
+The summarisers are registered in ENGINES by extension, and each one imports its module (and through that arcpy,
+mappyfile, xlsxwriter...) only when it's run, so e.g. a map file run never touches arcpy and --help is instant.
+A directory or a glob is summarised as a batch of map files.
+
+Usage: python summarise.py INPUT [OUTPUT] [options], see --help.
+"""
+from __future__ import print_function
+import os
+import sys
+import argparse
+import collections
+
+import instrument
+
+ENGINES = collections.OrderedDict()  # extension -> function(src, out, opts, set_msg)
+
+
+def engine(*extensions):
+    """Register a summariser function for the given file extensions."""
+    def register(func):
+        for ext in extensions:
+            ENGINES[ext.lower()] = func
+        return func
+    return register
+
+
+@engine('.map')
+def _run_mapfile(src, out, opts, set_msg=None):
+    import summarise_mapfile
+    if set_msg:
+        summarise_mapfile.set_msg = set_msg
+    reader = 'fast' if opts.get('fast') else 'mappyfile'
+    if opts.get('diff'):
+        summarise_mapfile.main_diff(opts['diff'], src, out, opts.get('split_scale'), not opts.get('includes'),
+                                    engine=reader, cache=opts.get('cache', True))
+    elif is_batch(src):
+        summarise_mapfile.main_batch(src, out, opts.get('split_scale'), not opts.get('includes'),
+                                     combined=not opts.get('per_file'), max_workers=opts.get('workers'),
+                                     engine=reader, cache=opts.get('cache', True),
+                                     out_format='.' + (opts.get('format') or 'xlsx'),
+                                     incremental=opts.get('incremental'), inventory=opts.get('inventory'),
+                                     check_tables=opts.get('check_tables'), data_stats=opts.get('data_stats'),
+                                     pipelined=bool(opts.get('pipeline')), stage_workers=_stage_workers(opts),
+                                     queue_depth=opts.get('queue_depth'), layer_filter=_layer_filter(opts),
+                                     zoom_scales=_zoom_scales(opts))
+    else:
+        summarise_mapfile.main(src, out, opts.get('split_scale'), not opts.get('includes'), engine=reader,
+                               cache=opts.get('cache', True), incremental=opts.get('incremental'),
+                               inventory=opts.get('inventory'), check_tables=opts.get('check_tables'),
+                               data_stats=opts.get('data_stats'), zoom_scales=_zoom_scales(opts),
+                               layer_filter=_layer_filter(opts))
+
+
+@engine('.aprx')
+def _run_aprx(src, out, opts, set_msg=None):
+    import summarise_aprx
+    if set_msg:
+        summarise_aprx.set_msg = set_msg
+    summarise_aprx.summarise_aprx(src, out, opts.get('check_paths'), opts.get('cache', True),
+                                  'cim' if opts.get('cim') else None, opts.get('inventory'), _zoom_scales(opts),
+                                  _layer_filter(opts))
+
+
+@engine('.mxd')
+def _run_mxd(src, out, opts, set_msg=None):
+    import summarise_mxd
+    if set_msg:
+        summarise_mxd.set_msg = set_msg
+    summarise_mxd.summarise_mxd(src, out, opts.get('check_paths'), opts.get('cache', True), opts.get('inventory'),
+                                opts.get('describe_cache'), _zoom_scales(opts), _layer_filter(opts))
+
+
+def _zoom_scales(opts):
+    if not opts.get('zoom_report'):
+        return None
+    import scale_index
+    return scale_index.parse_scales(opts['zoom_report'])
+
+
+def _layer_filter(opts):
+    if not opts.get('filter'):
+        return None
+    import layer_filter
+    return layer_filter.LayerFilter.parse(opts['filter'])
+
+
+def _stage_workers(opts):
+    if not opts.get('pipeline'):
+        return None
+    import pipeline
+    return pipeline.parse_workers(opts['pipeline'], 3)
+
+
+def _run_watch(src, out, opts, set_msg=None):
+    import watch
+    import summarise_mapfile
+    import summarise_aprx
+    if set_msg:
+        watch.set_msg = summarise_mapfile.set_msg = summarise_aprx.set_msg = set_msg
+    watch.watch(src, out, opts.get('aprx'), opts.get('interval') or 2.0, split_scale_lyrs=opts.get('split_scale'),
+                drop_includes=not opts.get('includes'), engine='fast' if opts.get('fast') else 'mappyfile',
+                cache=opts.get('cache', True), inventory=opts.get('inventory'),
+                check_tables=opts.get('check_tables'), layer_filter=_layer_filter(opts),
+                zoom_scales=_zoom_scales(opts))
+
+
+def is_batch(src):
+    """A directory or a glob is a batch of map files."""
+    return os.path.isdir(src) or any(c in src for c in '*?[')
+
+
+def get_engine(src):
+    if is_batch(src):
+        return ENGINES['.map']
+    ext = os.path.splitext(src)[1].lower()
+    if ext not in ENGINES:
+        raise ValueError("Don't know how to summarise {} files, only {}".format(ext, ', '.join(ENGINES)))
+    return ENGINES[ext]
+
+
+def default_output(src, per_file=False, diff=False):
+    """Next to the input, or in the current folder for batches."""
+    if is_batch(src):
+        return 'summary' if per_file else 'summary.xlsx'
+    return os.path.splitext(src)[0] + ('_diff.xlsx' if diff else '.xlsx')
+
+
+def run(src, out=None, set_msg=None, **opts):
+    """Summarise src (a map file, aprx, mxd, or a directory/glob of map files) to out.
+
+    With the timings option (a json path), the time spent in each phase and the counters are reported and saved there,
+    see instrument. profile (a path for the cProfile stats) and trace_memory turn on profiling.
+    """
+    func = _run_watch if opts.get('watch') else get_engine(src)
+    out = out or default_output(src, opts.get('per_file'), opts.get('diff'))
+    instrument.reset()
+    with instrument.profile(opts.get('profile'), opts.get('trace_memory'), set_msg or print):
+        with instrument.span('summarise'):
+            func(src, out, opts, set_msg)
+    if opts.get('timings'):
+        instrument.report(set_msg or print)
+        instrument.export_json(opts['timings'])
+    return out
+
+
+def warm_up():
+    """Import the summarisers, and arcpy if it's there, up front, e.g. in a long-lived worker (see job_server)."""
+    import summarise_mapfile
+    import summarise_aprx
+    if summarise_aprx.has_arcpy():
+        summarise_aprx.import_arcpy()
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='summarise', description=__doc__.strip().split('\n')[0])
+    parser.add_argument('input', help="map file, aprx or mxd, or a directory or glob of map files")
+    parser.add_argument('output', nargs='?',
+                        help="xlsx, csv, jsonl or parquet file, or a folder for --per-file "
+                             "(default: xlsx next to the input)")
+    parser.add_argument('--no-cache', dest='cache', action='store_false', help="don't use the result cache")
+    parser.add_argument('--inventory', nargs='?', const=True, metavar='DB',
+                        help="also store the layers in the inventory (see inventory.py), optionally in this file")
+    parser.add_argument('--zoom-report', nargs='?', const=True, metavar='SCALES',
+                        help="also report the layers and data sources active at each scale, for the given comma "
+                             "separated scales or common ones")
+    parser.add_argument('--filter', action='append', metavar='COND',
+                        help="only summarise the layers that meet the condition: group=GLOB, name=GLOB, source=TEXT, "
+                             "scale=FROM-TO or visible=yes/no (can be repeated, or separated by ;)")
+    parser.add_argument('--timings', metavar='JSON', help="report the time spent per phase, and save it to this file")
+    parser.add_argument('--profile', metavar='PROF', help="run cProfile, and save the stats to this file")
+    parser.add_argument('--trace-memory', action='store_true', help="report the peak memory use and top allocations")
+
+    grp = parser.add_argument_group('map files')
+    grp.add_argument('--split-scale', action='store_true', help="one row per scale for layers with SCALETOKENs")
+    grp.add_argument('--includes', action='store_true', help="resolve INCLUDEs instead of dropping them")
+    grp.add_argument('--fast', action='store_true', help="use the streaming LAYER reader instead of mappyfile")
+    grp.add_argument('--incremental', action='store_true',
+                     help="cache the stats per LAYER block, so only changed layers are read again")
+    grp.add_argument('--diff', metavar='OLD_MAP', help="list the layers added, removed and modified since OLD_MAP")
+    grp.add_argument('--check-tables', nargs='?', const=True, metavar='BACKEND',
+                     help="check that the tables of PostGIS layers exist (BACKEND: postgres, or sqlite:FOLDER "
+                          "for a local stand-in)")
+    grp.add_argument('--data-stats', action='store_true',
+                     help="add the feature count, extent and size of shape files, GeoPackages and GeoTIFFs")
+    grp.add_argument('--workers', type=int, help="number of worker processes for batches")
+    grp.add_argument('--per-file', action='store_true', help="one output file per map file for batches")
+    grp.add_argument('--pipeline', nargs='?', const=True, metavar='READ,PARSE,WRITE',
+                     help="run batches as overlapping read, parse and write stages, optionally with these numbers "
+                          "of workers per stage (e.g. 4,6,2)")
+    grp.add_argument('--queue-depth', type=int, help="map files queued between the --pipeline stages (default: 4)")
+    grp.add_argument('--format', choices=['xlsx', 'csv', 'jsonl', 'parquet'],
+                     help="output format for --per-file (otherwise it's taken from the output extension)")
+
+    grp = parser.add_argument_group('watch mode')
+    grp.add_argument('--watch', action='store_true',
+                     help="keep the output up to date as the map files in the input folder (or glob) change")
+    grp.add_argument('--aprx', action='store_true', help="also watch aprx files")
+    grp.add_argument('--interval', type=float, help="seconds between checks for changes (default: 2)")
+
+    grp = parser.add_argument_group('aprx and mxd')
+    grp.add_argument('--check-paths', action='store_true', help="check that the data sources exist")
+    grp.add_argument('--cim', action='store_true', help="read the aprx without arcpy")
+    grp.add_argument('--describe-cache', nargs='?', const=True, metavar='DB',
+                     help="keep the mxd join lookups between runs for a day, optionally in this file")
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    opts = vars(args)
+    src = opts.pop('input')
+    out = opts.pop('output')
+    try:
+        get_engine(src)
+        _layer_filter(opts)
+    except ValueError as e:
+        sys.exit(str(e))
+    run(src, out, **opts)
+
+
+if __name__ == "__main__":
+    main()
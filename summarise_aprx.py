@@ -5,56 +5,136 @@ Utility to summarise the contents of an Esri aprx file.
 Created by: Hanne L. Petersen <halpe@sdfe.dk>
 Created: 2019(ish)
 """
-import sys
 import os
 from datetime import datetime as dt
-import re
+import collections
 
-from office_utils import OfficeUtils
+import output_writers
+import result_cache
+import path_check
+import arcade_fields
+import scale_index
+import layer_filter as layer_filters
+import inventory as inventory_store
+import instrument
+from layer_record import LayerRecord
 
 is_in_arcgis = 'arcgis' in globals()  # this check MUST be done before anything using arcpy is imported!
-import arcpy
+arcpy = None  # imported on first use by import_arcpy, it takes a while
+
+import aprx_cim
 
 
 def set_msg(msg, severity=0):  # placeholder
     print(msg)
 
 
-def summarise_aprx(aprx_path, outfile_path, check_paths=False):
+# (layer record key, heading) of the output columns, data_ok is only included with check_paths
+COLUMNS = [('layer', 'Layer'), ('data_path', 'Data path'), ('data_ok', 'Data OK?'), ('visible', 'Visibility'),
+           ('transparency', 'Transparency'), ('max_scale', 'Max. scale'), ('min_scale', 'Min. scale'),
+           ('vis_attributes', 'Visualisation attributes'), ('vis_classes', 'Visualisation classes'),
+           ('definition_query', 'Definition query')]
+
+
+def summarise_aprx(aprx_path, outfile_path, check_paths=False, cache=True, engine=None, inventory=None,
+                   zoom_scales=None, layer_filter=None):
+    """Summarise the maps in an aprx to xlsx.
+
+    engine='arcpy' reads the project with arcpy.mp, engine='cim' reads the CIM JSON straight from the aprx zip
+    (see aprx_cim), which doesn't need ArcGIS Pro. By default arcpy is used if it's available.
+    With inventory (True, or the path of the inventory file), the layers are also stored in the inventory.
+    With zoom_scales (a list of scales), the layers and data sources active at each scale are reported per map in
+    a file next to the output, see scale_index. With layer_filter (a layer_filter.LayerFilter), only the layers that
+    meet the filter are summarised.
+    """
     t0 = dt.now()
     set_msg("Starting at  {}".format(t0))
-    set_msg("  Reading {}...".format(aprx_path))
-    aprx = arcpy.mp.ArcGISProject(aprx_path)
-    map_lst = aprx.listMaps()
 
-    map_dic = {}
-    for map in map_lst:
-        set_msg("  Processing map {}...".format(map.name))
-        lyr_lst = map.listLayers()
-        map_dic[map.name] = get_lyr_stats(lyr_lst, check_paths)
+    map_dic = get_map_stats(aprx_path, check_paths, cache, engine, layer_filter)
+    if inventory and layer_filter:
+        set_msg("  Not storing the layers in the inventory, they're filtered.", 30)
+    elif inventory and os.path.isfile(aprx_path):
+        with instrument.span('inventory'):
+            inventory_store.record(inventory, aprx_path, 'aprx', map_dic.items())
 
     # Write outputs
-    xlsx_path = os.path.splitext(outfile_path)[0] + '.xlsx'  # ensure it's xlsx and not xls
+    xlsx_path = output_writers.output_path(outfile_path)  # xlsx, unless it's one of the other supported formats
     set_msg("  Writing {}...".format(xlsx_path))
-    sheets = []
-    stats = []
-    for (mapnam, lyr_stats) in map_dic.items():  # unzip dict to lists
-        sheets.append(mapnam)
-        stats.append(lyr_stats)
-    headings = ['Layer', 'Data path', 'Visibility', 'Transparency', 'Max. scale', 'Min. scale',
-                'Visualisation attributes', 'Definition query']
-    if check_paths:
-        headings = headings[:2] + ['Data OK?'] + headings[2:]
-    OfficeUtils.multi_lists2xlsx(stats, xlsx_path, headings,
-                                 {'sheetname': sheets, 'widths': [40, 60, 10, 10, 10, 10, 40, 50, 20, 50]})
-    set_msg("  Output written to {}.".format(xlsx_path))
+    columns = [(k, heading) for (k, heading) in COLUMNS if check_paths or k != 'data_ok']
+    with instrument.span('write'):
+        written = output_writers.write_tables(xlsx_path, columns, map_dic.items(),  # one sheet per map
+                                              {'widths': [40, 60, 10, 10, 10, 10, 40, 50, 40, 20, 50]})
+    if written:
+        set_msg("  Output written to {}.".format(xlsx_path))
+    else:
+        set_msg("  No maps in {}, no file written.".format(aprx_path), 30)
+    if zoom_scales:
+        with instrument.span('zoom report'):
+            set_msg("  Zoom report written to {}.".format(
+                scale_index.write_report(map_dic.items(), xlsx_path, zoom_scales)))
 
     set_msg("Python script duration (h:mm:ss.dddd): " + str(dt.now() - t0)[:-2])
 
 
-def get_lyr_stats(lyr_lst, check_paths=False):
+def get_map_stats(aprx_path, check_paths=False, cache=True, engine=None, layer_filter=None):
+    """Get the layer stats of each map in an aprx, as an OrderedDict of map name -> list of LayerRecords.
+    With layer_filter, only the layers that meet it. The cache only holds whole aprx files, so a filtered run uses
+    them, but doesn't store its own. The data sources aren't cached, they're checked anew on every run."""
+    if engine is None:
+        engine = 'arcpy' if has_arcpy() else 'cim'
+
+    # Look for the layer stats in the result cache first (not for CURRENT, or other non-files)
+    cache = result_cache.open_cache(cache) if os.path.isfile(aprx_path) else None
+    map_dic = None
+    if cache:
+        key = cache.key(result_cache.hash_file(aprx_path), tool='aprx', engine=engine)
+        with instrument.span('cache'):
+            cached = cache.get(key)
+        if cached is not None:
+            set_msg("  Using cached layer stats for {}.".format(aprx_path))
+            instrument.count('cache_hits')
+            map_dic = collections.OrderedDict((map_name, [LayerRecord.from_list(values) for values in records])
+                                              for (map_name, records) in cached)
+            if layer_filter:
+                map_dic = collections.OrderedDict((map_name, layer_filter.filter(records))
+                                                  for (map_name, records) in map_dic.items())
+
+    if map_dic is None:
+        set_msg("  Reading {}...".format(aprx_path))
+        with instrument.span('open'):
+            if engine == 'cim':
+                aprx = aprx_cim.ArcGISProject(aprx_path)
+            else:
+                aprx = import_arcpy().mp.ArcGISProject(aprx_path)
+            map_lst = aprx.listMaps()
+
+        map_dic = collections.OrderedDict()
+        for map in map_lst:
+            set_msg("  Processing map {}...".format(map.name))
+            with instrument.span('map ' + map.name):
+                lyr_lst = map.listLayers()
+                map_dic[map.name] = get_lyr_stats(lyr_lst, layer_filter=layer_filter)
+        if engine == 'cim':
+            aprx.close()
+        if cache and not layer_filter:
+            with instrument.span('cache'):
+                cache.put(key, [(map_name, [rec.to_list() for rec in records]) for (map_name, records) in map_dic.items()])
+    if cache:
+        cache.close()
+    if check_paths:  # the sources of all the maps in one go
+        check_records([rec for records in map_dic.values() for rec in records])
+    return map_dic
+
+
+def get_lyr_stats(lyr_lst, check_paths=False, check_func=None, layer_filter=None):
+    """Get a LayerRecord of stats per layer.
+
+    With check_paths, the data sources are checked with check_func (default: data_exists) once all layers are read,
+    see path_check. With layer_filter, the layers that don't meet it are skipped before their CIM definitions are
+    fetched or their data sources checked.
+    """
     lyr_stats = []
-    for i, lyr in enumerate(lyr_lst):
+    for lyr in instrument.spans_of(lyr_lst, 'layer'):
         try:  # Ignore non-feature layers (e.g. anno classes)
             lyr.isFeatureLayer
         except (NameError, ValueError, AttributeError):
@@ -70,16 +150,8 @@ def get_lyr_stats(lyr_lst, check_paths=False):
         except (NameError, ValueError, AttributeError):
             visi = 'N/A'
 
-        path_ok = '-'
         try:
             src = lyr.dataSource  # note: annos don't support dataSource and each anno class is considered a layer...
-            if check_paths:
-                if not i % 5:
-                    set_msg("    checked {} layers".format(i))
-                if arcpy.Exists(src):
-                    path_ok = 'OK'
-                else:
-                    path_ok = 'missing'
         except (NameError, ValueError, AttributeError):
             if lyr.isGroupLayer:
                 src = '[group layer]'
@@ -97,6 +169,10 @@ def get_lyr_stats(lyr_lst, check_paths=False):
             min_scale = '-'
             max_scale = '-'
 
+        if layer_filter and not layer_filter.match(nam, layer_filters.parent_path(nam), src, max_scale, min_scale,
+                                                   visi):
+            continue
+
         try:
             def_qry = lyr.definitionQuery
         except (NameError, ValueError, AttributeError):
@@ -104,15 +180,12 @@ def get_lyr_stats(lyr_lst, check_paths=False):
 
         try:
             cim = lyr.getDefinition('V2')  # V2 = cim_version to be used until next major release
-            render_flds = cim.renderer.fields
-            if render_flds:
-                vis_attr = "Standard: [{}]".format(', '.join(cim.renderer.fields))
-            else:
-                arcade_expr = cim.renderer.valueExpressionInfo.expression
-                lst = re.findall('feature\.([a-zA-Z]+)[^a-zA-Z]', arcade_expr)
-                vis_attr = "Custom: [{}]".format(', '.join(set(lst)))
+            render_flds = arcade_fields.renderer_fields(cim.renderer)  # memoised for shared Arcade expressions
+            vis_attr = "{}: [{}]".format(render_flds[0], ', '.join(render_flds[1])) if render_flds else ''
+            vis_classes = '; '.join(arcade_fields.renderer_classes(cim.renderer))
         except (NameError, ValueError, AttributeError):
             vis_attr = ''
+            vis_classes = ''
 
         try:
             tr = lyr.transparency
@@ -146,15 +219,62 @@ def get_lyr_stats(lyr_lst, check_paths=False):
         # join_lst = join_check(lyr)
         # joins = ', '.join(join_lst)
 
-        if check_paths:
-            # lyr_stats.append([nam, src, path_ok, str(visi), tr, max_scale, min_scale, def_qry, ';'.join(sym_fields), ';'.join(sym_classes)])  # , joins])
-            lyr_stats.append([nam, src, path_ok, str(visi), tr, max_scale, min_scale, vis_attr, def_qry])  # , joins])
-        else:
-            lyr_stats.append([nam, src, str(visi), tr, max_scale, min_scale, vis_attr, def_qry])  # , joins])
+        # lyr_stats.append([nam, src, path_ok, str(visi), tr, max_scale, min_scale, def_qry, ';'.join(sym_fields), ';'.join(sym_classes)])  # , joins])
+        rec = LayerRecord(layer=nam, data_path=src, visible=str(visi), transparency=tr, max_scale=max_scale,
+                          min_scale=min_scale, vis_attributes=vis_attr, vis_classes=vis_classes,
+                          definition_query=def_qry)  # , joins
+        lyr_stats.append(rec)
+        instrument.count('layers')
+
+    if check_paths:
+        check_records(lyr_stats, check_func)
+    return lyr_stats
+
 
+def check_records(lyr_stats, check_func=None):
+    """Set data_ok of the records from their data sources, checked with check_func (default: data_exists), see
+    path_check. Group layers and layers without a source get '-'."""
+    to_check = []  # (record, data source)
+    for rec in lyr_stats:
+        rec.data_ok = '-'
+        if rec.data_path and rec.data_path != '[group layer]':
+            to_check.append((rec, rec.data_path))
+    if to_check:
+        with instrument.span('check paths'):
+            statuses = path_check.check_sources([src for (rec, src) in to_check], check_func or data_exists,
+                                                progress=_check_progress)
+        for (rec, src) in to_check:
+            rec.data_ok = statuses[src]
     return lyr_stats
 
 
+def _check_progress(checked, total):
+    if not checked % 20 or checked == total:
+        set_msg("    checked {} of {} data sources".format(checked, total))
+
+
+def import_arcpy():
+    global arcpy
+    if arcpy is None:
+        import arcpy
+    return arcpy
+
+
+def has_arcpy():
+    """Check if arcpy can be imported, without importing it."""
+    if arcpy is not None:
+        return True
+    import importlib.util
+    return importlib.util.find_spec('arcpy') is not None
+
+
+def data_exists(src):
+    """arcpy.Exists, or a plain file check without arcpy (enterprise geodatabase sources will show as missing)."""
+    if has_arcpy():
+        return import_arcpy().Exists(src)
+    return os.path.exists(src)
+
+
 # def join_check(lyr):
 #     tbl_set = set()
 #     try:
@@ -171,19 +291,9 @@ def get_lyr_stats(lyr_lst, check_paths=False):
 
 
 if __name__ == "__main__":
-    aprx = r'C:\Temp\SK_tiles.aprx'
-    txt = r'C:\Temp\SK_tiles_overview.xlsx'
-    verify = True
-
     if is_in_arcgis:
-        aprx = arcpy.GetParameterAsText(0)
-        txt = arcpy.GetParameterAsText(1)
-        verify = bool(arcpy.GetParameter(2))
+        import_arcpy()
+        summarise_aprx(arcpy.GetParameterAsText(0), arcpy.GetParameterAsText(1), bool(arcpy.GetParameter(2)))
     else:
-        if len(sys.argv) > 1:
-            aprx = sys.argv[1]
-        if len(sys.argv) > 2:
-            txt = sys.argv[2]
-
-    summarise_aprx(aprx, txt, verify)
-    # os.startfile(txt)
+        import summarise  # the command line is shared by all the summarisers
+        summarise.main()
@@ -3,21 +3,55 @@
 A basic utility to summarise the contents of a map file.
 It isn't pretty or polished, and only covers the cases we've needed so far, but mostly does its thing.
 
-INCLUDEs in the map file are currently ignored.
+INCLUDEs in the map file are ignored by default. With drop_includes=False they are resolved by mapfile_preprocess,
+which reads each included fragment only once per process, however many map files include it.
+
+With engine='fast', the layers are read with the streaming reader in mapfile_tokenizer instead of a full
+mappyfile parse, which is a lot quicker on big map files.
+
+With incremental=True, the stats of each LAYER block are cached by the block's contents, so when a few layers in a
+big map file change, only those are read again. main_diff compares two versions of a map file layer by layer.
+
+With check_tables, the tables that the PostGIS layers read from are looked up in their databases (see db_check), and
+the result is shown in a "Data OK?" column. With data_stats, the feature count, extent and size of file based data
+(shape files, GeoPackages, GeoTIFFs) are read from the file headers, see source_stats.
+
+With layer_filter (a layer_filter.LayerFilter), only the layers that meet the filter are summarised. Each LAYER
+block is screened with the streaming reader first, so the other layers are never parsed by mappyfile, nor have
+their metadata decoded or scale tokens expanded.
+
+Several map files can be summarised in one go with main_batch, which takes a directory or a glob and spreads the
+map files over a pool of worker processes. With pipelined=True, reading the map files, parsing them and writing the
+outputs are run as stages connected by bounded queues instead (see pipeline), so they overlap, and only a few map
+files are held in memory at a time.
 
 Created by: Hanne L. Petersen <halpe@sdfe.dk>
 Created: June 2021
 """
 import sys
 import os
+import re
+import csv
+import glob
 import logging
-import shutil
-from datetime import datetime as dt
+import operator
+import functools
 import collections
-import codecs
-import mappyfile  # https://pypi.org/project/mappyfile/
-import re
-
+from datetime import datetime as dt
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import output_writers
+import mapfile_tokenizer
+import mapfile_preprocess
+import result_cache
+import db_check
+import source_stats
+import inventory as inventory_store
+import scale_tokens
+import scale_index
+import pipeline
+import instrument
+from layer_record import LayerRecord
 from office_utils import OfficeUtils
 
 log_level = logging.DEBUG
@@ -27,134 +61,573 @@ def set_msg(msg, severity=0):  # placeholder
     print(msg)
 
 
-def main(mapfile_src_cp, outfile_path, split_scale_lyrs=False, drop_includes=True):
+# (layer record key, heading) of the output columns
+COLUMNS = [('layer', 'Layer name'), ('group', 'Layer group'), ('data_path', 'Data path (beta)'),
+           ('visible', 'Visibility'), ('max_scale', 'Max. scale'), ('min_scale', 'Min. scale'),
+           ('data_sql', 'Data SQL'), ('wms_title', 'WMS Title'), ('wms_layer_group', 'WMS Layer Group'),
+           ('wms_abstract', 'WMS Abstract'), ('wms_group_title', 'WMS Group Title'),
+           ('wms_group_abstract', 'WMS Group Abstract')]  # , 'Definition query']
+WIDTHS = [20, 30, 70, 10, 10, 10, 50, 20, 20, 20, 20]
+
+DIFF_HEADINGS = ['Change', 'Layer', 'Column', 'Old value', 'New value']
+DIFF_WIDTHS = [10, 30, 20, 60, 60]
+
+_SHAPEPATH_RE = re.compile(r'^\s*SHAPEPATH\s+["\']([^"\']*)["\']', re.IGNORECASE | re.MULTILINE)
+
+
+def main(mapfile_src_cp, outfile_path, split_scale_lyrs=False, drop_includes=True, engine='mappyfile', cache=True,
+         incremental=False, inventory=None, check_tables=False, data_stats=False, zoom_scales=None,
+         layer_filter=None):
+    """Summarise a map file to outfile_path. With zoom_scales (a list of scales), the number of layers and data
+    sources active at each scale are written to a report next to it, see scale_index."""
     set_msg("Processing {} to {}...".format(mapfile_src_cp, outfile_path))
     t0 = dt.now()
     set_msg("Start time: {}".format(t0))
 
-    # Copy input file, so we can kill the bom and any includes
-    mapfile_src = mapfile_src_cp
-    mapfile_src_cp = '_tmp'.join(os.path.splitext(mapfile_src_cp))
-    set_msg("Duplicating map file to {}...".format(mapfile_src_cp))
-    if drop_includes:
-        with open(mapfile_src, "r") as fin:
-            with open(mapfile_src_cp, "w") as fout:
-                for line in fin:
-                    fout.write(re.sub('(\t|  |\t )INCLUDE', '\\1# INCLUDE', line))
-    else:
-        shutil.copyfile(mapfile_src, mapfile_src_cp)
+    with instrument.span('map file'):
+        lyr_stats = summarise_file(mapfile_src_cp, split_scale_lyrs, drop_includes, engine, cache, incremental,
+                                   inventory, check_tables, data_stats, layer_filter=layer_filter)
 
-    if has_bom(mapfile_src_cp):
-        set_msg("Removing BOM...")
-        remove_bom_in_place(mapfile_src_cp)
+        # Write outputs
+        out_path = output_writers.output_path(outfile_path)  # xlsx, unless it's one of the other supported formats
+        write_output(lyr_stats, out_path, check_tables=check_tables, data_stats=data_stats)
+        if zoom_scales:
+            with instrument.span('zoom report'):
+                set_msg("  Zoom report written to {}.".format(
+                    scale_index.write_report([(None, lyr_stats)], out_path, zoom_scales)))
 
-    map_dic = get_lyr_stats(mapfile_src_cp, split_scale_lyrs)
+    set_msg("Script duration: {}".format(dt.now() - t0))
 
-    set_msg("Deleting tmp file...")
-    os.remove(mapfile_src_cp)
 
-    # print(map_dic)
+def main_batch(mapfile_srcs, outfile_path, split_scale_lyrs=False, drop_includes=True, combined=False,
+               max_workers=None, engine='mappyfile', cache=True, out_format='.xlsx', incremental=False,
+               inventory=None, check_tables=False, data_stats=False, pipelined=False, stage_workers=None,
+               queue_depth=pipeline.DEFAULT_DEPTH, layer_filter=None, zoom_scales=None):
+    """Summarise all map files in a directory or matching a glob, using a pool of worker processes.
 
-    # Write outputs
-    xlsx_path = os.path.splitext(outfile_path)[0] + '.xlsx'  # ensure it's xlsx and not xls
-    set_msg("  Writing {}...".format(xlsx_path))
-    stats = []
-    for k in sorted(map_dic.keys()):
-        for lyr_info in map_dic[k]:
-            stats.append([lyr_info[0]] + [k] + lyr_info[1:])
-    # for (mapnam, lyr_stats) in map_dic.items():  # unzip dict to lists
-    #     sheets.append(mapnam)
-    #     stats.append(lyr_stats)
-    # print(stats)
-    headings = ['Layer name', 'Layer group', 'Data path (beta)', 'Visibility', 'Max. scale', 'Min. scale', 'Data SQL',
-                'WMS Title', 'WMS Layer Group', 'WMS Abstract', 'WMS Group Title', 'WMS Group Abstract']  # , 'Definition query']
-    OfficeUtils.multi_lists2xlsx([stats], xlsx_path, headings,
-                                 {'widths': [20, 30, 70, 10, 10, 10, 50, 20, 20, 20, 20]})
-    set_msg("  Output written to {}.".format(xlsx_path))
+    With combined=True all layers are written to the single file outfile_path, with an extra "Map file" column.
+    Otherwise outfile_path is a directory, and one file is written per map file, in out_format (e.g. '.csv').
+    A map file that fails is reported and skipped. Returns the list of (map file, error) failures.
+    With zoom_scales, a zoom report is written next to each output, or next to the combined output with a row per
+    map file and scale, see scale_index.
+
+    With pipelined, the map files are read on threads, parsed in max_workers processes and written on threads, in
+    stages connected by queues of queue_depth map files. stage_workers is the (read, parse, write) worker counts,
+    any of them None for the default.
+    """
+    set_msg("Processing {} to {}...".format(mapfile_srcs, outfile_path))
+    t0 = dt.now()
+    set_msg("Start time: {}".format(t0))
 
+    map_files = find_map_files(mapfile_srcs)
+    set_msg("Found {} map files.".format(len(map_files)))
+    if not combined and not os.path.isdir(outfile_path):
+        os.makedirs(outfile_path)
+    if pipelined:
+        return _main_pipeline(map_files, outfile_path, t0, split_scale_lyrs, drop_includes, combined, max_workers,
+                              engine, cache, out_format, incremental, inventory, check_tables, data_stats,
+                              stage_workers, queue_depth, layer_filter, zoom_scales)
+
+    results = {}
+    failures = []
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {}
+        for mapfile_src in map_files:
+            if combined:
+                xlsx_path = None
+            else:
+                xlsx_path = os.path.join(outfile_path, os.path.splitext(os.path.basename(mapfile_src))[0] + out_format)
+            fut = pool.submit(_batch_job, mapfile_src, xlsx_path, split_scale_lyrs, drop_includes, engine, cache,
+                              incremental, inventory, check_tables, data_stats, layer_filter=layer_filter,
+                              zoom_scales=zoom_scales)
+            futures[fut] = mapfile_src
+
+        for fut in as_completed(futures):
+            mapfile_src = futures[fut]
+            try:
+                (results[mapfile_src], timings) = fut.result()
+            except Exception as e:  # one broken map file shouldn't stop the rest
+                set_msg("  Failed to summarise {}: {}".format(mapfile_src, e), 30)
+                failures.append((mapfile_src, e))
+                continue
+            instrument.merge(timings)  # the workers' timings add up to more than the wall time
+            set_msg("  Done with {}.".format(mapfile_src))
+
+    if combined:
+        stats = (rec for mapfile_src in sorted(results.keys())
+                 for rec in _with_source(results[mapfile_src], mapfile_src))
+        out_path = output_writers.output_path(outfile_path)
+        write_output(stats, out_path, combined=True, check_tables=check_tables, data_stats=data_stats)
+        if zoom_scales:
+            with instrument.span('zoom report'):
+                set_msg("  Zoom report written to {}.".format(scale_index.write_report(
+                    ((mapfile_src, results[mapfile_src]) for mapfile_src in sorted(results.keys())), out_path,
+                    zoom_scales)))
+
+    set_msg("{} map files summarised, {} failed.".format(len(results), len(failures)))
+    for (mapfile_src, e) in failures:
+        set_msg("  {}: {}".format(mapfile_src, e), 30)
+    set_msg("Script duration: {}".format(dt.now() - t0))
+    return failures
+
+
+def _batch_job(mapfile_src, xlsx_path, split_scale_lyrs, drop_includes, engine, cache, incremental=False,
+               inventory=None, check_tables=False, data_stats=False, text=None, layer_filter=None, zoom_scales=None):
+    """Worker for main_batch. Writes the output (and with zoom_scales the zoom report) if xlsx_path is given,
+    otherwise returns the stats. Returns (stats or None, timings), see instrument."""
+    instrument.reset()  # the worker processes are reused
+    with instrument.span('map file'):
+        try:
+            lyr_stats = summarise_file(mapfile_src, split_scale_lyrs, drop_includes, engine, cache, incremental,
+                                       inventory, check_tables, data_stats, text, layer_filter)
+        except Exception as e:  # parser errors don't always survive the trip back from the worker process
+            raise RuntimeError("{}: {}".format(type(e).__name__, e))
+        if xlsx_path:
+            write_output(lyr_stats, xlsx_path, check_tables=check_tables, data_stats=data_stats)
+            if zoom_scales:
+                with instrument.span('zoom report'):
+                    scale_index.write_report([(None, lyr_stats)], xlsx_path, zoom_scales)
+            lyr_stats = None
+    return (lyr_stats, instrument.snapshot())
+
+
+def _main_pipeline(map_files, outfile_path, t0, split_scale_lyrs, drop_includes, combined, max_workers, engine, cache,
+                   out_format, incremental, inventory, check_tables, data_stats, stage_workers, queue_depth,
+                   layer_filter=None, zoom_scales=None):
+    """main_batch with the map files going through read, parse and (unless combined) write stages."""
+    (read_workers, parse_workers, write_workers) = stage_workers or (None, None, None)
+    queue_depth = queue_depth or pipeline.DEFAULT_DEPTH
+    stages = [pipeline.Stage('read', functools.partial(_read_stage, drop_includes), read_workers or 4),
+              pipeline.Stage('parse', functools.partial(_parse_stage, split_scale_lyrs, drop_includes, engine, cache,
+                                                        incremental, inventory, check_tables, data_stats,
+                                                        layer_filter),
+                             parse_workers or max_workers or os.cpu_count(), processes=True)]
+    if not combined:
+        stages.append(pipeline.Stage('write', functools.partial(_write_stage, outfile_path, out_format, check_tables,
+                                                                data_stats, zoom_scales), write_workers or 2))
+    set_msg("  Pipeline: {}, queues of {}.".format(', '.join(
+        '{} {}'.format(stage.workers, stage.name) for stage in stages), queue_depth))
+
+    done = []
+    failures = []
+    timings = []  # merged at the end, the combined output is written while the results come in
+    zoom_rows = []  # of the combined output, map file by map file
+
+    def results():
+        for (mapfile_src, value, error) in pipeline.run(map_files, stages, queue_depth):
+            if error is not None:
+                set_msg("  Failed to summarise {}: {}".format(mapfile_src, error), 30)
+                failures.append((mapfile_src, error))
+                continue
+            (_, lyr_stats, job_timings) = value
+            timings.append(job_timings)
+            if combined and zoom_scales:
+                with instrument.span('zoom report'):
+                    zoom_rows.extend(scale_index.zoom_report([(mapfile_src, lyr_stats)], zoom_scales))
+            set_msg("  Done with {}.".format(mapfile_src))
+            done.append(mapfile_src)
+            yield (mapfile_src, lyr_stats)
+
+    if combined:  # streamed, in the order of the map files
+        stats = (rec for (mapfile_src, lyr_stats) in results() for rec in _with_source(lyr_stats, mapfile_src))
+        out_path = output_writers.output_path(outfile_path)
+        write_output(stats, out_path, combined=True, check_tables=check_tables, data_stats=data_stats)
+        if zoom_scales:
+            set_msg("  Zoom report written to {}.".format(scale_index.write_rows(zoom_rows, out_path)))
+    else:
+        for _ in results():
+            pass
+    for job_timings in timings:
+        instrument.merge(job_timings)
+
+    set_msg("{} map files summarised, {} failed.".format(len(done), len(failures)))
+    for (mapfile_src, e) in failures:
+        set_msg("  {}: {}".format(mapfile_src, e), 30)
     set_msg("Script duration: {}".format(dt.now() - t0))
+    return failures
+
+
+def _read_stage(drop_includes, mapfile_src):
+    """Read stage of _main_pipeline: (map file, preprocessed text)."""
+    set_msg("Reading {}...".format(mapfile_src))
+    return (mapfile_src, mapfile_preprocess.preprocess(mapfile_src, drop_includes))
+
+
+def _parse_stage(split_scale_lyrs, drop_includes, engine, cache, incremental, inventory, check_tables, data_stats,
+                 layer_filter, value):
+    """Parse stage of _main_pipeline, in a worker process: (map file, stats, timings)."""
+    (mapfile_src, text) = value
+    return (mapfile_src,) + _batch_job(mapfile_src, None, split_scale_lyrs, drop_includes, engine, cache, incremental,
+                                       inventory, check_tables, data_stats, text, layer_filter)
+
 
+def _write_stage(out_dir, out_format, check_tables, data_stats, zoom_scales, value):
+    """Write stage of _main_pipeline: writes the output (and with zoom_scales the zoom report) of a map file, and
+    passes on (map file, [], timings)."""
+    (mapfile_src, lyr_stats, timings) = value
+    out_path = os.path.join(out_dir, os.path.splitext(os.path.basename(mapfile_src))[0] + out_format)
+    write_output(lyr_stats, out_path, check_tables=check_tables, data_stats=data_stats)
+    if zoom_scales:
+        scale_index.write_report([(None, lyr_stats)], out_path, zoom_scales)
+    return (mapfile_src, [], timings)
 
-def get_lyr_stats(mapfile_src, split_scale_lyrs=False):
-    mapfile = mappyfile.open(mapfile_src)
-    layers = mapfile["layers"]
-
-    groups = collections.defaultdict(list)
-
-    for lyr in layers:
-        nam = lyr['name']
-        if nam == 'Byomraade':
-            print(nam)
-            print(lyr['metadata'].keys())
-
-        min_scale = str(lyr['maxscaledenom']) if 'maxscaledenom' in lyr.keys() else 'N/A'
-        max_scale = str(lyr['minscaledenom']) if 'minscaledenom' in lyr.keys() else 'N/A'
-        meta = lyr['metadata']
-        wms_title = str(hack_asciify(lyr['metadata']['wms_title'])) if 'wms_title' in lyr['metadata'].keys() else 'N/A'
-        wms_layer_group = str(hack_asciify(lyr['metadata']['wms_layer_group'])) if 'wms_layer_group' in lyr['metadata'].keys() else '-'
-        wms_abstract = str(hack_asciify(lyr['metadata']['wms_abstract'])) if 'wms_abstract' in lyr['metadata'].keys() else 'N/A'
-        wms_group_title = str(hack_asciify(lyr['metadata']['wms_group_title'])) if 'wms_group_title' in lyr['metadata'].keys() else 'N/A'
-        wms_group_abstract = str(hack_asciify(lyr['metadata']['wms_group_abstract'])) if 'wms_group_abstract' in lyr['metadata'].keys() else 'N/A'
-
-        visi = lyr['status'] if 'status' in lyr.keys() else 'N/A'  # ON -> True
-
-        # Do other stuff first - extract token values (key => combined string)
-        tokens = {}
-        if lyr['scaletokens']:  # Get scaletokens for text replacement
-            for t in lyr['scaletokens']:
-                # print("{}: {}".format(t['name'], t['values']))
-                token_dict = t['values']
-                del token_dict['__type__']
-                for k, v in token_dict.items():  # map, keep OrderedDict...
-                    # print(k)
-                    token_dict[k] = strip_from_string(v, ' using')
-                long_vals = token_dict.values()
-                long_vals_encoded = [encodeIfUnicode(s) for s in long_vals]
-                tokens[t['name']] = '[{}]'.format(';'.join(long_vals_encoded))  # I thought py3 did utf, but this fails w ø in scaletoken values
-        if 'data' in lyr.keys():
-            src_long = lyr['data'][0]
-        elif 'connection' in lyr.keys():
-            src_long = lyr['connection']
+
+def _with_source(lyr_stats, mapfile_src):
+    for rec in lyr_stats:
+        rec.source_file = mapfile_src
+        yield rec
+
+
+def find_map_files(mapfile_srcs):
+    """List the map files in a directory, or matching a glob pattern (** is supported)."""
+    if os.path.isdir(mapfile_srcs):
+        found = glob.glob(os.path.join(mapfile_srcs, '*.map'))
+    else:
+        found = glob.glob(mapfile_srcs, recursive=True)
+    return sorted(f for f in found if os.path.isfile(f))
+
+
+def summarise_file(mapfile_src, split_scale_lyrs=False, drop_includes=True, engine='mappyfile', cache=True,
+                   incremental=False, inventory=None, check_tables=False, data_stats=False, text=None,
+                   layer_filter=None):
+    """Get the layer stats of one map file, with any includes either dropped or resolved.
+
+    Unless cache is False, the stats are looked up in and stored in the result cache (see result_cache),
+    keyed by the preprocessed text, so unchanged map files (and includes) aren't parsed again.
+    cache can also be the path of the cache file. With incremental, a changed map file only has its changed
+    LAYER blocks read again, see get_lyr_stats_incremental.
+
+    With inventory (True, or the path of the inventory file), the layers are also stored in the inventory.
+    With check_tables (True for Postgres, or a backend, see db_check.get_backend), data_ok is set from the tables
+    found in the databases. This is never cached. With data_stats, the stats of the data files are added, see
+    add_data_stats. text is the preprocessed map file, if it's already been read.
+
+    With layer_filter, only the layers that meet the filter are read and checked, see get_lyr_stats. The result
+    cache only holds whole map files, so a filtered run uses them, but doesn't store its own. Filtered runs
+    aren't stored in the inventory either, as they'd replace the map file's layers there.
+    """
+    if text is None:
+        set_msg("Reading {}...".format(mapfile_src))
+        with instrument.span('read'):  # decoding, BOM removal and includes
+            text = mapfile_preprocess.preprocess(mapfile_src, drop_includes)
+    lyr_stats = _summarise_file(mapfile_src, split_scale_lyrs, drop_includes, engine, cache, incremental, text,
+                                layer_filter)
+    if check_tables:
+        with instrument.span('check tables'):
+            db_check.check_records(lyr_stats, check_tables)
+    if data_stats:
+        with instrument.span('data stats'):
+            add_data_stats(lyr_stats, mapfile_src, cache, text)
+    if inventory and layer_filter:
+        set_msg("  Not storing the layers of {} in the inventory, they're filtered.".format(mapfile_src), 30)
+    elif inventory:
+        with instrument.span('inventory'):
+            inventory_store.record(inventory, mapfile_src, 'mapfile', [(None, lyr_stats)])
+    return lyr_stats
+
+
+def _summarise_file(mapfile_src, split_scale_lyrs, drop_includes, engine, cache, incremental, text,
+                    layer_filter=None):
+    cache = result_cache.open_cache(cache)
+    if not cache:
+        return get_lyr_stats(mapfile_src, split_scale_lyrs, engine, text, layer_filter)
+
+    try:
+        key = cache.key(result_cache.hash_bytes(text.encode('utf-8')), tool='mapfile',
+                        split_scale_lyrs=split_scale_lyrs, drop_includes=drop_includes)
+        with instrument.span('cache'):
+            cached = cache.get(key)
+        if cached is not None:
+            set_msg("  Using cached layer stats for {}.".format(mapfile_src))
+            instrument.count('cache_hits')
+            lyr_stats = [LayerRecord.from_list(values) for values in cached]
+            return layer_filter.filter(lyr_stats) if layer_filter else lyr_stats
+        if layer_filter and not incremental:  # only whole map files go in the cache
+            return get_lyr_stats(mapfile_src, split_scale_lyrs, engine, text, layer_filter)
+        if incremental:  # the LAYER blocks are cached whole, so a filter is applied after
+            lyr_stats = get_lyr_stats_incremental(mapfile_src, split_scale_lyrs, engine, text, cache)
         else:
-            src_long = 'N/A'
-
-        src_short = strip_from_string(src_long, ' using')  # src_long[:src_long.lower().index(' using')]
-        src_short = src_short.replace('geometri from ', '')
-
-        # Check need for replacement
-        do_replace = False
-        for rep in tokens.keys():
-            if rep in src_short:
-                do_replace = True
-
-        grp = lyr['group']
-        if not grp:
-            grp = '-'  # wms_layer_group
-        if not do_replace or not split_scale_lyrs:
-            # Replace tokens (if needed)
-            for rep in tokens.keys():
-                src_short = src_short.replace(rep, tokens[rep])
-
-            groups[grp].append([nam, src_short, visi, max_scale, min_scale, src_long,
-                                wms_title, wms_layer_group, wms_abstract, wms_group_title, wms_group_abstract])
+            lyr_stats = get_lyr_stats(mapfile_src, split_scale_lyrs, engine, text)
+        with instrument.span('cache'):
+            cache.put(key, [rec.to_list() for rec in lyr_stats])
+        return layer_filter.filter(lyr_stats) if layer_filter else lyr_stats
+    finally:
+        cache.close()
+
+
+def add_data_stats(lyr_stats, mapfile_src, cache=True, text=None):
+    """Set the features, extent and data_size of the layers with file based data, found like MapServer does:
+    relative to the SHAPEPATH, which is relative to the map file. text is the preprocessed map file, so a SHAPEPATH
+    set in an include is found too when the includes are resolved; the map file is read if it isn't given."""
+    if text is None:
+        text = mapfile_preprocess.preprocess(mapfile_src, drop_includes=False)
+    shape_path = _SHAPEPATH_RE.search(text)
+    base_dir = os.path.join(os.path.dirname(os.path.abspath(mapfile_src)), shape_path.group(1) if shape_path else '')
+    sources = []  # (record, (path, table))
+    for rec in lyr_stats:
+        if rec.connection_type == 'OGR' and (rec.connection or '').lower().endswith('.gpkg'):
+            sources.append((rec, (os.path.join(base_dir, rec.connection), rec.data_path)))
+        elif not rec.connection_type and rec.data_path not in ('N/A', None) and '[' not in rec.data_path:
+            path = os.path.join(base_dir, rec.data_path)
+            if not os.path.splitext(path)[1]:  # MapServer adds .shp
+                path += '.shp'
+            sources.append((rec, (path, None)))
+    stats = source_stats.get_stats([src for (rec, src) in sources], cache)
+    for (rec, src) in sources:
+        (rec.features, rec.extent, rec.data_size) = stats.get(src, (None, None, None))
+    return lyr_stats
+
+
+def get_lyr_stats_incremental(mapfile_src, split_scale_lyrs, engine, text, cache):
+    """Get the layer stats of a map file block by block: each LAYER block is fingerprinted, the stats of the blocks
+    seen before are taken from the cache, and only new or changed blocks are read."""
+    try:
+        blocks = mapfile_tokenizer.layer_blocks(text)
+    except mapfile_tokenizer.UnsupportedSyntax as e:
+        set_msg("  Can't split {} into LAYER blocks ({}), reading all of it...".format(mapfile_src, e))
+        return get_lyr_stats(mapfile_src, split_scale_lyrs, engine, text)
+
+    keys = [cache.key(result_cache.hash_bytes(block.encode('utf-8')), tool='mapfile layer',
+                      split_scale_lyrs=split_scale_lyrs) for block in blocks]
+    with instrument.span('cache'):
+        found = cache.get_many(keys)
+    missing = collections.OrderedDict((key, block) for (key, block) in zip(keys, blocks) if key not in found)
+    new = {}
+    if missing:  # read all the new blocks in one go, mappyfile takes a while to get started
+        with instrument.span('parse'):
+            layers = read_layers('MAP\n{}\nEND\n'.format('\n'.join(missing.values())), engine)
+        if len(layers) != len(missing):
+            set_msg("  Unexpected layers in the LAYER blocks of {}, reading all of it...".format(mapfile_src))
+            return get_lyr_stats(mapfile_src, split_scale_lyrs, engine, text)
+        for (key, lyr) in zip(missing, instrument.spans_of(layers, 'layer')):
+            new[key] = layer_records(lyr, split_scale_lyrs)
+        with instrument.span('cache'):
+            cache.put_many(dict((key, [rec.to_list() for rec in recs]) for (key, recs) in new.items()))
+
+    lyr_stats = []
+    for key in keys:
+        if key in new:
+            lyr_stats.extend(new[key])
         else:
-            if lyr['scaletokens']:  # Get scaletokens for text replacement
-                for t_grp in lyr['scaletokens']:
-                    if t_grp['name'] in src_short:
-                        # Traverse with index, to allow peek ahead (or backwards, to avoid peek)
-                        keys = t_grp['values'].keys()
-                        # for scl, val in six.iteritems(t_grp['values']):
-                        for kk in range(len(keys)):
-                            scl = keys[kk]
-                            try:
-                                next_scl = int(keys[kk+1])-1
-                            except:
-                                next_scl = '-'
-                            groups[grp].append([nam, src_short.replace(t_grp['name'], t_grp['values'][scl]),
-                                                visi, int(scl), next_scl, src_long,
-                                                wms_title, wms_layer_group, wms_abstract, wms_group_title, wms_group_abstract])
-
-    return groups
+            lyr_stats.extend(LayerRecord.from_list(values) for values in found[key])
+    set_msg("  {} of {} LAYER blocks unchanged, {} read.".format(len(blocks) - len(missing), len(blocks),
+                                                                 len(missing)))
+    instrument.count('layers', len(missing))
+    instrument.count('layer_blocks_reused', len(blocks) - len(missing))
+    lyr_stats.sort(key=operator.attrgetter('group'))
+    return lyr_stats
+
+
+def main_diff(old_mapfile_src, mapfile_src, outfile_path, split_scale_lyrs=False, drop_includes=True,
+              engine='mappyfile', cache=True):
+    """Write the layers added, removed and modified from old_mapfile_src to mapfile_src to xlsx (or csv),
+    with a row per changed column for the modified ones. Returns the diff rows."""
+    set_msg("Comparing {} to {}...".format(old_mapfile_src, mapfile_src))
+    with instrument.span('diff'):
+        old_stats = summarise_file(old_mapfile_src, split_scale_lyrs, drop_includes, engine, cache, incremental=True)
+        new_stats = summarise_file(mapfile_src, split_scale_lyrs, drop_includes, engine, cache, incremental=True)
+        rows = diff_lyr_stats(old_stats, new_stats)
+
+    changes = collections.Counter(row[0] for row in rows if row[0] != 'modified')
+    modified = len(set(row[1] for row in rows if row[0] == 'modified'))
+    set_msg("  {} layers added, {} removed, {} modified.".format(changes['added'], changes['removed'], modified))
+    if os.path.splitext(outfile_path)[1].lower() == '.csv':
+        with open(outfile_path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(DIFF_HEADINGS)
+            writer.writerows(rows)
+    else:
+        outfile_path = os.path.splitext(outfile_path)[0] + '.xlsx'
+        OfficeUtils.iters2xlsx([('Changes', rows)], outfile_path, DIFF_HEADINGS, {'widths': DIFF_WIDTHS})
+    set_msg("  Output written to {}.".format(outfile_path))
+    return rows
+
+
+def diff_lyr_stats(old_stats, new_stats):
+    """Compare two lists of layer records by layer name (and order, for layers with the same name, e.g. split by
+    scale). Returns rows of [change, layer, column heading, old value, new value], with change being 'added',
+    'removed' or 'modified', and a row per changed column for the modified layers."""
+    old = _by_layer(old_stats)
+    new = _by_layer(new_stats)
+    rows = []
+    for (key, rec) in new.items():
+        if key not in old:
+            rows.append(['added', key[0], '', '', ''])
+            continue
+        for (k, heading) in COLUMNS:
+            (before, after) = (getattr(old[key], k), getattr(rec, k))
+            if before != after:
+                rows.append(['modified', key[0], heading, before, after])
+    for key in old:
+        if key not in new:
+            rows.append(['removed', key[0], '', '', ''])
+    return rows
+
+
+def _by_layer(lyr_stats):
+    """The records by (layer name, occurrence)."""
+    seen = collections.Counter()
+    by_layer = collections.OrderedDict()
+    for rec in lyr_stats:
+        by_layer[(rec.layer, seen[rec.layer])] = rec
+        seen[rec.layer] += 1
+    return by_layer
+
+
+def write_output(stats, out_path, combined=False, check_tables=False, data_stats=False):
+    """Write the layer records (any iterable) to xlsx, or csv/jsonl/parquet depending on the extension, streaming them.
+    With combined, the map file (source_file) of each record is added as the first column, and with check_tables
+    and data_stats their columns after the data path."""
+    set_msg("  Writing {}...".format(out_path))
+    # for (mapnam, lyr_stats) in map_dic.items():  # unzip dict to lists
+    #     sheets.append(mapnam)
+    #     stats.append(lyr_stats)
+    # print(stats)
+    columns = COLUMNS
+    widths = WIDTHS
+    n = [k for (k, heading) in COLUMNS].index('data_path') + 1
+    if data_stats:
+        columns = columns[:n] + [('features', 'Features'), ('extent', 'Extent'), ('data_size', 'Size (bytes)')] + \
+            columns[n:]
+        widths = widths[:n] + [10, 40, 12] + widths[n:]
+    if check_tables:
+        columns = columns[:n] + [('data_ok', 'Data OK?')] + columns[n:]
+        widths = widths[:n] + [20] + widths[n:]
+    if combined:
+        columns = [('source_file', 'Map file')] + columns
+        widths = [40] + widths
+    with instrument.span('write'):
+        output_writers.write_tables(out_path, columns, [(None, stats)], {'widths': widths})
+    set_msg("  Output written to {}.".format(out_path))
+
+
+def get_lyr_stats(mapfile_src, split_scale_lyrs=False, engine='mappyfile', text=None, layer_filter=None):
+    """Get the layer stats of a map file, as a list of LayerRecords sorted by layer group.
+    text is the preprocessed map file, if it's already been read (with includes resolved or dropped).
+
+    With layer_filter, the layers are checked against the filter before their records are made, and with mappyfile
+    only the LAYER blocks that can meet it are parsed, see screen_blocks."""
+    if text is None:
+        text = mapfile_preprocess.preprocess(mapfile_src, drop_includes=False)
+    if layer_filter and engine != 'fast':  # the fast reader is quick enough to read all the layers
+        text = screen_blocks(mapfile_src, text, layer_filter, split_scale_lyrs)
+    with instrument.span('parse'):
+        layers = read_layers(text, engine)
+
+    lyr_stats = []
+    for lyr in instrument.spans_of(layers, 'layer'):
+        if layer_filter is None:
+            lyr_stats.extend(layer_records(lyr, split_scale_lyrs))
+        elif layer_wanted(lyr, layer_filter, split_scale_lyrs):  # split scale records have scale ranges of their own
+            lyr_stats.extend(layer_filter.filter(layer_records(lyr, split_scale_lyrs)))
+
+    instrument.count('layers', len(layers))
+    lyr_stats.sort(key=operator.attrgetter('group'))  # stable, so the layers keep their order within the groups
+    return lyr_stats
+
+
+def screen_blocks(mapfile_src, text, layer_filter, split_scale_lyrs=False):
+    """The LAYER blocks of map file text that can meet layer_filter, as map file text. Each block is read with the
+    streaming reader in mapfile_tokenizer, and blocks it can't read are kept."""
+    with instrument.span('screen'):
+        try:
+            blocks = mapfile_tokenizer.layer_blocks(text)
+        except mapfile_tokenizer.UnsupportedSyntax as e:
+            set_msg("  Can't split {} into LAYER blocks ({}), reading all of it...".format(mapfile_src, e))
+            return text
+        kept = []
+        for block in blocks:
+            try:
+                layers = mapfile_tokenizer.loads_layers(block)
+            except mapfile_tokenizer.UnsupportedSyntax:
+                layers = None
+            if layers is None or len(layers) != 1 or layer_wanted(layers[0], layer_filter, split_scale_lyrs):
+                kept.append(block)
+    instrument.count('layers_screened_out', len(blocks) - len(kept))
+    if len(kept) == len(blocks):
+        return text
+    return 'MAP\n{}\nEND\n'.format('\n'.join(kept))
+
+
+def layer_wanted(lyr, layer_filter, split_scale_lyrs=False):
+    """Check a layer, as read by read_layers, against a layer_filter.LayerFilter, from its values as they are.
+    With scale tokens, the data path isn't checked, nor with split_scale_lyrs the scales, as the records can differ
+    from the layer in those; layer_filter.filter decides on the records."""
+    src = None
+    (max_scale, min_scale) = (lyr.get('minscaledenom', 'N/A'), lyr.get('maxscaledenom', 'N/A'))
+    if lyr.get('scaletokens'):  # the data path changes when the scale tokens are filled in
+        if split_scale_lyrs:  # and the records get the scales of the token intervals
+            (max_scale, min_scale) = (None, None)
+    else:
+        src = lyr['data'] if 'data' in lyr.keys() else lyr.get('connection', 'N/A')
+        if isinstance(src, list):  # older mappyfile versions give a list
+            src = src[0]
+    return layer_filter.match(lyr['name'], lyr['group'] or '', src, max_scale, min_scale, lyr.get('status', 'N/A'))
+
+
+def layer_records(lyr, split_scale_lyrs=False):
+    """Make the LayerRecord(s) of a layer, as read by read_layers: one, or one per scale with split_scale_lyrs."""
+    nam = lyr['name']
+    if nam == 'Byomraade':
+        print(nam)
+        print(lyr['metadata'].keys())
+
+    min_scale = str(lyr['maxscaledenom']) if 'maxscaledenom' in lyr.keys() else 'N/A'
+    max_scale = str(lyr['minscaledenom']) if 'minscaledenom' in lyr.keys() else 'N/A'
+    meta = lyr['metadata']
+    wms_title = str(hack_asciify(lyr['metadata']['wms_title'])) if 'wms_title' in lyr['metadata'].keys() else 'N/A'
+    wms_layer_group = str(hack_asciify(lyr['metadata']['wms_layer_group'])) if 'wms_layer_group' in lyr['metadata'].keys() else '-'
+    wms_abstract = str(hack_asciify(lyr['metadata']['wms_abstract'])) if 'wms_abstract' in lyr['metadata'].keys() else 'N/A'
+    wms_group_title = str(hack_asciify(lyr['metadata']['wms_group_title'])) if 'wms_group_title' in lyr['metadata'].keys() else 'N/A'
+    wms_group_abstract = str(hack_asciify(lyr['metadata']['wms_group_abstract'])) if 'wms_group_abstract' in lyr['metadata'].keys() else 'N/A'
+    wms = dict(wms_title=wms_title, wms_layer_group=wms_layer_group, wms_abstract=wms_abstract,
+               wms_group_title=wms_group_title, wms_group_abstract=wms_group_abstract)
+
+    visi = lyr['status'] if 'status' in lyr.keys() else 'N/A'  # ON -> True
+
+    tokens = scale_tokens.compile_tokens(lyr['scaletokens'])  # compiled once per distinct set of tokens
+    if 'data' in lyr.keys():
+        src_long = lyr['data']
+        if isinstance(src_long, list):  # older mappyfile versions give a list
+            src_long = src_long[0]
+    elif 'connection' in lyr.keys():
+        src_long = lyr['connection']
+    else:
+        src_long = 'N/A'
+
+    src_short = strip_from_string(src_long, ' using')  # src_long[:src_long.lower().index(' using')]
+    src_short = src_short.replace('geometri from ', '')
+    conn = lyr.get('connection')
+    conn_type = str(lyr['connectiontype']).upper() if lyr.get('connectiontype') else None
+
+    grp = lyr['group']
+    if not grp:
+        grp = '-'  # wms_layer_group
+    if split_scale_lyrs and tokens.used_in(src_short):  # a row per scale interval
+        return [LayerRecord(layer=nam, group=grp, data_path=scl_src, visible=visi, max_scale=scl, min_scale=next_scl,
+                            data_sql=src_long, connection=conn, connection_type=conn_type, **wms)
+                for (scl, next_scl, scl_src) in tokens.expand(src_short)]
+    return [LayerRecord(layer=nam, group=grp, data_path=tokens.summarise(src_short), visible=visi,
+                        max_scale=max_scale, min_scale=min_scale, data_sql=src_long, connection=conn,
+                        connection_type=conn_type, **wms)]
+
+
+def read_layers(text, engine='mappyfile'):
+    """Read the layers of preprocessed map file text, as dicts.
+
+    engine='fast' uses the streaming reader in mapfile_tokenizer, which only reads what get_lyr_stats needs,
+    and falls back to mappyfile for syntax it doesn't handle.
+    """
+    if engine == 'fast':
+        try:
+            return mapfile_tokenizer.loads_layers(text)
+        except mapfile_tokenizer.UnsupportedSyntax as e:
+            set_msg("  Fast reader gave up ({}), falling back to mappyfile...".format(e))
+    import mappyfile  # https://pypi.org/project/mappyfile/ - only imported when needed, it takes a while
+    mapfile = mappyfile.loads(text, expand_includes=False)  # includes are handled by mapfile_preprocess
+    if mapfile.get('__type__') == 'layer':  # a LAYER block on its own, see get_lyr_stats_incremental
+        return [mapfile]
+    return mapfile["layers"]
 
 
 def hack_asciify(s):
@@ -180,46 +653,6 @@ def encodeIfUnicode(strval):
     return str(strval)
 
 
-def has_bom(f):
-    """From https://gist.github.com/nevill/6a59ad277342bea2f8108cf55a35ba3e"""
-    UTF8_BOM = b'\xef\xbb\xbf'
-    UTF16_BOM = b'\xff\xfe'
-    with open(f, 'rb') as bs:
-        s = bs.read(3)
-        if s.startswith(UTF8_BOM) or s.startswith(UTF16_BOM):
-            return True
-    return False
-
-
-def remove_bom_in_place(path):
-    """Removes BOM mark, if it exists, from a file and rewrites it in-place."""
-    # From: https://www.stefangordon.com/remove-bom-mark-from-text-files-in-python/
-    buffer_size = 4096
-    bom_length = len(codecs.BOM_UTF8)
-
-    with open(path, "r+b") as fp:
-        chunk = fp.read(buffer_size)
-        if chunk.startswith(codecs.BOM_UTF8):
-            i = 0
-            chunk = chunk[bom_length:]
-            while chunk:
-                fp.seek(i)
-                fp.write(chunk)
-                i += len(chunk)
-                fp.seek(bom_length, os.SEEK_CUR)
-                chunk = fp.read(buffer_size)
-            fp.seek(-bom_length, os.SEEK_CUR)
-            fp.truncate()
-
-
 if __name__ == "__main__":
-    the_map = r'C:\Temp\my_map.map'
-    xlsx = r'C:\Temp\my_map.xlsx'
-
-    if len(sys.argv) < 2 or len(sys.argv) > 4:
-        print("Usage: python " + __file__ + " MAPFILE_SRC XLSX_TARG")
-    if len(sys.argv) > 1:
-        the_map = sys.argv[1]
-        xlsx = sys.argv[2]
-
-    main(the_map, xlsx, True)
+    import summarise  # the command line is shared by all the summarisers
+    summarise.main()
@@ -5,50 +5,122 @@ Utility to summarise the contents of an Esri mxd file.
 Created by: Hanne L. Petersen <halpe@sdfe.dk>
 Created: 2019(ish)
 """
-import sys
-
-from office_utils import OfficeUtils
+import os
+
+import output_writers
+import result_cache
+import path_check
+import scale_index
+import describe_memo
+import layer_filter as layer_filters
+import inventory as inventory_store
+import instrument
+from layer_record import LayerRecord
 
 is_in_arcgis = 'arcgis' in globals()  # this check MUST be done before anything using arcpy is imported!
-import arcpy
+arcpy = None  # imported on first use by import_arcpy, it takes a while
 
 
 def set_msg(msg, severity=0):  # placeholder
     print(msg)
 
 
-def summarise_mxd(mxd_path, outfile_path=None, check_paths=False):
-    mxd = arcpy.mapping.MapDocument(mxd_path)
-    lyr_lst = arcpy.mapping.ListLayers(mxd)
-    set_msg("  Reading {}...".format(mxd_path))
-
-    lyr_stats = get_lyr_stats(lyr_lst, check_paths)
+# (layer record key, heading) of the output columns, data_ok is only included with check_paths
+COLUMNS = [('layer', 'Layer'), ('data_path', 'Data path'), ('data_ok', 'Data OK?'), ('visible', 'Visibility'),
+           ('transparency', 'Transparency'), ('max_scale', 'Max. scale'), ('min_scale', 'Min. scale'),
+           ('definition_query', 'Definition query'), ('joins', 'Joins')]
+
+
+def summarise_mxd(mxd_path, outfile_path=None, check_paths=False, cache=True, inventory=None, describe_cache=None,
+                  zoom_scales=None, layer_filter=None):
+    """Summarise the layers of an mxd. describe_cache (True or a path) keeps the field lookups of the join check
+    between runs of the same mxd file, see describe_memo. With zoom_scales (a list of scales), the layers and data
+    sources active at each scale are reported in a file next to the output, see scale_index. With layer_filter (a
+    layer_filter.LayerFilter), only the layers that meet the filter are summarised; the cache only holds whole mxd
+    files, so a filtered run uses them, but doesn't store its own. The data sources aren't cached, with check_paths
+    they're checked anew on every run."""
+    # Look for the layer stats in the result cache first (not for CURRENT, or other non-files)
+    content_hash = result_cache.hash_file(mxd_path) if os.path.isfile(mxd_path) and (cache or describe_cache) else None
+    cache = result_cache.open_cache(cache) if content_hash else None
+    lyr_stats = None
+    if cache:
+        key = cache.key(content_hash, tool='mxd')
+        with instrument.span('cache'):
+            cached = cache.get(key)
+        if cached is not None:
+            set_msg("  Using cached layer stats for {}.".format(mxd_path))
+            instrument.count('cache_hits')
+            lyr_stats = [LayerRecord.from_list(values) for values in cached]
+            if layer_filter:
+                lyr_stats = layer_filter.filter(lyr_stats)
+
+    if lyr_stats is None:
+        with instrument.span('open'):
+            import_arcpy()
+            mxd = arcpy.mapping.MapDocument(mxd_path)
+            lyr_lst = arcpy.mapping.ListLayers(mxd)
+        set_msg("  Reading {}...".format(mxd_path))
+
+        memo = describe_memo.DescribeMemo(arcpy.Describe, describe_cache, scope=content_hash)
+        try:
+            with instrument.span('map'):
+                lyr_stats = get_lyr_stats(lyr_lst, False, memo=memo, layer_filter=layer_filter)
+        finally:
+            memo.close()
+        if cache and not layer_filter:
+            with instrument.span('cache'):
+                cache.put(key, [rec.to_list() for rec in lyr_stats])
+    if cache:
+        cache.close()
+    if check_paths:  # not cached, the data sources can come and go
+        check_records(lyr_stats)
+    if inventory and layer_filter:
+        set_msg("  Not storing the layers in the inventory, they're filtered.", 30)
+    elif inventory and os.path.isfile(mxd_path):  # with inventory, the layers are also stored in the inventory
+        with instrument.span('inventory'):
+            inventory_store.record(inventory, mxd_path, 'mxd', [(None, lyr_stats)])
 
     # Write outputs
+    columns = [(k, heading) for (k, heading) in COLUMNS if check_paths or k != 'data_ok']
+    keys = [k for (k, heading) in columns]
     if outfile_path:
         if outfile_path.split('.')[1] in ('xls', 'xlsx'):   # Write xlsx
             xlsx_path = outfile_path.split('.')[0] + '.xlsx'  # ensure it's xlsx and not xls
-            headings = ['Layer', 'Data path', 'Visibility', 'Transparency', 'Max. scale',
-                        'Min. scale', 'Definition query', 'Joins']
-            if check_paths:
-                headings = headings[:2] + ['Data OK?'] + headings[2:]
-            OfficeUtils.lists2xlsx(lyr_stats, xlsx_path, headings)
+            with instrument.span('write'):
+                output_writers.write_tables(xlsx_path, columns, [('Sheet1', lyr_stats)])
             set_msg("  Output written to {}.".format(xlsx_path))
 
+        elif os.path.splitext(outfile_path)[1].lower() in output_writers.WRITERS:  # csv, jsonl, parquet
+            with instrument.span('write'):
+                output_writers.write_tables(outfile_path, columns, [(None, lyr_stats)])
+            set_msg("  Output written to {}.".format(outfile_path))
+
         else:  # Write txt
             with open(outfile_path, 'w') as wf:
-                for l in lyr_stats:
-                    wf.write(encode_if_unicode('\t'.join(l) + '\n'))
+                for rec in lyr_stats:
+                    wf.write(encode_if_unicode('\t'.join(text_row(rec.row(keys))) + '\n'))
             set_msg("  Output written to {}.".format(outfile_path))
 
+        if zoom_scales:
+            with instrument.span('zoom report'):
+                set_msg("  Zoom report written to {}.".format(
+                    scale_index.write_report([(None, lyr_stats)], outfile_path, zoom_scales)))
+
     # Output to screen
     else:
-        set_msg(['\n'.join(['\t'.join(l) for l in lyr_stats])])
+        set_msg(['\n'.join(['\t'.join(text_row(rec.row(keys))) for rec in lyr_stats])])
+
 
+def get_lyr_stats(lyr_lst, check_paths, check_func=None, memo=None, layer_filter=None):
+    """Get a LayerRecord of stats per layer.
 
-def get_lyr_stats(lyr_lst, check_paths):
+    With check_paths, the data sources are checked with check_func (default: arcpy.Exists) once all layers are read,
+    see path_check. The joins are looked up through memo (a describe_memo.DescribeMemo), if given.
+    With layer_filter, the layers that don't meet it are skipped before their joins are looked up or their data
+    sources checked.
+    """
     lyr_stats = []
-    for lyr in lyr_lst:
+    for (n, lyr) in enumerate(instrument.spans_of(lyr_lst, 'layer')):
         nam = encode_if_unicode(lyr.longName)
         try:
             nam = nam.decode('utf8')
@@ -59,11 +131,6 @@ def get_lyr_stats(lyr_lst, check_paths):
 
         try:
             src = lyr.dataSource  # annos don't support dataSource...
-            if check_paths:
-                if arcpy.Exists(src):
-                    path_ok = 'OK'
-                else:
-                    path_ok = 'missing'
         except (NameError, ValueError):
             if lyr.isGroupLayer:
                 src = '[group layer]'
@@ -77,6 +144,10 @@ def get_lyr_stats(lyr_lst, check_paths):
         if not max_scale > 1:
             max_scale = '-'
 
+        if layer_filter and not layer_filter.match(nam, layer_filters.parent_path(nam), src, max_scale, min_scale,
+                                                   visi):
+            continue
+
         try:
             def_qry = lyr.definitionQuery
         except (NameError, ValueError):
@@ -88,28 +159,66 @@ def get_lyr_stats(lyr_lst, check_paths):
             tr = 'N/A'
 
         # Look for joins - https://gis.stackexchange.com/a/7715
-        join_lst = join_check(lyr)
+        join_lst = join_check(lyr, memo, u'{} {}'.format(n, nam))
         joins = ', '.join(join_lst)
 
-        if check_paths:
-            lyr_stats.append([nam, src, path_ok, str(visi), tr, max_scale, min_scale, def_qry, joins])
-        else:
-            lyr_stats.append([nam, src, str(visi), tr, max_scale, min_scale, def_qry, joins])
+        rec = LayerRecord(layer=nam, data_path=src, visible=str(visi), transparency=tr, max_scale=max_scale,
+                          min_scale=min_scale, definition_query=def_qry, joins=joins)
+        lyr_stats.append(rec)
+        instrument.count('layers')
 
+    if check_paths:
+        check_records(lyr_stats, check_func)
     return lyr_stats
 
 
-def join_check(lyr):
-    tbl_set = set()
+def check_records(lyr_stats, check_func=None):
+    """Set data_ok of the records from their data sources, checked with check_func (default: arcpy.Exists), see
+    path_check. Group layers and layers without a source get '-'."""
+    to_check = []  # (record, data source)
+    for rec in lyr_stats:
+        rec.data_ok = '-'
+        if rec.data_path and rec.data_path != '[group layer]':
+            to_check.append((rec, rec.data_path))
+    if to_check:
+        if check_func is None:
+            import_arcpy()
+            check_func = arcpy.Exists
+        with instrument.span('check paths'):
+            statuses = path_check.check_sources([src for (rec, src) in to_check], check_func,
+                                                progress=_check_progress)
+        for (rec, src) in to_check:
+            rec.data_ok = statuses[src]
+    return lyr_stats
+
+
+def _check_progress(checked, total):
+    if not checked % 20 or checked == total:
+        set_msg("    checked {} of {} data sources".format(checked, total))
+
+
+def join_check(lyr, memo=None, key=None):
+    """The tables joined to a layer, from its qualified field names. With a memo, the field names are looked up
+    through it, by key (the layer's position and long name, see describe_memo)."""
+    import_arcpy()
     try:
-        fld_lst = arcpy.Describe(lyr).fields
-        for fld in fld_lst:
-            if fld.name.find('.') > -1:
-                if fld.name.split('.')[0] != lyr.datasetName:
-                    tbl_set.add(fld.name.split('.')[0])
+        if memo:
+            return memo.join_tables(lyr, key, lyr.datasetName)
+        return describe_memo.join_tables(describe_memo.field_names(arcpy.Describe, lyr), lyr.datasetName)
     except (RuntimeError, AttributeError):  # anno layers have a "layer" per anno class, and these don't have fields
         return []  # False
-    return tbl_set
+
+
+def import_arcpy():
+    global arcpy
+    if arcpy is None:
+        import arcpy
+    return arcpy
+
+
+def text_row(row):
+    """The values of a row as text, for the txt output (transparency and scales are numbers)."""
+    return [v if isinstance(v, basestring) else str(v) for v in row]
 
 
 def encode_if_unicode(strval):
@@ -120,16 +229,9 @@ def encode_if_unicode(strval):
 
 
 if __name__ == "__main__":
-    mxd = r'C:\Temp\my_project.mxd'
-    txt = r'C:\Temp\mxd_overview.xlsx'
-
     if is_in_arcgis:
-        mxd = arcpy.GetParameterAsText(0)
-        txt = arcpy.GetParameterAsText(1)
+        import_arcpy()
+        summarise_mxd(arcpy.GetParameterAsText(0), arcpy.GetParameterAsText(1))
     else:
-        if len(sys.argv) > 1:
-            mxd = sys.argv[1]
-        if len(sys.argv) > 2:
-            txt = sys.argv[2]
-
-    summarise_mxd(mxd, txt)
+        import summarise  # the command line is shared by all the summarisers
+        summarise.main()
@@ -0,0 +1,25 @@
+import os
+import sys
+import shlex
+import subprocess
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def python2():
+    """A py2 interpreter to run (the command as a list), from $PYTHON2 (may include arguments, e.g.
+    "env PYENV_VERSION=2.7.18 python") or the path. Skips the test if there's none."""
+    for cmd in (os.environ.get('PYTHON2'), 'python2.7', 'python2'):
+        if not cmd:
+            continue
+        cmd = shlex.split(cmd)
+        try:
+            subprocess.check_output(cmd + ['-c', 'import sys; assert sys.version_info[0] == 2'],
+                                    stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError):
+            continue
+        return cmd
+    pytest.skip("no py2 interpreter, set PYTHON2")
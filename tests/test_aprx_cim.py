@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import zipfile
+
+import pytest
+
+import aprx_cim
+import summarise_aprx
+
+SDE = {'type': 'CIMStandardDataConnection', 'workspaceFactory': 'SDE', 'dataset': 'geo.vej.veje',
+       'workspaceConnectionString': 'ENCRYPTED_PASSWORD=xx;SERVER=db;DATABASE=geo;USER=reader'}
+GDB = {'type': 'CIMStandardDataConnection', 'workspaceFactory': 'FileGDB', 'featureDataset': 'hydro',
+       'dataset': 'soer', 'workspaceConnectionString': 'DATABASE=..\\data\\geo.gdb'}
+DOCS = {
+    'GISProject.json': {'type': 'CIMGISProject', 'projectItems': [
+        {'type': 'CIMProjectItem', 'itemType': 'Map', 'name': 'Kort', 'catalogPath': 'CIMPATH=map/map.json'}]},
+    'map/map.json': {'type': 'CIMMap', 'name': 'Kort', 'layers': ['CIMPATH=map/group.json', 'CIMPATH=map/soer.json',
+                                                                 'CIMPATH=map/gone.json']},
+    'map/group.json': {'type': 'CIMGroupLayer', 'name': 'Veje', 'visibility': True,
+                       'layers': ['CIMPATH=map/veje.json']},
+    'map/veje.json': {'type': 'CIMFeatureLayer', 'name': 'Vejmidter', 'visibility': True, 'transparency': 20,
+                      'minScale': 50000, 'maxScale': 500,
+                      'featureTable': {'type': 'CIMFeatureTable', 'definitionExpression': 'vejtype = 1',
+                                       'dataConnection': {'type': 'CIMRelQueryTableDataConnection',
+                                                          'sourceTable': SDE}}},
+    'map/soer.json': {'type': 'CIMFeatureLayer', 'name': u'Søer',
+                      'featureTable': {'type': 'CIMFeatureTable', 'dataConnection': GDB}},
+}
+
+
+@pytest.fixture
+def aprx(tmp_path):
+    path = tmp_path / 'project' / 'test.aprx'
+    path.parent.mkdir()
+    with zipfile.ZipFile(str(path), 'w') as z:
+        for (uri, doc) in DOCS.items():
+            z.writestr(uri, json.dumps(doc))
+    return str(path)
+
+
+def test_layers(aprx):
+    with aprx_cim.ArcGISProject(aprx) as project:
+        maps = project.listMaps()
+        assert [m.name for m in maps] == ['Kort']
+        layers = maps[0].listLayers()
+        assert [lyr.longName for lyr in layers] == ['Veje', 'Veje\\Vejmidter', u'Søer']
+        (group, veje, soer) = layers
+        assert group.isGroupLayer and not group.isFeatureLayer
+        with pytest.raises(AttributeError):
+            group.dataSource
+        assert (veje.visible, veje.transparency, veje.minThreshold, veje.maxThreshold) == (True, 20, 50000, 500)
+        assert veje.definitionQuery == 'vejtype = 1'
+        assert (soer.visible, soer.definitionQuery) == (False, '')
+
+
+def test_data_sources(aprx, tmp_path):
+    with aprx_cim.ArcGISProject(aprx) as project:
+        (group, veje, soer) = project.listMaps()[0].listLayers()
+        # the joined table's source, without the password
+        assert veje.dataSource == os.sep.join(['SERVER=db;DATABASE=geo;USER=reader', 'geo.vej.veje'])
+        # relative to the aprx
+        assert soer.dataSource == os.sep.join([str(tmp_path / 'data' / 'geo.gdb'), 'hydro', 'soer'])
+
+
+def test_not_cim(tmp_path):
+    path = str(tmp_path / 'old.aprx')
+    with zipfile.ZipFile(path, 'w') as z:
+        z.writestr('GISProject.xml', '<xml/>')
+    with pytest.raises(ValueError, match='ArcGIS Pro 3.0'):
+        aprx_cim.ArcGISProject(path)
+
+
+def test_get_map_stats(aprx):
+    maps = summarise_aprx.get_map_stats(aprx, cache=False, engine='cim')
+    records = dict((rec.layer, rec) for rec in maps['Kort'])
+    assert sorted(records) == [u'Søer', 'Veje', 'Veje\\Vejmidter']
+    veje = records['Veje\\Vejmidter']
+    assert (veje.definition_query, veje.transparency) == ('vejtype = 1', 20)
+    assert records['Veje'].data_path == '[group layer]'
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import json
+
+import aprx_cim
+import arcade_fields
+
+
+def cim(doc):
+    return json.loads(json.dumps(doc), object_hook=aprx_cim.CimObject)
+
+
+def test_feature_access():
+    expr = 'var t = $feature.VEJTYPE; return t + $feature["Kl asse"] + $feature[\'navn\'] + $Feature.vejtype;'
+    assert arcade_fields.expression_fields(expr) == ('VEJTYPE', 'Kl asse', 'navn', 'vejtype')
+
+
+def test_strings_and_comments_skipped():
+    expr = '''// $feature.commented
+    /* $feature.block
+       comment */
+    var s = "$feature.in_string";
+    return s + '$feature.single' + $feature.real;'''
+    assert arcade_fields.expression_fields(expr) == ('real',)
+
+
+def test_template_literals():
+    expr = 'return `${$feature.vejnavn} ${Round($feature["laengde"], 1)} m, not $feature.plain`;'
+    assert arcade_fields.expression_fields(expr) == ('vejnavn', 'laengde')
+
+
+def test_field_functions():
+    expr = ('Expects($feature, "a", \'b\'); var d = DomainName($feature, "kode"); '
+            'return DomainCode($feature, "type", d) + Expects($feature, Concatenate(["x"]));')
+    assert arcade_fields.expression_fields(expr) == ('a', 'b', 'kode', 'type')
+
+
+def test_renderer_fields():
+    assert arcade_fields.renderer_fields(cim({'fields': ['TYPE', 'KLASSE']})) == ('Standard', ['TYPE', 'KLASSE'])
+    assert arcade_fields.renderer_fields(cim({'field': 'AREAL'})) == ('Standard', ['AREAL'])
+    renderer = cim({'fields': [], 'valueExpressionInfo': {'expression': 'return $feature.vejtype;'}})
+    assert arcade_fields.renderer_fields(renderer) == ('Custom', ['vejtype'])
+    assert arcade_fields.renderer_fields(cim({'type': 'CIMSimpleRenderer'})) is None
+
+
+def test_renderer_classes():
+    unique = cim({'groups': [{'classes': [{'values': [{'fieldValues': ['1', 'A']}]},
+                                          {'values': [{'fieldValues': ['2', 'B']}, {'fieldValues': ['3', 'B']}]}]}]})
+    assert arcade_fields.renderer_classes(unique) == ['1,A', '2,B', '3,B']
+    breaks = cim({'breaks': [{'upperBound': 10.0}, {'upperBound': 2.5e6}, {}]})
+    assert arcade_fields.renderer_classes(breaks) == ['10', '2.5e+06']
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import csv
+
+import pytest
+
+import summarise_mapfile
+
+MAP = '''MAP
+  NAME "{0}"
+  LAYER
+    NAME "{0}_veje"
+    TYPE LINE
+    DATA "veje.shp"
+  END
+  LAYER
+    NAME "{0}_soer"
+    TYPE POLYGON
+    DATA "soer.shp"
+  END
+END
+'''
+
+
+@pytest.fixture
+def map_dir(tmp_path):
+    folder = tmp_path / 'maps'
+    folder.mkdir()
+    for name in ('a', 'b', 'c'):
+        (folder / (name + '.map')).write_text(MAP.format(name))
+    (folder / 'broken.map').write_text(u'MAP\n  LAYER\n    NAME "x"\n')
+    (folder / 'notes.txt').write_text(u'not a map file')
+    return folder
+
+
+def read_csv(path):
+    with io.open(str(path), encoding='utf-8', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+@pytest.mark.parametrize('engine', ['fast', 'mappyfile'])
+def test_per_file(map_dir, tmp_path, engine):
+    out = tmp_path / 'out'
+    failures = summarise_mapfile.main_batch(str(map_dir), str(out), engine=engine, cache=False, out_format='.csv',
+                                            max_workers=2)
+    assert [os.path.basename(src) for (src, e) in failures] == ['broken.map']
+    assert sorted(os.listdir(str(out))) == ['a.csv', 'b.csv', 'c.csv']
+    assert [row['layer'] for row in read_csv(out / 'b.csv')] == ['b_veje', 'b_soer']
+
+
+def test_combined_glob(map_dir, tmp_path):
+    out = tmp_path / 'all.csv'
+    summarise_mapfile.main_batch(str(map_dir / '[ab].map'), str(out), combined=True, engine='fast', cache=False,
+                                 max_workers=2)
+    rows = read_csv(out)
+    assert [(os.path.basename(row['source_file']), row['layer']) for row in rows] == [
+        ('a.map', 'a_veje'), ('a.map', 'a_soer'), ('b.map', 'b_veje'), ('b.map', 'b_soer')]
+
+
+def test_find_map_files(map_dir):
+    assert [os.path.basename(f) for f in summarise_mapfile.find_map_files(str(map_dir))] == [
+        'a.map', 'b.map', 'broken.map', 'c.map']
+    assert summarise_mapfile.find_map_files(str(map_dir.parent / '**' / 'c.map')) == [str(map_dir / 'c.map')]
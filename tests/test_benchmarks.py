@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import summarise_aprx  # noqa: E402
+import summarise_mapfile  # noqa: E402
+from benchmarks import run_benchmarks  # noqa: E402
+
+
+def test_both_readers_benchmarked():
+    for engine in ('fast', 'mappyfile'):
+        assert 'get_lyr_stats ({})'.format(engine) in run_benchmarks.STAGES
+        assert 'end-to-end map file ({})'.format(engine) in run_benchmarks.STAGES
+
+
+def test_compare_with_same_inputs(tmp_path, capsys, monkeypatch):
+    for module in (summarise_mapfile, summarise_aprx):  # main quietens them
+        monkeypatch.setattr(module, 'set_msg', module.set_msg)
+    baseline = str(tmp_path / 'baseline.json')
+    args = ['--layers', '20', '--maps', '1', '--repeat', '1', '--stages', 'preprocess', 'parse (fast)']
+    run_benchmarks.main(args + ['--json', baseline])
+    with open(baseline) as f:
+        saved = json.load(f)
+    assert list(saved['results']) == ['preprocess', 'parse (fast)']
+    run_benchmarks.main(args + ['--compare', baseline, '--tolerance', '1000'])
+    assert 'No regressions' in capsys.readouterr().out
+
+
+def test_compare_refuses_other_inputs(tmp_path, capsys):
+    baseline = tmp_path / 'baseline.json'
+    baseline.write_text(json.dumps({'args': {'layers': 10000, 'groups': 20, 'token_sets': 3, 'metadata_size': 5,
+                                             'includes': 0, 'bom': False, 'maps': 2}, 'results': {}}))
+    with pytest.raises(SystemExit) as e:
+        run_benchmarks.main(['--layers', '20', '--compare', str(baseline)])
+    assert e.value.code == 2
+    assert '--layers 10000 (not 20)' in capsys.readouterr().err
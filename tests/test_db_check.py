@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+import db_check
+import summarise_mapfile
+from layer_record import LayerRecord
+
+MAP = '''MAP
+  NAME "veje"
+  LAYER
+    NAME "veje"
+    CONNECTIONTYPE POSTGIS
+    CONNECTION "host=db dbname=geo user=reader"
+    DATA "geometri from vej.veje using unique gid"
+  END
+  LAYER
+    NAME "stier"
+    CONNECTIONTYPE POSTGIS
+    CONNECTION "host=db dbname=geo user=reader"
+    DATA "geometri from vej.stier using unique gid"
+  END
+END
+'''
+
+
+def test_referenced_tables_geom_from():
+    assert db_check.referenced_tables('geometri from vej.veje using unique gid') == ['vej.veje']
+
+
+@pytest.mark.parametrize('engine', ['fast', 'mappyfile'])
+def test_check_tables_geom_from(tmp_path, monkeypatch, engine):
+    monkeypatch.setattr(summarise_mapfile, 'set_msg', lambda *args: None)
+    con = sqlite3.connect(str(tmp_path / 'geo.sqlite'))
+    con.execute('CREATE TABLE "vej.veje" (gid integer)')
+    con.commit()
+    con.close()
+    src = tmp_path / 'veje.map'
+    src.write_text(MAP)
+
+    recs = summarise_mapfile.summarise_file(str(src), engine=engine, cache=False,
+                                            check_tables='sqlite:' + str(tmp_path))
+    assert dict((rec.layer, rec.data_ok) for rec in recs) == {'veje': 'OK', 'stier': 'missing: vej.stier'}
+
+
+class CountingBackend(db_check.SQLiteBackend):
+    def __init__(self, folder):
+        super(CountingBackend, self).__init__(folder)
+        self.queries = 0
+
+    def existing(self, con, names):
+        self.queries += 1
+        return super(CountingBackend, self).existing(con, names)
+
+
+def test_one_query_per_database(tmp_path):
+    sqlite3.connect(str(tmp_path / 'geo.sqlite')).close()
+    backend = CountingBackend(str(tmp_path))
+    recs = [LayerRecord(layer='a', connection_type='POSTGIS', connection='host=db dbname=geo', data_sql='a.b'),
+            LayerRecord(layer='c', connection_type='POSTGIS', connection="dbname='geo'  host=db", data_sql='c.d')]
+    db_check.check_records(recs, pool=db_check.ConnectionPool(backend))
+    assert backend.queries == 1
+    assert [rec.data_ok for rec in recs] == ['missing: a.b', 'missing: c.d']
+
+
+def test_function_calls_not_tables():
+    data = ('geom from (select g.geom, extract(year from g.dato) as aar, substring(g.navn from 1 for 3) as kort '
+            'from vej.veje g join generate_series(1, 3) n on true '
+            'where g.id in (select id from vej.valgte)) as foo using unique gid')
+    assert db_check.referenced_tables(data) == ['vej.veje', 'vej.valgte']
+    assert db_check.referenced_tables('geom from public.lag(2) using srid=25832') == []
+
+
+def test_quoted_identifiers_kept():
+    assert db_check.referenced_tables('geom from "Vej"."Veje" join vej.stier using unique gid') == [
+        '"Vej"."Veje"', 'vej.stier']
+    assert db_check.referenced_tables('"Kort".lag_[fin;grov]') == ['"Kort".lag_fin', '"Kort".lag_grov']
+
+
+def test_quoted_identifiers_in_sqlite(tmp_path):
+    con = sqlite3.connect(str(tmp_path / 'geo.sqlite'))
+    con.execute('CREATE TABLE "vej.veje" (gid integer)')
+    con.commit()
+    con.close()
+    rec = LayerRecord(layer='a', connection_type='POSTGIS', connection='dbname=geo', data_sql='geom from "Vej"."Veje"')
+    db_check.check_records([rec], check_tables='sqlite:' + str(tmp_path))
+    assert rec.data_ok == 'OK'
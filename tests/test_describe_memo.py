@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import subprocess
+
+import describe_memo
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The same base table in two layers of an mxd, joined to a lookup table in the first one only. arcpy.mapping keeps
+# the base table as the dataSource of a joined layer.
+FAKES = r'''
+class Field(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class Layer(object):
+    isGroupLayer = False
+    visible = True
+    minScale = 0
+    maxScale = 0
+    definitionQuery = ''
+    transparency = 0
+
+    def __init__(self, name, fields):
+        self.longName = name
+        self.dataSource = 'C:\\data\\geo.gdb\\veje'
+        self.datasetName = 'veje'
+        self.fields = [Field(f) for f in fields]
+
+
+class Describe(object):
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, lyr):
+        self.calls += 1
+        return lyr
+
+
+def layers():
+    return [Layer('Veje (joined)', ['veje.gid', 'vejtype.navn']), Layer('Veje', ['gid', 'navn'])]
+'''
+exec(FAKES)
+
+MXD_SCRIPT = r'''
+import sys, json
+sys.path.insert(0, sys.argv[1])
+import describe_memo
+import summarise_mxd
+summarise_mxd.import_arcpy = lambda: None
+''' + FAKES + r'''
+memo = describe_memo.DescribeMemo(Describe(), sys.argv[2], scope='mxd hash')
+print(json.dumps([rec.joins for rec in summarise_mxd.get_lyr_stats(layers(), False, memo=memo)]))
+'''
+
+
+def join_tables(memo):
+    return [sorted(memo.join_tables(lyr, '{} {}'.format(n, lyr.longName), lyr.datasetName))
+            for (n, lyr) in enumerate(layers())]
+
+
+def test_joins_are_per_layer():
+    memo = describe_memo.DescribeMemo(Describe())
+    assert join_tables(memo) == [['vejtype'], []]
+
+
+def test_persisted_per_mxd(tmp_path):
+    path = str(tmp_path / 'describe.sqlite')
+    describe = Describe()
+    for (scope, calls) in [('mxd hash', 2), ('mxd hash', 2), ('changed mxd hash', 4)]:
+        memo = describe_memo.DescribeMemo(describe, path, scope=scope)
+        assert join_tables(memo) == [['vejtype'], []]
+        assert describe.calls == calls  # the second run has the fields from the memo file
+        memo.close()
+
+
+def test_not_persisted_without_scope(tmp_path):
+    path = tmp_path / 'describe.sqlite'
+    describe = Describe()
+    for _ in range(2):
+        join_tables(describe_memo.DescribeMemo(describe, str(path)))
+    assert describe.calls == 4
+    assert not path.exists()
+
+
+def test_get_lyr_stats_joins(tmp_path, python2):
+    script = tmp_path / 'mxd.py'
+    script.write_text(MXD_SCRIPT, encoding='utf-8')
+    out = subprocess.check_output(python2 + [str(script), REPO, str(tmp_path / 'describe.sqlite')])
+    assert json.loads(out.decode('utf-8')) == ['vejtype', '']
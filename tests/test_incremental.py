@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import io
+import csv
+
+import pytest
+
+import instrument
+import summarise_mapfile
+
+LAYER = '''  LAYER
+    NAME "{0}"
+    GROUP "{1}"
+    TYPE LINE
+    DATA "{0}.shp"
+  END
+'''
+
+
+def map_text(*layers):
+    return 'MAP\n{}END\n'.format(''.join(LAYER.format(name, group) for (name, group) in layers))
+
+
+def summarise(src, cache_path, engine):
+    instrument.reset()
+    lyr_stats = summarise_mapfile.summarise_file(str(src), cache=cache_path, engine=engine, incremental=True)
+    return (lyr_stats, instrument.snapshot()['counters'])
+
+
+@pytest.mark.parametrize('engine', ['fast', 'mappyfile'])
+def test_only_changed_blocks_read(tmp_path, engine):
+    cache_path = str(tmp_path / 'cache.sqlite')
+    src = tmp_path / 'test.map'
+    src.write_text(map_text(('veje', 'Transport'), ('soer', 'Natur'), ('skov', 'Natur')))
+    (first, counters) = summarise(src, cache_path, engine)
+    assert counters['layers'] == 3
+
+    layers = (('veje', 'Transport'), ('soer', 'Natur'), ('skov', 'Natur'), ('stier', 'Transport'))
+    src.write_text(map_text(*layers).replace('"soer.shp"', '"soer_2024.shp"'))
+    (second, counters) = summarise(src, cache_path, engine)
+    assert (counters['layers'], counters['layer_blocks_reused']) == (2, 2)
+    assert second == summarise_mapfile.summarise_file(str(src), cache=False, engine=engine)
+
+
+def test_diff(tmp_path):
+    old = tmp_path / 'old.map'
+    old.write_text(map_text(('veje', 'Transport'), ('soer', 'Natur')))
+    new = tmp_path / 'new.map'
+    new.write_text(map_text(('veje', 'Vej'), ('skov', 'Natur')))
+    out = tmp_path / 'diff.csv'
+    rows = summarise_mapfile.main_diff(str(old), str(new), str(out), engine='fast', cache=False)
+    assert sorted(rows) == [['added', 'skov', '', '', ''], ['modified', 'veje', 'Layer group', 'Transport', 'Vej'],
+                            ['removed', 'soer', '', '', '']]
+    with io.open(str(out), encoding='utf-8', newline='') as f:
+        assert list(csv.reader(f))[1:] == rows
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import json
+import pstats
+import threading
+
+import pytest
+
+import instrument
+
+
+@pytest.fixture(autouse=True)
+def fresh_recorder():
+    instrument.reset()
+    yield
+    instrument.reset()
+
+
+def test_spans_nest_and_aggregate():
+    with instrument.span('map file'):
+        for _ in instrument.spans_of(range(3), 'layer'):
+            pass
+        with instrument.span('write'):
+            pass
+    spans = instrument.snapshot()['spans']
+    assert list(spans) == ['map file/layer', 'map file/write', 'map file']
+    assert spans['map file/layer']['count'] == 3
+    assert spans['map file']['seconds'] >= spans['map file/layer']['seconds']
+
+
+def test_spans_per_thread():
+    def work():
+        with instrument.span('stage parse'):
+            pass
+
+    with instrument.span('summarise'):
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    spans = instrument.snapshot()['spans']
+    assert spans['stage parse']['count'] == 4  # not under the main thread's span
+    assert 'summarise/stage parse' not in spans
+
+
+def test_counters_and_merge():
+    instrument.count('layers', 2)
+    list(instrument.counted(iter('abc'), 'rows'))
+    worker = instrument.Recorder()
+    with worker.span('map file'):
+        worker.count('layers', 5)
+    with instrument.span('batch'):
+        instrument.merge(worker.to_dict())
+    data = instrument.snapshot()
+    assert data['counters'] == {'layers': 7, 'rows': 3}
+    assert data['spans']['batch/map file']['count'] == 1
+
+
+def test_export_and_report(tmp_path):
+    with instrument.span('parse'):
+        instrument.count('layers')
+    path = str(tmp_path / 'timings.json')
+    instrument.export_json(path)
+    with open(path) as f:
+        assert json.load(f)['counters'] == {'layers': 1}
+    lines = []
+    instrument.report(lines.append)
+    assert lines[0] == 'Timings (s):' and lines[1].split()[0] == 'parse' and lines[-1] == '  layers: 1'
+
+
+def test_profile(tmp_path):
+    path = str(tmp_path / 'out.prof')
+    lines = []
+    with instrument.profile(path, memory=True, set_msg=lines.append):
+        sorted(range(1000))
+    assert pstats.Stats(path).total_calls > 0
+    assert instrument.snapshot()['counters']['peak_memory_bytes'] > 0
+    assert 'Top memory allocations:' in lines
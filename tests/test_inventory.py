@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+
+import pytest
+
+import inventory
+from layer_record import LayerRecord
+
+
+@pytest.fixture
+def inv(tmp_path):
+    inv = inventory.Inventory(str(tmp_path / 'inventory.sqlite'))
+    yield inv
+    inv.close()
+
+
+def names(rows):
+    return sorted(row[2] for row in rows)
+
+
+def test_at_scale(inv, tmp_path):
+    inv.record(str(tmp_path / 'kort.map'), 'mapfile', [('Kort', [
+        LayerRecord(layer='fin', max_scale='-', min_scale=5000),
+        LayerRecord(layer='mellem', max_scale=5000, min_scale=25000),
+        LayerRecord(layer='grov', max_scale=25000, min_scale='N/A'),
+        LayerRecord(layer='altid', max_scale=0, min_scale=0)])])
+    assert names(inv.at_scale(1000)) == ['altid', 'fin']
+    assert names(inv.at_scale(5000)) == ['altid', 'mellem']
+    assert names(inv.at_scale(25000)) == ['altid', 'grov']
+    assert names(inv.at_scale(1e9)) == ['altid', 'grov']
+
+
+def test_open_bounds_of_old_inventories(tmp_path):
+    path = str(tmp_path / 'old.sqlite')
+    inventory.Inventory(path).close()
+    con = sqlite3.connect(path)
+    with con:
+        con.execute("INSERT INTO projects (id, path, tool, layers, updated) VALUES (1, 'gammel.map', 'mapfile', 1, 0)")
+        con.execute("INSERT INTO layers (project_id, layer, scale_from, scale_to) VALUES (1, 'aaben', NULL, NULL)")
+        con.execute('PRAGMA user_version = 0')
+    con.close()
+    inv = inventory.Inventory(path)
+    try:
+        assert names(inv.at_scale(50000)) == ['aaben']
+    finally:
+        inv.close()
+
+
+def test_at_scale_uses_the_index(inv):
+    plan = inv._con.execute('EXPLAIN QUERY PLAN SELECT layer FROM layers l WHERE l.scale_from <= ? AND l.scale_to > ?',
+                            (1000, 1000)).fetchall()
+    assert 'layers_scale' in ' '.join(str(row) for row in plan)
+
+
+def test_wildcards_taken_literally(inv, tmp_path):
+    inv.record(str(tmp_path / 'kort.map'), 'mapfile', [('Kort', [
+        LayerRecord(layer='a', data_path='vej.veje_2020', definition_query="pct = '10%'"),
+        LayerRecord(layer='b', data_path='vej.vejex2020', definition_query="pct = '10 procent'")])])
+    assert names(inv.find_source('veje_2020')) == ['a']
+    assert names(inv.find_query('10%')) == ['a']
+    assert names(inv.find_layer('_')) == ['a', 'b']  # layer and group names still take wildcards
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import os
+import socket
+import threading
+
+import pytest
+
+import job_server
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    paths = []
+    for n in range(4):
+        path = tmp_path / '{}.map'.format(n)
+        path.write_text(u'MAP END\n' * (n + 1))
+        paths.append(str(path))
+    return paths
+
+
+def run(pool, jobs):
+    return sorted((e for e in pool.run(jobs) if e['event'] == 'done'), key=lambda e: e['job'])
+
+
+def test_jobs_run_on_warm_workers(inputs):
+    with job_server.WorkerPool(2, 'stub') as pool:
+        done = run(pool, [(src, None, {}) for src in inputs])
+        done += run(pool, [(src, None, {}) for src in inputs])
+    assert [e['error'] for e in done] == [None] * 8
+    assert len(set(e['pid'] for e in done)) == 2
+    assert pool.started == 2
+    with open(done[1]['output']) as f:
+        assert f.read() == '{}\t{}\n'.format(inputs[1], 16)
+
+
+def test_crashed_job_reported(inputs):
+    with job_server.WorkerPool(2, 'stub') as pool:
+        done = run(pool, [(inputs[0], None, {'crash': True}), (inputs[1], None, {})])
+        assert done[0]['error'] == 'Worker crashed (exit code 3)'
+        assert done[1]['error'] is None
+        assert run(pool, [(inputs[2], None, {})])[0]['error'] is None
+    assert pool.started == 3
+
+
+def test_worker_died_while_idle(inputs):
+    with job_server.WorkerPool(1, 'stub') as pool:
+        run(pool, [(inputs[0], None, {})])
+        pool.workers[0].proc.kill()
+        pool.workers[0].proc.join()
+        done = run(pool, [(src, None, {}) for src in inputs])
+    assert [e['error'] for e in done] == [None] * 4
+    assert pool.started == 2
+
+
+def test_engine_that_fails_to_load(inputs):
+    with job_server.WorkerPool(2, 'no_such_module:run') as pool:
+        done = run(pool, [(src, None, {}) for src in inputs])
+    assert len(done) == 4
+    assert all(e['error'].startswith("Couldn't") for e in done)
+
+
+def test_mxd_rejected(tmp_path, inputs):
+    (tmp_path / 'old.mxd').write_text(u'')
+    assert job_server.expand_inputs([str(tmp_path)]) == inputs
+    with pytest.raises(ValueError, match='mxd'):
+        job_server.expand_inputs([str(tmp_path / 'old.mxd')])
+
+
+def test_serve_and_submit(inputs):
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        address = ('localhost', s.getsockname()[1])
+    key = b'test key'
+    server = threading.Thread(target=job_server.serve, args=(address, 1, 'stub', 50, key))
+    server.start()
+    try:
+        for _ in range(50):
+            try:
+                events = list(job_server.submit([(inputs[0], None, {})], address, key))
+                break
+            except ConnectionRefusedError:
+                server.join(0.1)
+        assert [e['error'] for e in events if e['event'] == 'done'] == [None]
+        assert os.path.isfile(events[-1]['output'])
+    finally:
+        job_server.stop(address, key)
+        server.join(10)
+    assert not server.is_alive()
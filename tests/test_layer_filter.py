@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import summarise_mapfile
+from layer_filter import LayerFilter
+
+# The layer's own scales (3000-50000) are outside the filter, but its first split scale interval (0-5000) isn't
+SPLIT_MAP = '''MAP
+  NAME "split"
+  LAYER
+    NAME "veje"
+    GROUP "vej"
+    STATUS ON
+    MINSCALEDENOM 3000
+    MAXSCALEDENOM 50000
+    DATA "geom from vej.veje_%s% using unique gid"
+    SCALETOKEN
+      NAME "%s%"
+      VALUES
+        "0" "detail"
+        "5000" "oversigt"
+      END
+    END
+  END
+  LAYER
+    NAME "stier"
+    STATUS OFF
+    MINSCALEDENOM 100000
+    DATA "geom from vej.stier using unique gid"
+  END
+END
+'''
+
+
+@pytest.fixture(autouse=True)
+def quiet(monkeypatch):
+    monkeypatch.setattr(summarise_mapfile, 'set_msg', lambda *args: None)
+
+
+@pytest.mark.parametrize('engine', ['fast', 'mappyfile'])
+def test_split_scale_filter_same_cold_and_warm(tmp_path, engine):
+    src = tmp_path / 'split.map'
+    src.write_text(SPLIT_MAP)
+    cache = str(tmp_path / 'cache.sqlite')
+    flt = LayerFilter.parse('scale=1000-2000')
+
+    def rows(layer_filter):
+        return [rec.to_list() for rec in summarise_mapfile.summarise_file(
+            str(src), split_scale_lyrs=True, engine=engine, cache=cache, layer_filter=layer_filter)]
+
+    cold = rows(flt)  # filtered runs aren't stored...
+    rows(None)  # ...whole ones are
+    warm = rows(flt)
+    assert cold == warm
+    assert [row[2] for row in cold] == ['veje']
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+import json
+import pickle
+
+import pytest
+
+from layer_record import KEYS, LayerRecord
+
+
+def test_slots():
+    rec = LayerRecord(layer='veje', max_scale=1000)
+    assert not hasattr(rec, '__dict__')
+    assert (rec.layer, rec.max_scale, rec.group) == ('veje', 1000, None)
+    with pytest.raises(AttributeError):
+        rec.colour = 'red'
+    with pytest.raises(TypeError, match='colour'):
+        LayerRecord(layer='veje', colour='red')
+
+
+def test_repeated_values_interned():
+    data_path = ''.join(['/data/', 'veje.shp'])  # not a literal, which would be interned anyway
+    a = LayerRecord(layer='a', data_path=data_path)
+    b = LayerRecord(layer='b')
+    b.data_path = ''.join(['/data/', 'veje', '.shp'])
+    assert a.data_path is b.data_path
+
+
+def test_round_trips():
+    rec = LayerRecord(layer=u'Søer', data_path='soer.shp', visible='True', max_scale=1000.0, features=3)
+    assert LayerRecord.from_list(json.loads(json.dumps(rec.to_list()))) == rec
+    assert pickle.loads(pickle.dumps(rec)) == rec
+    assert len(rec.to_list()) == len(KEYS)
+    assert rec.row(['max_scale', 'layer', 'group']) == [1000.0, u'Søer', None]
+
+
+def test_unhashable():
+    assert LayerRecord(layer='a') != LayerRecord(layer='b')
+    with pytest.raises(TypeError):
+        hash(LayerRecord(layer='a'))
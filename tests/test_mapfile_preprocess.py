@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import os
+import codecs
+
+import pytest
+
+import mapfile_preprocess
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    mapfile_preprocess.clear_fragment_cache()
+    yield
+    mapfile_preprocess.clear_fragment_cache()
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding='utf-8')
+    return str(path)
+
+
+def test_includes_relative_to_main_map_file(tmp_path):
+    write(tmp_path / 'inc' / 'layers.inc', 'LAYER NAME "a" END\nINCLUDE "inc/more.inc"\n')
+    write(tmp_path / 'inc' / 'more.inc', 'LAYER NAME "b" END\n')
+    src = write(tmp_path / 'main.map', 'MAP\n  INCLUDE "inc/layers.inc" # layers\nEND\n')
+    text = mapfile_preprocess.preprocess(src, drop_includes=False)
+    assert text.split() == 'MAP LAYER NAME "a" END LAYER NAME "b" END END'.split()
+
+
+def test_drop_includes_comments_them_out(tmp_path):
+    src = write(tmp_path / 'main.map', 'MAP\n  include "missing.inc"\nEND\n')
+    assert mapfile_preprocess.preprocess(src) == 'MAP\n  # include "missing.inc"\nEND\n'
+
+
+def test_include_cycle(tmp_path):
+    write(tmp_path / 'a.inc', 'INCLUDE "b.inc"\n')
+    write(tmp_path / 'b.inc', 'INCLUDE "a.inc"\n')
+    src = write(tmp_path / 'main.map', 'MAP\nINCLUDE "a.inc"\nEND\n')
+    with pytest.raises(mapfile_preprocess.IncludeError) as e:
+        mapfile_preprocess.preprocess(src, drop_includes=False)
+    assert 'Include cycle' in str(e.value)
+    assert str(e.value).endswith('a.inc')
+
+
+def test_self_include(tmp_path):
+    src = write(tmp_path / 'main.map', 'MAP\nINCLUDE "main.map"\nEND\n')
+    with pytest.raises(mapfile_preprocess.IncludeError, match='Include cycle'):
+        mapfile_preprocess.preprocess(src, drop_includes=False)
+
+
+def test_include_depth(tmp_path):
+    levels = mapfile_preprocess.MAX_INCLUDE_DEPTH
+    for n in range(levels + 1):
+        write(tmp_path / '{}.inc'.format(n), 'INCLUDE "{}.inc"\n'.format(n + 1))
+    write(tmp_path / '{}.inc'.format(levels - 1), 'LAYER END\n')
+    src = write(tmp_path / 'main.map', 'MAP\nINCLUDE "0.inc"\nEND\n')
+    assert 'LAYER END' in mapfile_preprocess.preprocess(src, drop_includes=False)  # just deep enough
+
+    write(tmp_path / '{}.inc'.format(levels - 1), 'INCLUDE "{}.inc"\n'.format(levels))
+    write(tmp_path / '{}.inc'.format(levels), 'LAYER END\n')
+    with pytest.raises(mapfile_preprocess.IncludeError, match='nested more than'):
+        mapfile_preprocess.preprocess(src, drop_includes=False)
+
+
+def test_missing_include_names_the_line(tmp_path):
+    src = write(tmp_path / 'main.map', 'MAP\n\nINCLUDE "missing.inc"\nEND\n')
+    with pytest.raises(mapfile_preprocess.IncludeError, match='line 3'):
+        mapfile_preprocess.preprocess(src, drop_includes=False)
+
+
+def test_fragments_read_once(tmp_path):
+    write(tmp_path / 'shared.inc', 'LAYER NAME "shared" END\n')
+    srcs = [write(tmp_path / '{}.map'.format(n), 'MAP\nINCLUDE "shared.inc"\nEND\n') for n in range(3)]
+    for src in srcs:
+        mapfile_preprocess.preprocess(src, drop_includes=False)
+    assert mapfile_preprocess.fragment_cache_info() == {'read': 1, 'reused': 2}
+
+
+def test_changed_fragment_read_again(tmp_path):
+    inc = write(tmp_path / 'shared.inc', 'LAYER NAME "old" END\n')
+    src = write(tmp_path / 'main.map', 'MAP\nINCLUDE "shared.inc"\nEND\n')
+    assert '"old"' in mapfile_preprocess.preprocess(src, drop_includes=False)
+    write(tmp_path / 'shared.inc', 'LAYER NAME "new" END\n')
+    mtime = os.path.getmtime(inc) + 10
+    os.utime(inc, (mtime, mtime))
+    assert '"new"' in mapfile_preprocess.preprocess(src, drop_includes=False)
+
+
+@pytest.mark.parametrize('bom, encoding', [(codecs.BOM_UTF8, 'utf-8'), (codecs.BOM_UTF16_LE, 'utf-16-le'),
+                                           (b'', 'latin-1')])
+def test_decode(bom, encoding):
+    assert mapfile_preprocess.decode(bom + u'NAME "Søer"'.encode(encoding)) == u'NAME "Søer"'
+
+
+def test_large_files_memory_mapped(tmp_path, monkeypatch):
+    monkeypatch.setattr(mapfile_preprocess, 'MMAP_THRESHOLD', 0)
+    src = str(tmp_path / 'main.map')
+    with open(src, 'wb') as f:
+        f.write(codecs.BOM_UTF8 + u'MAP NAME "Søer" END\n'.encode('utf-8'))
+    assert mapfile_preprocess.preprocess(src) == u'MAP NAME "Søer" END\n'
+
+
+def test_nothing_written_next_to_the_map_file(tmp_path):
+    write(tmp_path / 'layers.inc', 'LAYER END\n')
+    src = write(tmp_path / 'main.map', 'MAP\nINCLUDE "layers.inc"\nEND\n')
+    mapfile_preprocess.preprocess(src)
+    mapfile_preprocess.preprocess(src, drop_includes=False)
+    assert sorted(os.listdir(str(tmp_path))) == ['layers.inc', 'main.map']
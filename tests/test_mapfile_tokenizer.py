@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import mapfile_tokenizer
+import summarise_mapfile
+
+TRICKY = u'''MAP
+  NAME "tricky"
+  SYMBOLSET "symbols.sym"
+  SYMBOL
+    NAME "circle"
+    TYPE ELLIPSE
+    POINTS 1 1 END
+  END
+  SCALEBAR
+    STYLE 0
+    STATUS ON
+  END
+  WEB
+    VALIDATION
+      "aar" "^[0-9]{4}$"
+    END
+  END
+  LAYER
+    NAME "veje"
+    GROUP "Transport"
+    DATA "/data/vej/veje.shp"
+    STATUS ON
+    MAXSCALEDENOM 25000
+    CLASS
+      NAME "motorvej"
+      EXPRESSION /^(motor|hoved)vej$/
+      STYLE
+        SYMBOL circle
+        SIZE 4
+      END
+      LABEL
+        STYLE
+          GEOMTRANSFORM "labelpoly"
+        END
+      END
+    END
+    CLASS
+      EXPRESSION ([vejtype] ~ /sti(er)?/ AND [bredde] / 2 > 1)
+      STYLE
+        SYMBOL "circle"
+      END
+    END
+  END
+  LAYER
+    NAME "soer"
+    GROUP "Natur"
+    DATA "/data/natur/soer.shp"
+    STATUS OFF
+    MINSCALEDENOM 1000
+    FILTER /^s[oe]$/
+    CLASS
+      STYLE
+        SYMBOL 0
+      END
+    END
+  END
+END
+'''
+
+
+def records(text, engine):
+    return [rec.to_list() for rec in summarise_mapfile.get_lyr_stats('tricky.map', False, engine, text)]
+
+
+def test_same_as_mappyfile():
+    assert [lyr['name'] for lyr in mapfile_tokenizer.loads_layers(TRICKY)] == ['veje', 'soer']  # no fallback
+    assert records(TRICKY, 'fast') == records(TRICKY, 'mappyfile')
+
+
+def test_split_scale_same_as_mappyfile():
+    text = TRICKY.replace('DATA "/data/vej/veje.shp"', 'DATA "/data/vej/veje_%s%.shp"\n    SCALETOKEN\n'
+                          '      NAME "%s%"\n      VALUES\n        "0" "fin"\n        "5000" "grov"\n      END\n'
+                          '    END')
+    fast = summarise_mapfile.get_lyr_stats('tricky.map', True, 'fast', text)
+    slow = summarise_mapfile.get_lyr_stats('tricky.map', True, 'mappyfile', text)
+    assert [rec.to_list() for rec in fast] == [rec.to_list() for rec in slow]
+
+
+def test_unquoted_path_not_a_regex():
+    text = TRICKY.replace('DATA "/data/vej/veje.shp"', 'DATA /data/vej/veje.shp')
+    assert mapfile_tokenizer.loads_layers(text)[0]['data'] == '/data/vej/veje.shp'
+
+
+def test_regex_in_validation():
+    text = TRICKY.replace('"aar" "^[0-9]{4}$"', '"navn" /^[a-z "]+$/')
+    assert len(mapfile_tokenizer.loads_layers(text)) == 2
+
+
+def test_unquoted_symbol_in_style():
+    text = u'MAP\n  LAYER\n    NAME "a"\n    CLASS\n      STYLE\n        SYMBOL circle\n      END\n    END\n  END\n' \
+           u'  LAYER\n    NAME "b"\n  END\nEND\n'
+    assert [lyr['name'] for lyr in mapfile_tokenizer.loads_layers(text)] == ['a', 'b']
+    assert len(mapfile_tokenizer.layer_blocks(text)) == 2
+
+
+@pytest.mark.parametrize('text', [u'MAP\n  LAYER\n    NAME "a"\n  END\n', u'MAP\n  END\nEND\n',
+                                  u'MAP\n  LAYER\n    INCLUDE "a.inc"\n  END\nEND\n'])
+def test_unsupported(text):
+    with pytest.raises(mapfile_tokenizer.UnsupportedSyntax):
+        mapfile_tokenizer.loads_layers(text)
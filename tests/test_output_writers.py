@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import csv
+import json
+import subprocess
+import sys
+
+import pytest
+
+import output_writers
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Writes the test records as csv and jsonl, under either interpreter. The plain literals are str, i.e. UTF-8 bytes
+# in py2 (as from summarise_mxd), and the u'' ones unicode.
+WRITE_SCRIPT = r'''# -*- coding: utf-8 -*-
+import sys
+sys.path.insert(0, sys.argv[1])
+import output_writers
+from layer_record import LayerRecord
+
+records = [LayerRecord(layer=u'Vejmidter \xe6\xf8\xe5', data_path='N/A', visible='ON', max_scale='1000',
+                       min_scale='-', features=3),
+           LayerRecord(layer='Søer', data_path='c:\\data\\søer.shp', visible=False, transparency=u'N/A')]
+columns = [('layer', 'Layer'), ('data_path', 'Data path'), ('visible', 'Visibility'), ('transparency', 'Transparency'),
+           ('max_scale', 'Max. scale'), ('min_scale', 'Min. scale'), ('features', 'Features')]
+for ext in ('.csv', '.jsonl'):
+    output_writers.write_tables(sys.argv[2] + ext, columns, [('Kort', records)])
+'''
+
+
+def write_with(cmd, tmp_path, name):
+    script = tmp_path / 'write.py'
+    script.write_text(WRITE_SCRIPT, encoding='utf-8')
+    subprocess.check_call(cmd + [str(script), REPO, str(tmp_path / name)])
+    return str(tmp_path / name)
+
+
+def check_outputs(base):
+    with io.open(base + '.csv', encoding='utf-8', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert rows == [{'map': 'Kort', 'layer': u'Vejmidter æøå', 'data_path': '', 'features': '3', 'visible': 'True',
+                     'transparency': '', 'max_scale': '1000.0', 'min_scale': ''},
+                    {'map': 'Kort', 'layer': u'Søer', 'data_path': u'c:\\data\\søer.shp', 'features': '',
+                     'visible': 'False', 'transparency': '', 'max_scale': '', 'min_scale': ''}]
+    with io.open(base + '.jsonl', encoding='utf-8') as f:
+        lines = [json.loads(line) for line in f]
+    assert lines[0] == {'map': 'Kort', 'layer': u'Vejmidter æøå', 'data_path': None, 'visible': True,
+                        'transparency': None, 'max_scale': 1000.0, 'min_scale': None, 'features': 3}
+    assert lines[1]['layer'] == u'Søer' and lines[1]['visible'] is False
+
+
+def test_writers_py3(tmp_path):
+    check_outputs(write_with([sys.executable], tmp_path, 'py3'))
+
+
+def test_writers_py2_same_as_py3(tmp_path, python2):
+    py2 = write_with(python2, tmp_path, 'py2')
+    py3 = write_with([sys.executable], tmp_path, 'py3')
+    check_outputs(py2)
+    for ext in ('.csv', '.jsonl'):
+        with io.open(py2 + ext, 'rb') as f2, io.open(py3 + ext, 'rb') as f3:
+            assert f2.read() == f3.read()
+
+
+@pytest.mark.parametrize('ext', ['.csv', '.jsonl', '.xlsx'])
+def test_no_tables_no_file(tmp_path, capsys, ext):
+    path = str(tmp_path / ('empty' + ext))
+    assert output_writers.write_tables(path, [('layer', 'Layer')], []) is False
+    assert not os.path.exists(path)
+    assert capsys.readouterr().out == ''  # left to the caller's set_msg
+    assert output_writers.write_tables(path, [('layer', 'Layer')], [(None, [])]) is True
+    assert os.path.exists(path)
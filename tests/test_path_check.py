@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import path_check
+
+
+def test_each_source_checked_once():
+    checked = []
+    lock = threading.Lock()
+
+    def check(src):
+        with lock:
+            checked.append(src)
+        return src.strip().endswith('.shp')
+
+    sources = ['a.shp', ' a.shp', 'b.gdb', '', 'a.shp']
+    statuses = path_check.check_sources(sources, check)
+    assert len(checked) == 2
+    assert statuses == {'a.shp': path_check.OK, ' a.shp': path_check.OK, 'b.gdb': path_check.MISSING}
+
+
+def test_errors_and_timeouts():
+    release = threading.Event()
+
+    def check(src):
+        if src == 'hangs':
+            release.wait(5)
+        if src == 'fails':
+            raise RuntimeError(src)
+        return True
+
+    try:
+        statuses = path_check.check_sources(['ok', 'fails', 'hangs'], check, timeout=0.2)
+    finally:
+        release.set()
+    assert statuses == {'ok': path_check.OK, 'fails': path_check.ERROR, 'hangs': path_check.TIMEOUT}
+
+
+def test_checks_run_concurrently():
+    started = threading.Barrier(4, timeout=5)
+    statuses = path_check.check_sources(['a', 'b', 'c', 'd'], lambda src: started.wait() is not None,
+                                        max_workers=4)
+    assert set(statuses.values()) == {path_check.OK}
+
+
+def test_progress():
+    reports = []
+    path_check.check_sources(['a', 'b', 'c'], lambda src: True, progress=lambda *args: reports.append(args))
+    assert reports[-1] == (3, 3)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import random
+import threading
+
+import pytest
+
+import pipeline
+import summarise_mapfile
+
+
+def slow_double(n):
+    time.sleep(random.random() / 100)
+    return n * 2
+
+
+def fail_on_six(n):
+    if n == 6:
+        raise ValueError('six')
+    return n
+
+
+def test_results_in_input_order():
+    stages = [pipeline.Stage('double', slow_double, 4), pipeline.Stage('check', fail_on_six, 2)]
+    results = list(pipeline.run(range(10), stages, depth=2))
+    assert [item for (item, value, error) in results] == list(range(10))
+    assert [value for (item, value, error) in results if error is None] == [0, 2, 4, 8, 10, 12, 14, 16, 18]
+    assert [str(error) for (item, value, error) in results if error is not None] == ['six']
+
+
+def test_bounded_in_flight():
+    fed = []
+    lock = threading.Lock()
+    state = {'in_flight': 0, 'max': 0}
+
+    def items():
+        for n in range(50):
+            with lock:
+                fed.append(n)
+                state['in_flight'] += 1
+                state['max'] = max(state['max'], state['in_flight'])
+            yield n
+
+    for (item, value, error) in pipeline.run(items(), [pipeline.Stage('double', slow_double, 2)], depth=1,
+                                             max_in_flight=3):
+        with lock:
+            state['in_flight'] -= 1
+    assert len(fed) == 50
+    assert state['max'] <= 3 + 1  # and the one the feed holds while it waits for a slot
+
+
+def test_stops_early():
+    consumed = []
+    for (item, value, error) in pipeline.run(iter(range(1000)), [pipeline.Stage('double', slow_double, 2)]):
+        consumed.append(value)
+        if len(consumed) == 3:
+            break
+    assert consumed == [0, 2, 4]
+    assert not [t for t in threading.enumerate() if t.name.startswith('pipeline')]
+
+
+def test_process_stage():
+    results = list(pipeline.run(range(5), [pipeline.Stage('double', slow_double, 2, processes=True)]))
+    assert [value for (item, value, error) in results] == [0, 2, 4, 6, 8]
+
+
+def test_parse_workers():
+    assert pipeline.parse_workers(True, 3) == [None, None, None]
+    assert pipeline.parse_workers('4,,2', 3) == [4, None, 2]
+    assert pipeline.parse_workers('4', 3) == [4, None, None]
+    with pytest.raises(ValueError):
+        pipeline.parse_workers('1,2,3,4', 3)
+
+
+def test_pipelined_batch_same_as_pool(tmp_path):
+    folder = tmp_path / 'maps'
+    folder.mkdir()
+    for n in range(6):
+        (folder / '{}.map'.format(n)).write_text(
+            u'MAP\n  LAYER\n    NAME "l{0}"\n    DATA "d{0}.shp"\n  END\nEND\n'.format(n))
+    (folder / 'broken.map').write_text(u'MAP\n  LAYER\n')
+    outputs = []
+    for pipelined in (False, True):
+        out = str(tmp_path / 'out_{}.csv'.format(pipelined))
+        failures = summarise_mapfile.main_batch(str(folder), out, combined=True, engine='fast', cache=False,
+                                                max_workers=2, pipelined=pipelined, stage_workers=[2, 2, 1],
+                                                queue_depth=1)
+        assert [os.path.basename(src) for (src, e) in failures] == ['broken.map']
+        with open(out) as f:
+            outputs.append(f.read())
+    assert outputs[0] == outputs[1]
+    assert outputs[0].count(',l5,') == 1
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+import instrument
+import path_check
+import result_cache
+import summarise_aprx
+import summarise_mapfile
+from benchmarks import generate
+
+MAP = '''MAP
+  NAME "test"
+  INCLUDE "layers.inc"
+  LAYER
+    NAME "veje"
+    TYPE LINE
+    DATA "veje.shp"
+  END
+END
+'''
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / 'results.sqlite')
+
+
+def summarise(src, cache_path, **kwargs):
+    kwargs.setdefault('drop_includes', False)
+    instrument.reset()
+    lyr_stats = summarise_mapfile.summarise_file(src, cache=cache_path, engine='fast', **kwargs)
+    return ([rec.layer for rec in lyr_stats], instrument.snapshot()['counters'].get('cache_hits', 0))
+
+
+def test_key_depends_on_content_and_options():
+    key = result_cache.ResultCache.key
+    assert key('abc', tool='mapfile', split_scale_lyrs=False) == key('abc', split_scale_lyrs=False, tool='mapfile')
+    assert key('abc', tool='mapfile', split_scale_lyrs=False) != key('abd', tool='mapfile', split_scale_lyrs=False)
+    assert key('abc', tool='mapfile', split_scale_lyrs=False) != key('abc', tool='mapfile', split_scale_lyrs=True)
+
+
+def test_get_put(cache_path):
+    cache = result_cache.ResultCache(cache_path)
+    assert cache.get('k') is None
+    cache.put('k', [['a', 1]])
+    cache.put_many({'l': [], 'm': [['b']]})
+    assert cache.get('k') == [['a', 1]]
+    assert cache.get_many(['k', 'm', 'n']) == {'k': [['a', 1]], 'm': [['b']]}
+    cache.close()
+
+
+def test_least_recently_used_evicted(cache_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, 'time', lambda: now[0])
+    cache = result_cache.ResultCache(cache_path, max_bytes=30)
+    for key in ('a', 'b', 'c'):
+        now[0] += 1
+        cache.put(key, 'x' * 8)  # 10 bytes of JSON each
+    now[0] += 1
+    cache.get('a')
+    now[0] += 1
+    cache.put('d', 'x' * 8)
+    assert sorted(cache.get_many('abcd')) == ['a', 'c', 'd']
+    cache.close()
+
+
+def test_changed_map_file_parsed_again(tmp_path, cache_path):
+    (tmp_path / 'layers.inc').write_text(u'LAYER NAME "soer" TYPE POLYGON END\n')
+    src = tmp_path / 'test.map'
+    src.write_text(MAP)
+    assert summarise(str(src), cache_path) == (['soer', 'veje'], 0)
+    assert summarise(str(src), cache_path) == (['soer', 'veje'], 1)
+
+    src.write_text(MAP.replace('"veje"', '"vejmidter"'))
+    assert summarise(str(src), cache_path) == (['soer', 'vejmidter'], 0)
+    assert summarise(str(src), cache_path, split_scale_lyrs=True) == (['soer', 'vejmidter'], 0)
+
+
+def test_changed_include_parsed_again(tmp_path, cache_path):
+    inc = tmp_path / 'layers.inc'
+    inc.write_text(u'LAYER NAME "soer" TYPE POLYGON END\n')
+    src = tmp_path / 'test.map'
+    src.write_text(MAP)
+    assert summarise(str(src), cache_path) == (['soer', 'veje'], 0)
+    inc.write_text(u'LAYER NAME "vandloeb" TYPE LINE END\n')
+    mtime = os.path.getmtime(str(inc)) + 10  # the fragment cache goes by the modification time
+    os.utime(str(inc), (mtime, mtime))
+    assert summarise(str(src), cache_path) == (['vandloeb', 'veje'], 0)
+    assert summarise(str(src), cache_path, drop_includes=True) == (['veje'], 0)
+
+
+def test_data_ok_checked_anew(tmp_path, cache_path, monkeypatch):
+    aprx = generate.make_aprx(str(tmp_path / 'test.aprx'), maps=1, layers=3, groups=1)
+    existing = set()
+    monkeypatch.setattr(summarise_aprx, 'data_exists', lambda src: src in existing)
+
+    def data_ok():
+        maps = summarise_aprx.get_map_stats(aprx, check_paths=True, cache=cache_path, engine='cim')
+        return dict((rec.layer, rec.data_ok) for rec in maps['Map 0'] if rec.data_ok != '-')
+
+    assert set(data_ok().values()) == {path_check.MISSING}
+    existing.update(rec.data_path for rec in summarise_aprx.get_map_stats(aprx, cache=cache_path)['Map 0'])
+    assert set(data_ok().values()) == {path_check.OK}  # from the cache, but checked again
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import csv
+import random
+
+import pytest
+
+import scale_index
+import summarise_mapfile
+from layer_record import LayerRecord
+
+INF = scale_index.INF
+
+
+def test_boundaries():
+    index = scale_index.ScaleIndex([(1000, 5000, 'a'), (5000, 25000, 'b'), (0, 1000, 'c'), (25000, INF, 'd')])
+    for (scale, active) in [(0, ['c']), (999, ['c']), (1000, ['a']), (4999.5, ['a']), (5000, ['b']),
+                            (24999, ['b']), (25000, ['d']), (1e9, ['d'])]:
+        assert sorted(index.at(scale)) == active, scale
+        assert index.count_at(scale) == len(active), scale
+
+
+def test_empty_ranges_left_out():
+    index = scale_index.ScaleIndex([(1000, 1000, 'empty'), (5000, 1000, 'reversed'), (0, INF, 'all')])
+    assert len(index) == 1
+    assert index.at(1000) == ['all']
+
+
+def test_same_as_brute_force():
+    rnd = random.Random(7)
+    ends = [0, 500, 1000, 2500, 5000, 10000, 25000, 50000, INF]
+    items = []
+    for n in range(300):
+        (lo, hi) = sorted(rnd.sample(ends, 2))
+        items.append((lo, hi, n))
+    index = scale_index.ScaleIndex(items)
+    for scale in ends[:-1] + [1, 499, 501, 9999.9, 1e7]:
+        expected = sorted(n for (lo, hi, n) in items if lo <= scale < hi)
+        assert sorted(index.at(scale)) == expected
+        assert index.count_at(scale) == len(expected)
+
+
+def test_scale_range():
+    assert scale_index.scale_range(LayerRecord(max_scale=1000.0, min_scale='50000')) == (1000.0, 50000.0)
+    assert scale_index.scale_range(LayerRecord(max_scale='-', min_scale=0)) == (0.0, INF)
+    assert scale_index.parse_scales('1:25000, 1000') == [1000.0, 25000.0]
+
+
+def test_zoom_report():
+    records = [LayerRecord(layer='g', data_path='[group layer]'),
+               LayerRecord(layer='a', data_path='veje.shp', visible='True', min_scale=5000),
+               LayerRecord(layer='b', data_path='veje.shp', visible='False', max_scale=1000),
+               LayerRecord(layer='c', data_path='N/A', visible='True', max_scale=5000)]
+    assert scale_index.zoom_report([('Kort', records)], [500, 1000, 5000]) == [
+        ['Kort', 500, 1, 1, 1], ['Kort', 1000, 2, 1, 1], ['Kort', 5000, 2, 1, 1]]
+
+
+MAP = u'''MAP
+  LAYER
+    NAME "l{0}"
+    DATA "d{0}.shp"
+    MAXSCALEDENOM 10000
+  END
+END
+'''
+
+
+def read_csv(path):
+    with io.open(str(path), encoding='utf-8', newline='') as f:
+        return list(csv.reader(f))[1:]
+
+
+@pytest.mark.parametrize('pipelined', [False, True])
+def test_batch_zoom_reports(tmp_path, pipelined):
+    folder = tmp_path / 'maps'
+    folder.mkdir()
+    for n in range(3):
+        (folder / '{}.map'.format(n)).write_text(MAP.format(n))
+    kwargs = dict(engine='fast', cache=False, max_workers=2, pipelined=pipelined, zoom_scales=[1000.0, 25000.0])
+
+    out = tmp_path / 'per_file'
+    summarise_mapfile.main_batch(str(folder), str(out), out_format='.csv', **kwargs)
+    assert sorted(os.listdir(str(out))) == ['0.csv', '0_zoom.csv', '1.csv', '1_zoom.csv', '2.csv', '2_zoom.csv']
+    assert read_csv(out / '2_zoom.csv') == [['-', '1000.0', '1', '0', '1'], ['-', '25000.0', '0', '0', '0']]
+
+    summarise_mapfile.main_batch(str(folder), str(tmp_path / 'all.csv'), combined=True, **kwargs)
+    rows = read_csv(tmp_path / 'all_zoom.csv')
+    assert [(os.path.basename(row[0]), row[1], row[2]) for row in rows] == [
+        ('0.map', '1000.0', '1'), ('0.map', '25000.0', '0'), ('1.map', '1000.0', '1'), ('1.map', '25000.0', '0'),
+        ('2.map', '1000.0', '1'), ('2.map', '25000.0', '0')]
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import scale_tokens
+import summarise_mapfile
+
+LVL = {'name': '%lvl%', 'values': {'0': 'fine', '25000': 'coarse using unique id'}}
+SRC = {'name': '%src%', 'values': {'0': 'a', '10000': 'b', '25000': 'c'}}
+LVL2 = {'name': '%lvl2%', 'values': {'0': 'x'}}
+
+
+def test_summarise():
+    tokens = scale_tokens.compile_tokens([LVL, LVL2])
+    assert tokens.summarise('veje_%lvl% veje_%lvl2%') == 'veje_[fine;coarse] veje_[x]'
+
+
+def test_expand_one_token():
+    tokens = scale_tokens.compile_tokens([LVL])
+    assert list(tokens.expand('veje_%lvl%')) == [(0, 24999, 'veje_fine'), (25000, '-', 'veje_coarse')]
+    assert list(tokens.expand('veje')) == []
+
+
+def test_expand_several_tokens_at_all_their_scales():
+    tokens = scale_tokens.compile_tokens([LVL, SRC])
+    assert list(tokens.expand('%src%.veje_%lvl%')) == [(0, 9999, 'a.veje_fine'), (10000, 24999, 'b.veje_fine'),
+                                                       (25000, '-', 'c.veje_coarse')]
+
+
+def test_token_without_a_value_yet():
+    tokens = scale_tokens.compile_tokens([{'name': '%src%', 'values': {'10000': 'b'}}, LVL])
+    assert list(tokens.expand('%src%.veje_%lvl%'))[:2] == [(0, 9999, '%src%.veje_fine'),
+                                                            (10000, 24999, 'b.veje_fine')]
+
+
+def test_memoised():
+    assert scale_tokens.compile_tokens([LVL]) is scale_tokens.compile_tokens([dict(LVL)])
+    assert not scale_tokens.compile_tokens([])
+
+
+MAP = '''MAP
+  LAYER
+    NAME "multi"
+    DATA "geom from (select * from s_%a%.t_%b%) as foo using unique id"
+    SCALETOKEN
+      NAME "%a%"
+      VALUES
+        "0" "x"
+        "10000" "y using z"
+      END
+    END
+    SCALETOKEN
+      NAME "%b%"
+      VALUES
+        "0" "1"
+        "5000" "2"
+        "20000" "3"
+      END
+    END
+  END
+END
+'''
+
+
+@pytest.mark.parametrize('engine', ['fast', 'mappyfile'])
+def test_split_scale_lyrs(tmp_path, engine):
+    src = tmp_path / 'tok.map'
+    src.write_text(MAP)
+    lyr_stats = summarise_mapfile.get_lyr_stats(str(src), True, engine, MAP)
+    assert [(rec.max_scale, rec.min_scale, rec.data_path) for rec in lyr_stats] == [
+        (0, 4999, 'geom from (select * from s_x.t_1) as foo'),
+        (5000, 9999, 'geom from (select * from s_x.t_2) as foo'),
+        (10000, 19999, 'geom from (select * from s_y.t_2) as foo'),
+        (20000, '-', 'geom from (select * from s_y.t_3) as foo')]
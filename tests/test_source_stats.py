@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+import os
+import struct
+
+import source_stats
+import summarise_mapfile
+
+
+def write_shapefile(base, features, bbox=(500000.0, 6100000.0, 510000.0, 6110000.0)):
+    """A shape file header (no records) with the count in the .shx."""
+    header = struct.pack('>i', 9994) + b'\0' * 20 + struct.pack('>i', 50) + struct.pack('<2i', 1000, 1)
+    with open(base + '.shp', 'wb') as f:
+        f.write(header + struct.pack('<4d', *bbox) + b'\0' * 32)
+    with open(base + '.shx', 'wb') as f:
+        f.write(header[:24] + struct.pack('>i', 50 + features * 4) + b'\0' * 72)
+
+
+def test_shapefile_stats(tmp_path):
+    base = str(tmp_path / 'veje')
+    write_shapefile(base, 12)
+    assert source_stats.shapefile_stats(base + '.shp') == (12, '500000.0, 6100000.0, 510000.0, 6110000.0', 200)
+
+
+def test_sidecar_change_not_cached(tmp_path):
+    base = str(tmp_path / 'veje')
+    src = (base + '.shp', None)
+    cache = str(tmp_path / 'cache.sqlite')
+    write_shapefile(base, 12)
+    assert source_stats.get_stats([src], cache)[src][0] == 12
+    st = os.stat(base + '.shp')
+    write_shapefile(base, 7)  # the same .shp, only the .shx changed
+    os.utime(base + '.shp', (st.st_atime, st.st_mtime))
+    os.utime(base + '.shx', (st.st_atime, st.st_mtime + 10))
+    assert source_stats.get_stats([src], cache)[src][0] == 7
+
+
+def test_shapepath_from_include(tmp_path):
+    (tmp_path / 'data').mkdir()
+    write_shapefile(str(tmp_path / 'data' / 'veje'), 3)
+    (tmp_path / 'paths.inc').write_text(u'SHAPEPATH "data"\n')
+    src = tmp_path / 'kort.map'
+    src.write_text(u'MAP\n  INCLUDE "paths.inc"\n  LAYER\n    NAME "veje"\n    DATA "veje"\n  END\nEND\n')
+    recs = summarise_mapfile.summarise_file(str(src), drop_includes=False, engine='fast', cache=False,
+                                            data_stats=True)
+    assert [(rec.layer, rec.features) for rec in recs] == [('veje', 3)]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import csv
+import sys
+import subprocess
+
+import pytest
+
+import summarise
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAP = '''MAP
+  LAYER
+    NAME "veje"
+    TYPE LINE
+    DATA "veje.shp"
+  END
+END
+'''
+
+
+def test_get_engine(tmp_path):
+    assert summarise.get_engine('x.MAP') is summarise._run_mapfile
+    assert summarise.get_engine('x.aprx') is summarise._run_aprx
+    assert summarise.get_engine('x.mxd') is summarise._run_mxd
+    assert summarise.get_engine(str(tmp_path)) is summarise._run_mapfile
+    assert summarise.get_engine('maps/*.map') is summarise._run_mapfile
+    with pytest.raises(ValueError, match='.qgs'):
+        summarise.get_engine('x.qgs')
+
+
+def test_default_output():
+    assert summarise.default_output(os.path.join('data', 'x.map')) == os.path.join('data', 'x.xlsx')
+    assert summarise.default_output(os.path.join('data', 'x.map'), diff=True) == os.path.join('data', 'x_diff.xlsx')
+    assert summarise.default_output('maps/*.map') == 'summary.xlsx'
+    assert summarise.default_output('maps/*.map', per_file=True) == 'summary'
+
+
+def test_imports_lazily():
+    code = ('import sys, summarise; summarise.make_parser(); '
+            'print(sorted(m for m in ("arcpy", "mappyfile", "xlsxwriter", "summarise_mapfile") if m in sys.modules))')
+    assert subprocess.check_output([sys.executable, '-c', code], cwd=REPO).strip() == b'[]'
+
+
+def test_main_map_file(tmp_path, monkeypatch):
+    monkeypatch.setenv('SUMMARISE_CACHE', str(tmp_path / 'cache.sqlite'))
+    src = tmp_path / 'test.map'
+    src.write_text(MAP)
+    out = tmp_path / 'test.csv'
+    summarise.main([str(src), str(out), '--fast'])
+    with io.open(str(out), encoding='utf-8', newline='') as f:
+        assert [row['layer'] for row in csv.DictReader(f)] == ['veje']
+
+
+def test_main_rejects_unknown_input():
+    with pytest.raises(SystemExit, match="Don't know how to summarise .qgs files"):
+        summarise.main(['x.qgs'])
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import csv
+
+import pytest
+
+import layer_filter
+import watch
+
+MAP = u'''MAP
+  LAYER
+    NAME "{0}"
+    GROUP "{1}"
+    DATA "{0}.shp"
+    MAXSCALEDENOM 10000
+  END
+END
+'''
+
+
+class Clock(object):
+    """time.time and time.sleep for watch, with the files changed between rounds by on_sleep."""
+    def __init__(self, on_sleep=None):
+        self.now = 1000.0
+        self.on_sleep = on_sleep
+        self.sleeps = 0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.now += secs
+        self.sleeps += 1
+        if self.on_sleep:
+            self.on_sleep(self.sleeps)
+
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path / 'maps'
+    folder.mkdir()
+    (folder / 'a.map').write_text(MAP.format('veje', 'Transport'))
+    (folder / 'b.map').write_text(MAP.format('soer', 'Natur'))
+    return folder
+
+
+def read_csv(path):
+    with io.open(str(path), encoding='utf-8', newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def test_columns():
+    assert len(watch.COLUMNS) == len(watch.WIDTHS)
+    assert 'vis_classes' in [k for (k, heading) in watch.COLUMNS]
+
+
+def test_written_once_settled(folder, tmp_path, monkeypatch):
+    monkeypatch.setattr(watch, 'time', Clock())
+    out = tmp_path / 'overview.csv'
+    watch.watch(str(folder), str(out), interval=2.0, engine='fast', cache=False, rounds=2)
+    assert sorted(row['layer'] for row in read_csv(out)) == ['soer', 'veje']
+
+
+def test_file_that_keeps_changing(folder, tmp_path, monkeypatch):
+    def on_sleep(n):
+        if n > 2:  # a.map is saved every round from the third on
+            (folder / 'a.map').write_text(MAP.format('veje', 'Transport') + u'#' * n)
+        if n == 3:
+            (folder / 'b.map').write_text(MAP.format('soer', 'Vand'))
+
+    monkeypatch.setattr(watch, 'time', Clock(on_sleep))
+    out = tmp_path / 'overview.csv'
+    watch.watch(str(folder), str(out), interval=2.0, engine='fast', cache=False, rounds=30, max_delay=10.0)
+    rows = dict((row['layer'], row) for row in read_csv(out))
+    assert rows['soer']['group'] == 'Vand'
+
+
+def test_options_passed_on(folder, tmp_path, monkeypatch):
+    monkeypatch.setattr(watch, 'time', Clock())
+    out = tmp_path / 'overview.csv'
+    watch.watch(str(folder), str(out), engine='fast', cache=False, rounds=2,
+                layer_filter=layer_filter.LayerFilter.parse('group=Natur'), zoom_scales=[1000.0, 25000.0],
+                check_tables='sqlite:' + str(tmp_path))
+    rows = read_csv(out)
+    assert [row['layer'] for row in rows] == ['soer']
+    assert 'data_ok' in rows[0]
+    assert len(read_csv(tmp_path / 'overview_zoom.csv')) == 4  # 2 files x 2 scales
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+Watch mode: keep one summary of all the map files (and optionally aprx files) in a folder up to date while they're
+being edited.
+
+The folder is polled every interval seconds. A changed file is only summarised again once it's stopped changing for
+debounce seconds, so a burst of saves gives one update, and the output is written once no file is waiting to settle.
+A file that keeps changing is summarised (and the output written) at least every max_delay seconds all the same.
+The layer stats of all files are kept in memory, so only the changed files are read again (incrementally, for map
+files), and the output is written to a temporary file that then replaces the old one, so whoever has it open never
+sees half a file. If the output can't be replaced (e.g. it's open in Excel on Windows), it's tried again on the next
+round.
+
+Included files aren't watched, only the .map (and .aprx) files themselves.
+"""
+import os
+import glob
+import time
+import collections
+
+import output_writers
+import summarise_mapfile
+import scale_index
+import inventory as inventory_store
+import instrument
+
+
+def set_msg(msg, severity=0):  # placeholder
+    print(msg)
+
+
+# (layer record key, heading) of the output columns, with the aprx columns after the map file ones
+COLUMNS = ([('source_file', 'File'), ('map', 'Map')] + summarise_mapfile.COLUMNS +
+           [('transparency', 'Transparency'), ('vis_attributes', 'Visualisation attributes'),
+            ('vis_classes', 'Visualisation classes'), ('definition_query', 'Definition query')])
+WIDTHS = [40, 20, 20, 30, 70, 10, 10, 10, 50, 20, 20, 20, 20, 20, 10, 40, 40, 50]
+DEFAULT_MAX_DELAY = 30.0
+
+
+def watch(folder, outfile_path, include_aprx=False, interval=2.0, debounce=1.0, split_scale_lyrs=False,
+          drop_includes=True, engine='mappyfile', cache=True, rounds=None, max_delay=DEFAULT_MAX_DELAY,
+          inventory=None, check_tables=False, layer_filter=None, zoom_scales=None):
+    """Summarise the .map (and with include_aprx the .aprx) files in folder (a directory or a glob) to outfile_path,
+    and keep it up to date as they change, until interrupted (or for the given number of polling rounds).
+
+    inventory, check_tables (map files only) and layer_filter are as for summarise_mapfile.summarise_file, and with
+    zoom_scales a zoom report with rows per file is written next to the output each time it's written.
+    """
+    opts = dict(split_scale_lyrs=split_scale_lyrs, drop_includes=drop_includes, engine=engine, cache=cache,
+                inventory=inventory, check_tables=check_tables, layer_filter=layer_filter)
+    columns = COLUMNS
+    widths = WIDTHS
+    if check_tables:
+        n = [k for (k, heading) in COLUMNS].index('data_path') + 1
+        columns = columns[:n] + [('data_ok', 'Data OK?')] + columns[n:]
+        widths = widths[:n] + [20] + widths[n:]
+    out_path = output_writers.output_path(outfile_path)
+    if os.path.dirname(out_path) and not os.path.isdir(os.path.dirname(out_path)):
+        os.makedirs(os.path.dirname(out_path))
+    results = collections.OrderedDict()  # path -> list of LayerRecords
+    seen = {}  # path -> (mtime, size) when it was last summarised
+    pending = {}  # path -> [time it was first seen changing, time it was last seen changing]
+    last = {}  # path -> (mtime, size) at the last poll
+    dirty_since = time.time()  # when the output first needed writing, None if it's up to date
+
+    set_msg("Watching {} for changes to {}, Ctrl+C to stop...".format(folder, out_path))
+    n = 0
+    try:
+        while rounds is None or n < rounds:
+            n += 1
+            now = time.time()
+            current = scan(folder, include_aprx)
+            for (path, sig) in current.items():
+                if sig != seen.get(path) and sig != last.get(path):
+                    pending.setdefault(path, [now, now])[1] = now  # (still) changing, wait for it to settle
+            for path in list(results):
+                if path not in current:
+                    set_msg("  {} removed.".format(path))
+                    del results[path]
+                    seen.pop(path, None)
+                    dirty_since = dirty_since or now
+            last = current
+
+            for (path, (first, changed)) in list(pending.items()):
+                if path not in current:
+                    del pending[path]
+                elif now - changed >= debounce or now - first >= max_delay:
+                    del pending[path]
+                    if _update(path, results, opts):
+                        seen[path] = current[path]
+                        dirty_since = dirty_since or now
+
+            if dirty_since and (not pending or now - dirty_since >= max_delay):
+                if write_atomic(results, out_path, columns, widths):
+                    dirty_since = None
+                    if zoom_scales:
+                        with instrument.span('zoom report'):
+                            scale_index.write_report(results.items(), out_path, zoom_scales)
+            if rounds is None or n < rounds:
+                time.sleep(interval)
+    except KeyboardInterrupt:
+        set_msg("Stopped watching.")
+    return results
+
+
+def scan(folder, include_aprx=False):
+    """The (mtime, size) of the files to summarise."""
+    patterns = ['*.map'] + (['*.aprx'] if include_aprx else [])
+    if os.path.isdir(folder):
+        paths = [p for pat in patterns for p in glob.glob(os.path.join(folder, pat))]
+    else:
+        exts = tuple(pat[1:] for pat in patterns)
+        paths = [p for p in glob.glob(folder, recursive=True) if p.lower().endswith(exts)]
+    sigs = {}
+    for path in sorted(paths):
+        try:
+            st = os.stat(path)
+        except OSError:  # deleted since the glob
+            continue
+        sigs[path] = (st.st_mtime, st.st_size)
+    return sigs
+
+
+def _update(path, results, opts):
+    """Summarise one file into results. If it fails (e.g. it's saved half way), the previous stats are kept."""
+    set_msg("  Summarising {}...".format(path))
+    try:
+        with instrument.span('watch update'):
+            if path.lower().endswith('.aprx'):
+                import summarise_aprx
+                lyr_stats = []
+                map_dic = summarise_aprx.get_map_stats(path, cache=opts['cache'], layer_filter=opts['layer_filter'])
+                if opts['inventory'] and not opts['layer_filter']:  # as summarise_file does for map files
+                    inventory_store.record(opts['inventory'], path, 'aprx', map_dic.items())
+                for (map_name, records) in map_dic.items():
+                    for rec in records:
+                        rec.map = map_name
+                        lyr_stats.append(rec)
+            else:
+                lyr_stats = summarise_mapfile.summarise_file(path, incremental=True, **opts)
+    except Exception as e:
+        set_msg("  Failed to summarise {}, keeping the previous stats: {}".format(path, e), 30)
+        return False
+    for rec in lyr_stats:
+        rec.source_file = path
+    results[path] = lyr_stats
+    return True
+
+
+def write_atomic(results, out_path, columns=COLUMNS, widths=WIDTHS):
+    """Write the stats of all files to a temporary file next to out_path, and replace out_path with it.
+    Returns False if out_path couldn't be replaced."""
+    (base, ext) = os.path.splitext(out_path)
+    tmp_path = '{}.partial{}'.format(base, ext)  # same extension, for the writer
+    records = (rec for lyr_stats in results.values() for rec in lyr_stats)
+    try:
+        with instrument.span('write'):
+            output_writers.write_tables(tmp_path, columns, [(None, records)], {'widths': widths})
+        os.replace(tmp_path, out_path)
+    except Exception as e:  # OSError, or e.g. xlsxwriter's FileCreateError
+        set_msg("  Couldn't write {} ({}), will try again.".format(out_path, e), 30)
+        return False
+    set_msg("  {} updated, {} files, {} layers.".format(out_path, len(results),
+                                                       sum(len(r) for r in results.values())))
+    return True